@@ -0,0 +1,47 @@
+from functools import reduce
+from operator import or_
+
+from migen import *
+
+# K2MM (LiteEth user stream) fields that do not cross the link
+_local_fields = {"src_port", "dst_port", "ip_address", "length"}
+
+def last_be_to_keep(last_be, last):
+    """ One-hot last valid byte -> contiguous byte enables (all bytes when
+    not the last beat, or when no byte is flagged) """
+    n = len(last_be)
+    keep = [reduce(or_, [last_be[j] for j in range(i, n)]) for i in range(n)]
+    return Mux(last & (last_be != 0), Cat(*keep), Replicate(1, n))
+
+def keep_to_last_be(keep, last):
+    """ Contiguous byte enables -> one-hot last valid byte (0 unless last) """
+    n = len(keep)
+    last_be = [keep[i] & ~keep[i + 1] for i in range(n - 1)] + [keep[n - 1]]
+    return Mux(last, Cat(*last_be), 0)
+
+def k2mm_to_link(source, sink):
+    """ Connect a K2MM `source_packet_tx` to an Aurora/Kyokko `sink_user_tx`
+
+    `last_be` becomes `keep` when the link endpoint has one, so the last
+    beat of a frame only carries its valid bytes.
+    """
+    omit = _local_fields | {"last_be", "error"}
+    r = [source.connect(sink, omit=omit)]
+    if hasattr(sink, "keep"):
+        r += [sink.keep.eq(last_be_to_keep(source.last_be, source.last))]
+    return r
+
+def link_to_k2mm(source, sink):
+    """ Connect an Aurora/Kyokko `source_user_rx` to a K2MM `sink_packet_rx`
+
+    Without `keep` on the link endpoint the last beat is taken as full.
+    """
+    omit = _local_fields | {"keep", "last_be", "error"}
+    r = [source.connect(sink, omit=omit)]
+    if hasattr(source, "keep"):
+        r += [sink.last_be.eq(keep_to_last_be(source.keep, source.last))]
+    else:
+        r += [sink.last_be.eq(Mux(source.last, 1 << (len(sink.last_be) - 1), 0))]
+    if hasattr(source, "error"):
+        r += [sink.error.eq(Replicate(source.error, len(sink.error)))]
+    return r
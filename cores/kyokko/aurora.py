@@ -2,9 +2,10 @@ from cgitb import reset
 from litex.soc.interconnect.csr import AutoCSR, CSRField, CSRStatus, CSRStorage
 from migen import *
 from litex.soc.interconnect.stream import Endpoint
-from migen.genlib.cdc import MultiReg
-from cores.kyokko.layout import kyokkoStreamDesc
-from cores.xpm_fifo import XPMAsyncStreamFIFO
+from migen.genlib.cdc import BusSynchronizer, MultiReg
+from cores.kyokko.drp import drp_layout
+from cores.kyokko.layout import kyokkoStreamDesc, kyokkoRxStreamDesc
+from cores.xpm_fifo import XPMAsyncStreamFIFO, XPMMultiReg
 from migen.genlib.resetsync import AsyncResetSynchronizer
 
 class _ResetSequencer(Module):
@@ -82,21 +83,399 @@ class _ResetSequencer(Module):
     def do_finalize(self):
         self.comb += self.do_reset.eq(reduce(or_, self.triggers))
 
+class _LinkWatchdog(Module):
+    """ Automatic link recovery
+
+    Requests a reset (`reset`, one cycle) when the channel stays down for
+    `backoff` cycles, or at once on `hard_err` or more than `soft_err_limit`
+    soft errors within `err_window` cycles. After each recovery attempt
+    `backoff` doubles up to `wait * 2**max_shift`; it returns to `wait`
+    once the channel stayed up for `wait` cycles.
+
+    All inputs are expected in the watchdog's clock domain.
+    """
+    def __init__(self, wait, max_shift=4, soft_err_limit=1000, err_window=None):
+        self.enable     = Signal(reset=1)
+        self.channel_up = Signal()
+        self.soft_err   = Signal()
+        self.hard_err   = Signal()
+        self.reset      = Signal()
+
+        self.recoveries = Signal(32)
+        self.downtime   = Signal(32) # Cycles with channel down
+
+        # # #
+
+        err_window = wait if err_window is None else err_window
+        backoff = Signal(32, reset=wait)
+        timer   = Signal(32)
+        errors  = Signal(max=soft_err_limit + 2)
+        window  = Signal(max=err_window + 1)
+        too_many_errors = Signal()
+
+        self.sync += [
+            If(~self.channel_up & (self.downtime != 2**32 - 1),
+                self.downtime.eq(self.downtime + 1)
+            ),
+            If(window == err_window,
+                window.eq(0),
+                errors.eq(0)
+            ).Else(
+                window.eq(window + 1),
+                If(self.soft_err & (errors != soft_err_limit + 1),
+                    errors.eq(errors + 1)
+                )
+            ),
+        ]
+        self.comb += too_many_errors.eq(self.hard_err | (errors > soft_err_limit))
+
+        self.submodules.fsm = fsm = FSM(reset_state="DOWN")
+        fsm.act("UP",
+            If(timer == wait,
+                NextValue(backoff, wait)
+            ).Else(
+                NextValue(timer, timer + 1)
+            ),
+            If(self.enable,
+                If(~self.channel_up,
+                    NextValue(timer, 0),
+                    NextState("DOWN")
+                ).Elif(too_many_errors,
+                    NextState("RECOVER")
+                )
+            )
+        )
+        fsm.act("DOWN",
+            NextValue(timer, timer + 1),
+            If(self.channel_up,
+                NextValue(timer, 0),
+                NextState("UP")
+            ).Elif(self.enable & (timer >= backoff),
+                NextState("RECOVER")
+            )
+        )
+        fsm.act("RECOVER",
+            self.reset.eq(1),
+            NextValue(self.recoveries, self.recoveries + 1),
+            If(backoff < (wait << max_shift),
+                NextValue(backoff, backoff << 1)
+            ),
+            NextValue(timer, 0),
+            NextValue(errors, 0),
+            NextState("DOWN")
+        )
+
+class _RXOverflowGuard(Module):
+    """ Drop beats a full FIFO cannot take without breaking the framing
+
+    `sink` has no backpressure (`sink.ready` is ignored). Frames whose
+    first beat is dropped are discarded entirely; frames that lose a later
+    beat are cut short and end with `error` set (on their own last beat if
+    it fits, on an extra empty beat otherwise). Without `framing`
+    (streaming mode) only the dropped beats are counted.
+    """
+    def __init__(self, layout, framing=True):
+        self.sink   = sink   = Endpoint(layout)
+        self.source = source = Endpoint(layout)
+
+        self.dropped_beats     = Signal(32)
+        self.dropped_frames    = Signal(32)
+        self.truncated_frames  = Signal(32)
+
+        # # #
+
+        taken = Signal()
+        drop  = Signal()
+        self.comb += drop.eq(sink.valid & ~taken)
+        self.sync += If(drop, self.dropped_beats.eq(self.dropped_beats + 1))
+
+        if not framing:
+            self.comb += taken.eq(source.ready)
+            self.comb += sink.connect(source)
+            return
+
+        # Frame position of the input, independent of what gets through
+        first = Signal(reset=1)
+        self.sync += If(sink.valid, first.eq(sink.last))
+
+        self.submodules.fsm = fsm = FSM(reset_state="PASS")
+        fsm.act("PASS",
+            sink.connect(source),
+            taken.eq(source.ready),
+            If(drop,
+                If(first,
+                    NextValue(self.dropped_frames, self.dropped_frames + 1),
+                    If(~sink.last,
+                        NextState("DISCARD")
+                    )
+                ).Else(
+                    NextValue(self.truncated_frames, self.truncated_frames + 1),
+                    If(sink.last,
+                        NextState("TERMINATE")
+                    ).Else(
+                        NextState("TRUNCATE")
+                    )
+                )
+            )
+        )
+        fsm.act("DISCARD",
+            If(sink.valid & sink.last,
+                NextState("PASS")
+            )
+        )
+        fsm.act("TRUNCATE",
+            If(sink.valid,
+                If(sink.last,
+                    sink.connect(source),
+                    source.error.eq(1),
+                    taken.eq(source.ready),
+                    If(~source.ready,
+                        NextState("TERMINATE")
+                    ).Else(
+                        NextState("PASS")
+                    )
+                )
+            )
+        )
+        fsm.act("TERMINATE",
+            source.valid.eq(1),
+            source.last.eq(1),
+            source.error.eq(1),
+            If(sink.valid & first,
+                NextValue(self.dropped_frames, self.dropped_frames + 1)
+            ),
+            If(source.ready,
+                If(Mux(sink.valid, sink.last, first),
+                    NextState("PASS")
+                ).Else(
+                    NextState("DISCARD")
+                )
+            )
+        )
+
+def _sat_inc(counter, cond):
+    return If(cond & (counter != 2**len(counter) - 1),
+        counter.eq(counter + 1)
+    )
+
+class _LinkStats(Module):
+    """ Saturating link health counters, run in the user clock domain
+
+    Aurora reports soft/hard errors per channel; per lane only `lane_up`
+    is available, so lane-down events are counted per lane.
+    """
+    def __init__(self, lanes, width=32):
+        self.lane_up    = Signal(lanes)
+        self.channel_up = Signal()
+        self.soft_err   = Signal()
+        self.hard_err   = Signal()
+
+        self.soft_errors  = Signal(width, reset_less=True)
+        self.hard_errors  = Signal(width, reset_less=True)
+        self.channel_down = Signal(width, reset_less=True)
+        self.lane_down    = [Signal(width, reset_less=True) for _ in range(lanes)]
+        self.uptime       = Signal(width, reset_less=True) # Cycles since channel up
+
+        # # #
+
+        lane_up_d    = Signal(lanes, reset_less=True)
+        channel_up_d = Signal(reset_less=True)
+        self.sync += [
+            lane_up_d.eq(self.lane_up),
+            channel_up_d.eq(self.channel_up),
+            _sat_inc(self.soft_errors, self.soft_err),
+            _sat_inc(self.hard_errors, self.hard_err),
+            _sat_inc(self.channel_down, channel_up_d & ~self.channel_up),
+            [_sat_inc(self.lane_down[n], lane_up_d[n] & ~self.lane_up[n]) for n in range(lanes)],
+            If(self.channel_up,
+                _sat_inc(self.uptime, 1)
+            ).Else(
+                self.uptime.eq(0)
+            ),
+        ]
+
+def add_watchdog_csrs(module, watchdog, cd_freerun, cd="sys"):
+    """ Control/statistics CSRs of a `_LinkWatchdog` running in `cd_freerun` """
+    module._recovery = CSRStorage(fields=[
+        CSRField("enable", size=1, reset=0, description="Reset the link automatically when it goes down"),
+    ])
+    module._recoveries = CSRStatus(32, description="Automatic link resets")
+    module._downtime = CSRStatus(32, description="Cycles (init_clk) with channel down")
+    module.specials += XPMMultiReg(module._recovery.fields.enable, watchdog.enable, odomain=cd_freerun, n=4)
+    for sig, csr in [(watchdog.recoveries, module._recoveries), (watchdog.downtime, module._downtime)]:
+        sync = BusSynchronizer(len(sig), cd_freerun, cd)
+        module.submodules += sync
+        module.comb += [
+            sync.i.eq(sig),
+            csr.status.eq(sync.o),
+        ]
+
+# Allowance for the lanes and the channel to come up after the GT reset
+_LANE_UP_MS = 100
+
+def _reset_seq_params(freerun_clk_freq, pma_init_ms):
+    """ aurora_reset_seq timing: reset_pb alone for 1 us, then `pma_init_ms`
+    of PMA_INIT (init_clk at `freerun_clk_freq`) """
+    return dict(
+        p_RSTPB_ASSERT_CYCLE   = max(freerun_clk_freq // 1000000, 1),
+        p_PMAINIT_ASSERT_CYCLE = pma_init_ms * freerun_clk_freq // 1000,
+    )
+
+def _watchdog_wait(freerun_clk_freq, reset_ms, wait_ms=None):
+    """ Base watchdog backoff [cycles] for a link held in reset `reset_ms`
+
+    A recovery restarts the reset, so the backoff must outlast the reset
+    plus `_LANE_UP_MS`, or a dropped link is reset over and over. The
+    default is twice that, leaving headroom for a slow bring-up.
+    """
+    min_ms = reset_ms + _LANE_UP_MS
+    if wait_ms is None:
+        wait_ms = 2 * min_ms
+    if wait_ms <= min_ms:
+        raise ValueError("Watchdog wait of {} ms does not cover the {} ms link reset and lane up".format(
+            wait_ms, min_ms))
+    return wait_ms * freerun_clk_freq // 1000
+
+class _BringupTimer(Module):
+    """ Timestamp link bring-up stages
+
+    `time` counts (saturating) from the last `restart`. Each stage records
+    the time of its last rising edge since then, 0 if it was already high
+    and never dropped.
+    """
+    def __init__(self, stages):
+        self.restart = Signal()
+        self.time    = Signal(32)
+        self.stages     = {name: Signal(name=name) for name in stages}
+        self.timestamps = {name: Signal(32, name=name + "_time") for name in stages}
+
+        # # #
+
+        self.sync += [
+            If(self.restart,
+                self.time.eq(0)
+            ).Elif(self.time != 2**32 - 1,
+                self.time.eq(self.time + 1)
+            )
+        ]
+        for name in stages:
+            sig, ts = self.stages[name], self.timestamps[name]
+            sig_d = Signal()
+            self.sync += [
+                sig_d.eq(sig),
+                If(self.restart,
+                    ts.eq(0)
+                ).Elif(sig & ~sig_d,
+                    ts.eq(self.time)
+                )
+            ]
+
+class _LoopbackControl(Module):
+    """ GT loopback mode (already synchronized); `reset` pulses for one
+    cycle after every change so that the link retrains in the new mode """
+    def __init__(self):
+        self.mode  = Signal(3, reset_less=True)
+        self.reset = Signal(reset_less=True)
+
+        # # #
+
+        mode_d = Signal(3, reset_less=True)
+        self.sync += [
+            mode_d.eq(self.mode),
+            self.reset.eq(self.mode != mode_d),
+        ]
+
+def _parse_quad(quad):
+    """ "Quad_X0Y3" -> (0, 3) """
+    x, y = quad[len("Quad_X"):].split("Y")
+    return int(x), int(y)
+
+def _check_line_rate(line_rate, refclk_freq):
+    """ Reject line rate / reference clock pairs the GTY QPLLs cannot make
+
+    line_rate [Gbps], refclk_freq [MHz]. A QPLL runs its VCO at
+    line_rate * D / 2 (D = output divider) from refclk * N / M.
+    """
+    if not 0.5 <= line_rate <= 32.75:
+        raise ValueError("Line rate {} Gbps out of GTY range (0.5-32.75)".format(line_rate))
+    if not 60.0 <= refclk_freq <= 820.0:
+        raise ValueError("Reference clock {} MHz out of GTY range (60-820)".format(refclk_freq))
+    for d in [1, 2, 4, 8, 16]:
+        vco = line_rate * 1e3 * d / 2
+        if not (9800 <= vco <= 16375 or 8000 <= vco <= 13000):
+            continue
+        for m in [1, 2, 3, 4]:
+            if 16 <= vco * m / refclk_freq <= 160:
+                return
+    raise ValueError("No QPLL setting for {} Gbps from a {} MHz reference clock".format(line_rate, refclk_freq))
+
 class Aurora64b66b(Module, AutoCSR):
+    """ Xilinx Aurora 64B/66B core
+
+    `pads` is one GTY quad (Record with `platform_info`) or a list of
+    adjacent quads for links of more than four lanes. The user datapath is
+    `64 * lanes` bits wide (`dw`), `sink_user_tx`/`source_user_rx` are in
+    clock domain `cd`.
+    `pma_init_ms`: PMA_INIT hold time of the reset sequence.
+    `watchdog_*`: automatic recovery (see `_LinkWatchdog`), off until the
+    `recovery` CSR enables it. The backoff starts at `watchdog_wait_ms`,
+    by default twice the reset sequence plus lane up (see `_watchdog_wait`).
+    """
     verilog_source_ready = False
     def __init__(
         self, platform, 
         pads, refclk,
+        cd = "sys",
         cd_freerun = "clk100",
         freerun_clk_freq = int(100e6),
-        with_ila = True):
-        LANES=4        
+        with_ila = True,
+        streaming = False,
+        lanes = 4,
+        line_rate = 25.78125,
+        refclk_freq = 161.1328125,
+        pma_init_ms = 1000,
+        watchdog_wait_ms = None,
+        watchdog_max_shift = 4,
+        watchdog_soft_err_limit = 1000):
+        quads = pads if isinstance(pads, (list, tuple)) else [pads]
+        channels = sum([list(q.platform_info['channel']) for q in quads], [])
+        if not 1 <= lanes <= 16:
+            raise ValueError("Aurora 64B/66B supports 1-16 lanes (got {})".format(lanes))
+        if lanes > len(channels):
+            raise ValueError("{} lanes requested, pads provide {}".format(lanes, len(channels)))
+        _xy = [_parse_quad(q.platform_info['quad']) for q in quads]
+        for (x0, y0), (x1, y1) in zip(_xy, _xy[1:]):
+            if x1 != x0 or y1 != y0 + 1:
+                raise ValueError("Quads must be adjacent in one column")
+        _check_line_rate(line_rate, refclk_freq)
+        LANES = lanes
+        self.dw = 64 * LANES
+        pads = quads[0]
+        rx_p = Cat(*[q.rx_p for q in quads])[:LANES]
+        rx_n = Cat(*[q.rx_n for q in quads])[:LANES]
+        tx_p = Cat(*[q.tx_p for q in quads])[:LANES]
+        tx_n = Cat(*[q.tx_n for q in quads])[:LANES]
         self.init_clk_locked = Signal(reset_less=True)
         self.sink_user_tx = sink_user_tx = Endpoint(kyokkoStreamDesc(lanes=LANES))
-        self.source_user_rx = source_user_rx = Endpoint(kyokkoStreamDesc(lanes=LANES))
+        self.source_user_rx = source_user_rx = Endpoint(kyokkoRxStreamDesc(lanes=LANES))
 
         # Clock domain
-        self.clock_domains.cd_dp = cd_dp = ClockDomain()
+        self.clock_domains.cd_user = cd_user = ClockDomain()
+
+        # GT loopback (UG578), changing it resets the link
+        self._loopback = CSRStorage(fields=[
+            CSRField("mode", size=3, values=[
+                ("0b000", "Normal operation"),
+                ("0b001", "Near-end PCS loopback"),
+                ("0b010", "Near-end PMA loopback"),
+                ("0b100", "Far-end PMA loopback"),
+                ("0b110", "Far-end PCS loopback"),
+            ]),
+        ])
+        self.loopback = Signal(3, reset_less=True)
+        self.specials += XPMMultiReg(self._loopback.fields.mode, self.loopback, odomain=cd_freerun, n=4)
+        self.submodules.loopback_ctrl = loopback_ctrl = ClockDomainsRenamer(cd_freerun)(_LoopbackControl())
+        self.comb += loopback_ctrl.mode.eq(self.loopback)
         
         # Reset sequencer
         self.reset_pb = Signal()
@@ -110,20 +489,21 @@ class Aurora64b66b(Module, AutoCSR):
             Aurora64b66b.verilog_source_ready = True
                 
         _vio_reset = Signal(reset_less=True)
+        _ext_reset = Signal(reset_less=True)
         _reset_seq_done = Signal(reset_less=True)
         _init_clk_locked = Signal(reset_less=True)
         _are_sys_reset_synced = Signal(reset_less=True)
 
-        from cores.xpm_fifo import XPMMultiReg
         self.specials += [
             XPMMultiReg(self.init_clk_locked, _init_clk_locked, odomain=cd_freerun, n=8, reset=0),
-            XPMMultiReg(cd_dp.rst, _are_sys_reset_synced, odomain=cd_freerun, n=8, reset=0),
+            XPMMultiReg(cd_user.rst, _are_sys_reset_synced, odomain=cd_freerun, n=8, reset=0),
             Instance(
                 "aurora_reset_seq", 
                 p_INSERT_CDC       = 0b0,
+                **_reset_seq_params(freerun_clk_freq, pma_init_ms),
                 i_init_clk         = ClockSignal(cd_freerun),
                 i_init_clk_locked  = _init_clk_locked,
-                i_ext_reset_in     = _vio_reset,
+                i_ext_reset_in     = _ext_reset,
                 i_are_sys_reset_in = _are_sys_reset_synced,
                 o_done             = _reset_seq_done,
                 o_are_reset_pb_out = self.reset_pb,
@@ -134,23 +514,23 @@ class Aurora64b66b(Module, AutoCSR):
         ip_vlnv = "xilinx.com:ip:aurora_64b66b"
         self.refname = "ar_" + pads.platform_info['quad']
         self.ip_cfg = {
-            "CONFIG.CHANNEL_ENABLE"      : " ".join(pads.platform_info['channel']),
+            "CONFIG.CHANNEL_ENABLE"      : " ".join(channels[:LANES]),
             "CONFIG.C_START_QUAD"        : pads.platform_info['quad'],
-            "CONFIG.C_AURORA_LANES"      : "4",
-            "CONFIG.C_LINE_RATE"         : "25.78125",
-            "CONFIG.C_REFCLK_FREQUENCY"  : "161.1328125",
+            "CONFIG.C_AURORA_LANES"      : str(LANES),
+            "CONFIG.C_LINE_RATE"         : str(line_rate),
+            "CONFIG.C_REFCLK_FREQUENCY"  : str(refclk_freq),
             "CONFIG.C_INIT_CLK"          : freerun_clk_freq // 1000000,
             "CONFIG.flow_mode"           : "None",
+            "CONFIG.interface_mode"      : "Streaming" if streaming else "Framing",
             "CONFIG.SINGLEEND_GTREFCLK"  : "false" if isinstance(refclk, Record) else "true",
-            "CONFIG.C_GT_LOC_4"          : "4",
-            "CONFIG.C_GT_LOC_3"          : "3",
-            "CONFIG.C_GT_LOC_2"          : "2",
             "CONFIG.drp_mode"            : "Native",
             "CONFIG.SupportLevel"        : "1",
             "CONFIG.C_USE_BYTESWAP"      : "true",
             "CONFIG.C_GTWIZ_OUT"         : "false",
             "CONFIG.C_UCOLUMN_USED"      : "left" if pads.platform_info['quad'][5: -2] == "X0" else "right",
         }
+        for _n in range(2, LANES + 1):
+            self.ip_cfg[f"CONFIG.C_GT_LOC_{_n}"] = str(_n)
 
         platform.add_tcl_ip(ip_vlnv, self.refname, self.ip_cfg)
         
@@ -170,35 +550,53 @@ class Aurora64b66b(Module, AutoCSR):
             i_reset_pb   = self.reset_pb,
             i_power_down = 0b0,
             i_pma_init   = self.pma_init,
-            i_loopback   = 0b0,
-            i_rxp = pads.rx_p,
-            i_rxn = pads.rx_n,
-            o_txp = pads.tx_p,
-            o_txn = pads.tx_n,
+            i_loopback   = self.loopback,
+            i_rxp = rx_p,
+            i_rxn = rx_n,
+            o_txp = tx_p,
+            o_txn = tx_n,
         )
         cdc_tx = XPMAsyncStreamFIFO(kyokkoStreamDesc(lanes=LANES),
             depth = 512,
             sync_stages = 4,
             xpm = True)
-        cdc_tx = ClockDomainsRenamer({"read": cd_dp.name, "write" : "sys"})(cdc_tx)
+        cdc_tx = ClockDomainsRenamer({"read": cd_user.name, "write" : cd})(cdc_tx)
         self.comb += self.sink_user_tx.connect(cdc_tx.sink)
         self.submodules.cdc_tx = cdc_tx
 
-        cdc_rx = XPMAsyncStreamFIFO(kyokkoStreamDesc(lanes=LANES),
+        cdc_rx = XPMAsyncStreamFIFO(kyokkoRxStreamDesc(lanes=LANES),
             depth = 512,
             sync_stages = 4,
             xpm = True)
-        cdc_rx = ClockDomainsRenamer({"read": "sys", "write" : cd_dp.name})(cdc_rx)
+        cdc_rx = ClockDomainsRenamer({"read": cd, "write" : cd_user.name})(cdc_rx)
         self.comb += cdc_rx.source.connect(self.source_user_rx)
         self.submodules.cdc_rx = cdc_rx
+
+        # The core cannot be backpressured: account for beats lost on a full cdc_rx
+        self.submodules.rx_guard = rx_guard = ClockDomainsRenamer(cd_user.name)(
+            _RXOverflowGuard(kyokkoRxStreamDesc(lanes=LANES), framing=not streaming))
+        self.comb += rx_guard.source.connect(cdc_rx.sink)
+        for name, desc in [
+            ("rx_dropped_beats",     "Received beats dropped on RX FIFO overflow"),
+            ("rx_dropped_frames",    "Received frames dropped entirely on RX FIFO overflow"),
+            ("rx_truncated_frames",  "Received frames truncated (ended with `error`) on RX FIFO overflow")]:
+            sig = getattr(rx_guard, name[len("rx_"):])
+            csr = CSRStatus(32, description=desc, name=name)
+            setattr(self, "_" + name, csr)
+            sync = BusSynchronizer(32, cd_user.name, "sys")
+            self.submodules += sync
+            self.comb += [
+                sync.i.eq(sig),
+                csr.status.eq(sync.o),
+            ]
         
         if with_ila:
             # import util.xilinx_ila
             for ep in [cdc_tx.source, cdc_rx.sink]:
                 for s in [ep.valid, ep.ready, ep.last]:
-                    platform.ila.add_probe(s, cd_dp.clk, trigger=True)
+                    platform.ila.add_probe(s, cd_user.clk, trigger=True)
                 for s in ep.payload.flatten():
-                    platform.ila.add_probe(s, cd_dp.clk, trigger=False)
+                    platform.ila.add_probe(s, cd_user.clk, trigger=False)
 
         self._status = CSRStatus(fields=[
             CSRField("reset_pb", size=1),
@@ -208,7 +606,6 @@ class Aurora64b66b(Module, AutoCSR):
 
         # Status Register
         mmcm_not_locked = Signal()
-        from cores.xpm_fifo import XPMMultiReg
         self.specials += [
             XPMMultiReg(self.reset_pb, self._status.fields.reset_pb, odomain="sys", n=4),
             XPMMultiReg(self.pma_init, self._status.fields.pma_init, odomain="sys", n=4),
@@ -217,15 +614,20 @@ class Aurora64b66b(Module, AutoCSR):
 
         self.ip_params.update(
             i_s_axi_tx_tdata    = cdc_tx.source.data,
-            i_s_axi_tx_tkeep    = Replicate(0b1, len(cdc_tx.source.data)//8),
-            i_s_axi_tx_tlast    = cdc_tx.source.last,
             i_s_axi_tx_tvalid   = cdc_tx.source.valid,
             o_s_axi_tx_tready   = cdc_tx.source.ready,
-            o_m_axi_rx_tdata    = self.cdc_rx.sink.data,
-            o_m_axi_rx_tkeep    = Signal(),
-            o_m_axi_rx_tlast    = self.cdc_rx.sink.last,
-            o_m_axi_rx_tvalid   = self.cdc_rx.sink.valid,
+            o_m_axi_rx_tdata    = rx_guard.sink.data,
+            o_m_axi_rx_tvalid   = rx_guard.sink.valid,
         )
+        # Streaming mode has no tkeep/tlast, K2MM (link_mode="streaming")
+        # carries the frame boundaries
+        if not streaming:
+            self.ip_params.update(
+                i_s_axi_tx_tkeep    = cdc_tx.source.keep,
+                i_s_axi_tx_tlast    = cdc_tx.source.last,
+                o_m_axi_rx_tkeep    = rx_guard.sink.keep,
+                o_m_axi_rx_tlast    = rx_guard.sink.last,
+            )
 
         lane_up                     = Signal(LANES,reset_less=True)
         channel_up                  = Signal(reset_less=True)
@@ -234,16 +636,17 @@ class Aurora64b66b(Module, AutoCSR):
         # Status Output
         _gt_qpllrefclklost_quad1_out = Signal(reset_less=True)
         _gt_qplllock_quad1_out = Signal(reset_less=True)
+        _gt_powergood = Signal(LANES, reset_less=True)
         self.ip_params.update(
             o_gt_qpllclk_quad1_out        = Signal(),
             o_gt_qpllrefclk_quad1_out     = Signal(),
             o_gt_qpllrefclklost_quad1_out = _gt_qpllrefclklost_quad1_out,
             o_gt_qplllock_quad1_out       = _gt_qplllock_quad1_out,
             o_gt_reset_out                = Signal(),
-            o_gt_powergood                = Signal(),
+            o_gt_powergood                = _gt_powergood,
             o_mmcm_not_locked_out         = mmcm_not_locked,
-            o_sys_reset_out               = cd_dp.rst,
-            o_user_clk_out                = cd_dp.clk,
+            o_sys_reset_out               = cd_user.rst,
+            o_user_clk_out                = cd_user.clk,
             o_link_reset_out              = Signal(),
             o_sync_clk_out                = Signal(),
             o_lane_up                     = lane_up,
@@ -253,10 +656,10 @@ class Aurora64b66b(Module, AutoCSR):
         )
         from util.xilinx_vio import XilinxVIO
         self.submodules.vio = vio = XilinxVIO(platform)
-        vio.add_input_probe(lane_up, cd_dp)
-        vio.add_input_probe(channel_up, cd_dp)
-        vio.add_input_probe(hard_err, cd_dp)
-        vio.add_input_probe(soft_err, cd_dp)
+        vio.add_input_probe(lane_up, cd_user)
+        vio.add_input_probe(channel_up, cd_user)
+        vio.add_input_probe(hard_err, cd_user)
+        vio.add_input_probe(soft_err, cd_user)
         vio.add_input_probe(self.pma_init)
         vio.add_input_probe(self.reset_pb)
         vio.add_input_probe(_reset_seq_done)
@@ -266,14 +669,78 @@ class Aurora64b66b(Module, AutoCSR):
         # FIXME: Timing error on Trefoil platform
         vio.add_output_probe(_vio_reset)
 
-        for _n in range(0, LANES):
+        # Link statistics
+        self.submodules.stats = stats = ClockDomainsRenamer(cd_user.name)(_LinkStats(LANES))
+        self.comb += [
+            stats.lane_up.eq(lane_up),
+            stats.channel_up.eq(channel_up),
+            stats.soft_err.eq(soft_err),
+            stats.hard_err.eq(hard_err),
+        ]
+        self._add_stats_csrs(stats, cd_user.name, LANES)
+
+        # Bring-up timestamps (init_clk cycles from the last reset request)
+        self.submodules.bringup = bringup = ClockDomainsRenamer(cd_freerun)(_BringupTimer([
+            "init_clk_locked", "gt_powergood", "qpll_lock", "reset_seq_done",
+            "reset_done", "lane_up", "channel_up"]))
+        _init_clk_locked_d = Signal(reset_less=True)
+        _sync = getattr(self.sync, cd_freerun)
+        _sync += _init_clk_locked_d.eq(_init_clk_locked)
+        self.comb += [
+            bringup.restart.eq(_ext_reset | (_init_clk_locked & ~_init_clk_locked_d)),
+            bringup.stages["init_clk_locked"].eq(_init_clk_locked),
+            bringup.stages["reset_seq_done"].eq(_reset_seq_done),
+        ]
+        _gt_powergood_all = Signal(reset_less=True)
+        _reset_done = Signal(reset_less=True)
+        _lane_up_all = Signal(reset_less=True)
+        self.comb += [
+            _gt_powergood_all.eq(_gt_powergood == 2**LANES - 1),
+            _reset_done.eq(~cd_user.rst),
+            _lane_up_all.eq(lane_up == 2**LANES - 1),
+        ]
+        self.specials += [
+            XPMMultiReg(_gt_powergood_all, bringup.stages["gt_powergood"], odomain=cd_freerun, n=4),
+            XPMMultiReg(_gt_qplllock_quad1_out, bringup.stages["qpll_lock"], odomain=cd_freerun, n=4),
+            XPMMultiReg(_reset_done, bringup.stages["reset_done"], odomain=cd_freerun, n=4),
+            XPMMultiReg(_lane_up_all, bringup.stages["lane_up"], odomain=cd_freerun, n=4),
+            XPMMultiReg(channel_up, bringup.stages["channel_up"], odomain=cd_freerun, n=4),
+        ]
+        for name, ts in bringup.timestamps.items():
+            csr = CSRStatus(32, name="bringup_" + name,
+                description="init_clk cycles from reset request to {}".format(name))
+            setattr(self, "_bringup_" + name, csr)
+            sync = BusSynchronizer(32, cd_freerun, "sys")
+            self.submodules += sync
+            self.comb += [
+                sync.i.eq(ts),
+                csr.status.eq(sync.o),
+            ]
+
+        # Automatic recovery
+        self.submodules.watchdog = watchdog = ClockDomainsRenamer(cd_freerun)(
+            _LinkWatchdog(
+                wait           = _watchdog_wait(freerun_clk_freq, pma_init_ms, watchdog_wait_ms),
+                max_shift      = watchdog_max_shift,
+                soft_err_limit = watchdog_soft_err_limit))
+        self.specials += [
+            XPMMultiReg(channel_up, watchdog.channel_up, odomain=cd_freerun, n=4),
+            XPMMultiReg(soft_err, watchdog.soft_err, odomain=cd_freerun, n=4),
+            XPMMultiReg(hard_err, watchdog.hard_err, odomain=cd_freerun, n=4),
+        ]
+        self.comb += _ext_reset.eq(_vio_reset | watchdog.reset | loopback_ctrl.reset)
+        add_watchdog_csrs(self, watchdog, cd_freerun)
+
+        # DRP, clocked by init_clk (see cores.kyokko.drp.DRPControl)
+        self.drp = [Record(drp_layout) for _ in range(LANES)]
+        for _n, drp in enumerate(self.drp):
             self.ip_params.update({
-                f"i_gt{_n}_drpaddr"  : 0,
-                f"i_gt{_n}_drpdi"    : Replicate(0b0, 10),
-                f"o_gt{_n}_drpdo"    : Signal(16),
-                f"i_gt{_n}_drpen"    : 0,
-                f"o_gt{_n}_drprdy"   : Signal(),
-                f"i_gt{_n}_drpwe"    : 0,
+                f"i_gt{_n}_drpaddr"  : drp.addr,
+                f"i_gt{_n}_drpdi"    : drp.di,
+                f"o_gt{_n}_drpdo"    : drp.do,
+                f"i_gt{_n}_drpen"    : drp.en,
+                f"o_gt{_n}_drprdy"   : drp.rdy,
+                f"i_gt{_n}_drpwe"    : drp.we,
             })
         
         self.specials += Instance(
@@ -281,4 +748,29 @@ class Aurora64b66b(Module, AutoCSR):
             name=self.refname + "_i",
             **self.ip_params)
 
-
+    def _add_stats_csrs(self, stats, cd_user, lanes):
+        self._link_status = CSRStatus(fields=[
+            CSRField("lane_up", size=lanes),
+            CSRField("channel_up", size=1),
+        ])
+        self.specials += [
+            XPMMultiReg(stats.lane_up, self._link_status.fields.lane_up, odomain="sys", n=4),
+            XPMMultiReg(stats.channel_up, self._link_status.fields.channel_up, odomain="sys", n=4),
+        ]
+        counters = [
+            ("soft_errors",  stats.soft_errors,  "Soft errors (saturating)"),
+            ("hard_errors",  stats.hard_errors,  "Hard errors (saturating)"),
+            ("channel_down", stats.channel_down, "Channel down events (saturating)"),
+            ("uptime",       stats.uptime,       "User clock cycles since channel up (saturating)"),
+        ]
+        counters += [("lane{}_down".format(n), sig, "Lane {} down events (saturating)".format(n))
+            for n, sig in enumerate(stats.lane_down)]
+        for name, sig, desc in counters:
+            csr = CSRStatus(len(sig), description=desc, name=name)
+            setattr(self, "_" + name, csr)
+            sync = BusSynchronizer(len(sig), cd_user, "sys")
+            self.submodules += sync
+            self.comb += [
+                sync.i.eq(sig),
+                csr.status.eq(sync.o),
+            ]
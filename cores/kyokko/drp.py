@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+from migen import *
+from migen.genlib.record import DIR_M_TO_S, DIR_S_TO_M
+from migen.genlib.roundrobin import RoundRobin, SP_CE
+from litex.soc.interconnect import stream
+from litex.soc.interconnect.csr import AutoCSR, CSRStorage, CSRStatus, CSRField
+
+# GTY DRP (UG578): 10-bit address, 16-bit data, one access in flight
+drp_layout = [
+    ("addr", 10, DIR_M_TO_S),
+    ("di",   16, DIR_M_TO_S),
+    ("en",    1, DIR_M_TO_S),
+    ("we",    1, DIR_M_TO_S),
+    ("do",   16, DIR_S_TO_M),
+    ("rdy",   1, DIR_S_TO_M),
+]
+
+def drp_request_description():
+    return [("port", 8), ("addr", 10), ("data", 16), ("we", 1)]
+
+def drp_response_description():
+    return [("data", 16), ("error", 1)]
+
+class DRPArbiter(Module):
+    """ Serialize DRP accesses of several masters onto a list of DRP ports
+
+    Masters are served round-robin, one access at a time. An access whose
+    `rdy` does not come back within `timeout` cycles (or that targets a
+    port that does not exist) is answered with `error`.
+    """
+    def __init__(self, ports, masters=1, timeout=1024):
+        self.sinks   = [stream.Endpoint(drp_request_description()) for _ in range(masters)]
+        self.sources = [stream.Endpoint(drp_response_description()) for _ in range(masters)]
+
+        # # #
+
+        self.submodules.rr = rr = RoundRobin(masters, SP_CE)
+        self.comb += rr.request.eq(Cat(*[s.valid for s in self.sinks]))
+
+        sink   = Array(self.sinks)[rr.grant]
+        source = Array(self.sources)[rr.grant]
+        port   = Array(ports)[sink.port]
+
+        data  = Signal(16)
+        error = Signal()
+        count = Signal(max=timeout + 1)
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            rr.ce.eq(1),
+            If(rr.request != 0,
+                NextState("ISSUE")
+            )
+        )
+        fsm.act("ISSUE",
+            If(sink.port >= len(ports),
+                NextValue(error, 1),
+                NextState("RESPOND")
+            ).Else(
+                port.en.eq(1),
+                port.we.eq(sink.we),
+                port.addr.eq(sink.addr),
+                port.di.eq(sink.data),
+                NextValue(error, 0),
+                NextValue(count, 0),
+                NextState("WAIT")
+            )
+        )
+        fsm.act("WAIT",
+            NextValue(count, count + 1),
+            If(port.rdy,
+                NextValue(data, port.do),
+                NextState("RESPOND")
+            ).Elif(count == timeout,
+                NextValue(error, 1),
+                NextState("RESPOND")
+            )
+        )
+        fsm.act("RESPOND",
+            source.valid.eq(1),
+            source.data.eq(data),
+            source.error.eq(error),
+            If(source.ready,
+                sink.ready.eq(1),
+                NextState("IDLE")
+            )
+        )
+
+class DRPControl(Module, AutoCSR):
+    """ CSR access to the DRP ports of GTY transceivers
+
+    `ports` is a list of `drp_layout` records, e.g. `aurora.drp` of several
+    Aurora64b66b instances concatenated; `_port` selects among them. All
+    ports have to be clocked by `cd` (the Aurora init_clk). `masters`
+    additional request/response endpoints (`sinks`/`sources`) are arbitrated
+    with the CSR master for gateware users such as the eye-scan engine.
+
+    Firmware sequence: write _port/_addr/_wdata, write _ctrl.start (with
+    _ctrl.we for a write), poll _status.done, read _rdata.
+    """
+    def __init__(self, ports, cd="clk100", masters=0, timeout=1024):
+        self._port   = CSRStorage(8, description="DRP port index (lane)")
+        self._addr   = CSRStorage(10, description="DRP address")
+        self._wdata  = CSRStorage(16, description="DRP write data")
+        self._ctrl   = CSRStorage(fields=[
+            CSRField("start", size=1, pulse=True, description="Start an access"),
+            CSRField("we",    size=1, description="1: write, 0: read"),
+        ])
+        self._status = CSRStatus(fields=[
+            CSRField("busy",  size=1),
+            CSRField("done",  size=1, description="Access finished, cleared by start"),
+            CSRField("error", size=1, description="No response or invalid port"),
+        ])
+        self._rdata  = CSRStatus(16, description="DRP read data")
+
+        # # #
+
+        self.submodules.arbiter = arbiter = ClockDomainsRenamer(cd)(
+            DRPArbiter(ports, masters=1 + masters, timeout=timeout))
+        self.sinks   = arbiter.sinks[1:]
+        self.sources = arbiter.sources[1:]
+
+        self.submodules.cdc_req = cdc_req = stream.ClockDomainCrossing(
+            drp_request_description(), cd_from="sys", cd_to=cd)
+        self.submodules.cdc_resp = cdc_resp = stream.ClockDomainCrossing(
+            drp_response_description(), cd_from=cd, cd_to="sys")
+        self.comb += [
+            cdc_req.source.connect(arbiter.sinks[0]),
+            arbiter.sources[0].connect(cdc_resp.sink),
+        ]
+
+        busy = self._status.fields.busy
+        self.comb += [
+            cdc_req.sink.port.eq(self._port.storage),
+            cdc_req.sink.addr.eq(self._addr.storage),
+            cdc_req.sink.data.eq(self._wdata.storage),
+            cdc_req.sink.we.eq(self._ctrl.fields.we),
+            cdc_resp.source.ready.eq(1),
+        ]
+        self.sync += [
+            If(self._ctrl.fields.start & ~busy,
+                cdc_req.sink.valid.eq(1),
+                busy.eq(1),
+                self._status.fields.done.eq(0),
+            ),
+            If(cdc_req.sink.valid & cdc_req.sink.ready,
+                cdc_req.sink.valid.eq(0)
+            ),
+            If(cdc_resp.source.valid,
+                busy.eq(0),
+                self._status.fields.done.eq(1),
+                self._status.fields.error.eq(cdc_resp.source.error),
+                self._rdata.status.eq(cdc_resp.source.data),
+            ),
+        ]
@@ -0,0 +1,222 @@
+#!/usr/bin/python3
+from migen import *
+from migen.genlib.cdc import PulseSynchronizer
+from litex.soc.interconnect.stream import Endpoint
+from litex.soc.interconnect.csr import AutoCSR, CSRStorage, CSRStatus, CSRField
+
+from cores.kyokko.drp import drp_request_description, drp_response_description
+from cores.xpm_fifo import XPMMultiReg
+
+# GTY eye scan DRP attributes (UG578)
+ES_CONTROL        = 0x03C # [15:10] ES_CONTROL, [9] ES_ERRDET_EN, [8] ES_EYE_SCAN_EN, [4:0] ES_PRESCALE
+ES_HORZ_OFFSET    = 0x04F # [15:4]
+RX_EYESCAN_VS     = 0x097 # [10] NEG_DIR, [9] UT_SIGN, [8:2] CODE, [1:0] RANGE
+ES_ERROR_COUNT    = 0x251
+ES_SAMPLE_COUNT   = 0x252
+ES_CONTROL_STATUS = 0x253 # [0] done
+
+class _EyeScanLane(Module):
+    """ Sweep ES_HORZ_OFFSET x RX_EYESCAN_VS of one lane through a DRP master
+
+    Each point is measured with both UT signs; the summed error and sample
+    counts (16 bits each, saturating) are written to `mem` at
+    `v_index * h_count + h_index`. A count of 0 scans one point, the scan
+    stops early once `mem` is full.
+    """
+    def __init__(self, port, depth=1024):
+        self.source = source = Endpoint(drp_request_description())
+        self.sink   = sink   = Endpoint(drp_response_description())
+
+        self.start    = Signal()
+        self.busy     = Signal()
+        self.error    = Signal()
+        self.prescale = Signal(5)
+        self.h_start  = Signal(12)
+        self.h_step   = Signal(12)
+        self.h_count  = Signal(8)
+        self.v_start  = Signal((8, True))
+        self.v_step   = Signal(7)
+        self.v_count  = Signal(8)
+
+        self.mem = Memory(32, depth)
+
+        # # #
+
+        self.specials.wrport = wrport = self.mem.get_port(write_capable=True)
+
+        h_index = Signal(8)
+        v_index = Signal(8)
+        h       = Signal(12)
+        v       = Signal((9, True))
+        ut      = Signal()
+        rdata   = Signal(16)
+        errors  = Signal(17)
+        samples = Signal(17)
+        addr    = Signal(max=depth)
+        h_last  = Signal(8)
+        v_last  = Signal(8)
+
+        def _sat16(x):
+            return Mux(x[16], 0xffff, x[:16])
+
+        self.comb += [
+            source.port.eq(port),
+            wrport.adr.eq(addr),
+            wrport.dat_w.eq(Cat(_sat16(samples), _sat16(errors))),
+            h_last.eq(Mux(self.h_count == 0, 0, self.h_count - 1)),
+            v_last.eq(Mux(self.v_count == 0, 0, self.v_count - 1)),
+        ]
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+
+        def access(state, next_state, addr, we=0, data=0, on_data=[]):
+            fsm.act(state,
+                source.valid.eq(1),
+                source.addr.eq(addr),
+                source.we.eq(we),
+                source.data.eq(data),
+                sink.ready.eq(1),
+                If(sink.valid,
+                    If(sink.error,
+                        NextValue(self.error, 1)
+                    ),
+                    NextState(next_state),
+                    *on_data
+                )
+            )
+
+        def rmw(state, next_state, addr, keep, value):
+            access(state + "_RD", state + "_WR", addr, on_data=[NextValue(rdata, sink.data)])
+            access(state + "_WR", next_state, addr, we=1, data=(rdata & keep) | value)
+
+        fsm.act("IDLE",
+            If(self.start,
+                NextValue(h_index, 0),
+                NextValue(v_index, 0),
+                NextValue(h, self.h_start),
+                NextValue(v, self.v_start),
+                NextValue(ut, 0),
+                NextValue(errors, 0),
+                NextValue(samples, 0),
+                NextValue(addr, 0),
+                NextValue(self.error, 0),
+                NextState("HORZ_RD")
+            )
+        )
+        rmw("HORZ", "VERT_RD", ES_HORZ_OFFSET, 0x000f, h << 4)
+        rmw("VERT", "RUN_RD", RX_EYESCAN_VS, 0xf803,
+            (Mux(v < 0, -v, v)[:7] << 2) | (ut << 9) | ((v < 0) << 10))
+        rmw("RUN", "POLL", ES_CONTROL, 0x03e0, (1 << 10) | self.prescale)
+        access("POLL", "POLL", ES_CONTROL_STATUS, on_data=[
+            If(sink.data[0],
+                NextState("ERRORS")
+            )
+        ])
+        access("ERRORS", "SAMPLES", ES_ERROR_COUNT, on_data=[
+            NextValue(errors, errors + sink.data)
+        ])
+        access("SAMPLES", "STOP_RD", ES_SAMPLE_COUNT, on_data=[
+            NextValue(samples, samples + sink.data)
+        ])
+        rmw("STOP", "NEXT", ES_CONTROL, 0x03e0, self.prescale)
+        fsm.act("NEXT",
+            If(~ut,
+                NextValue(ut, 1),
+                NextState("VERT_RD")
+            ).Else(
+                wrport.we.eq(1),
+                NextValue(addr, addr + 1),
+                NextValue(ut, 0),
+                NextValue(errors, 0),
+                NextValue(samples, 0),
+                NextValue(h_index, h_index + 1),
+                NextValue(h, h + self.h_step),
+                NextState("HORZ_RD"),
+                If(h_index == h_last,
+                    NextValue(h_index, 0),
+                    NextValue(h, self.h_start),
+                    NextValue(v_index, v_index + 1),
+                    NextValue(v, v + self.v_step),
+                ),
+                If(((h_index == h_last) & (v_index == v_last)) | (addr == depth - 1),
+                    NextState("IDLE")
+                )
+            )
+        )
+        self.comb += self.busy.eq(~fsm.ongoing("IDLE"))
+
+class EyeScan(Module, AutoCSR):
+    """ In-system eye scan of several GTY lanes
+
+    Scans run on live links, each lane has its own engine so lanes are
+    swept in parallel; the engines share the DRP through `drp`, a
+    `DRPControl` built with `masters=len(ports)`. `ports` are the DRP port
+    indices (in `drp`) of the lanes to scan.
+
+    Before a scan, firmware enables ES_EYE_SCAN_EN/ES_ERRDET_EN and sets the
+    ES_QUAL_MASK/ES_SDATA_MASK registers for the RX data width through
+    `DRPControl`. Results are read back through the _mem_sel/_mem_data window:
+    [31:16] errors, [15:0] samples, both in units of the prescaled sample
+    count and saturating.
+    """
+    def __init__(self, drp, ports, cd="clk100", depth=1024):
+        assert len(drp.sinks) >= len(ports)
+        nlanes = len(ports)
+
+        self._control = CSRStorage(fields=[
+            CSRField("start",    size=1, pulse=True),
+            CSRField("lanes",    size=nlanes, reset=2**nlanes - 1, description="Lanes to scan"),
+            CSRField("prescale", size=5, description="ES_PRESCALE"),
+        ])
+        self._horz = CSRStorage(fields=[
+            CSRField("start", size=12, description="First ES_HORZ_OFFSET"),
+            CSRField("step",  size=12),
+            CSRField("count", size=8),
+        ])
+        self._vert = CSRStorage(fields=[
+            CSRField("start", size=8, description="First vertical offset (signed, -127 to 127)"),
+            CSRField("step",  size=7),
+            CSRField("count", size=8),
+        ])
+        self._status = CSRStatus(fields=[
+            CSRField("busy",  size=nlanes),
+            CSRField("error", size=nlanes, description="DRP access failed during the last scan"),
+        ])
+        self._mem_sel = CSRStorage(fields=[
+            CSRField("lane", size=bits_for(nlanes - 1)),
+            CSRField("addr", size=log2_int(depth, False)),
+        ])
+        self._mem_data = CSRStatus(32)
+
+        # # #
+
+        start = PulseSynchronizer("sys", cd)
+        self.submodules += start
+        self.comb += start.i.eq(self._control.fields.start)
+
+        rddata = []
+        for n, port in enumerate(ports):
+            lane = ClockDomainsRenamer(cd)(_EyeScanLane(port, depth))
+            setattr(self.submodules, "lane{}".format(n), lane)
+            self.comb += [
+                lane.source.connect(drp.sinks[n]),
+                drp.sources[n].connect(lane.sink),
+                lane.start.eq(start.o & self._control.fields.lanes[n]),
+            ]
+            self.specials += [
+                XPMMultiReg(self._control.fields.prescale, lane.prescale, odomain=cd, n=4),
+                XPMMultiReg(self._horz.fields.start, lane.h_start, odomain=cd, n=4),
+                XPMMultiReg(self._horz.fields.step, lane.h_step, odomain=cd, n=4),
+                XPMMultiReg(self._horz.fields.count, lane.h_count, odomain=cd, n=4),
+                XPMMultiReg(self._vert.fields.start, lane.v_start, odomain=cd, n=4),
+                XPMMultiReg(self._vert.fields.step, lane.v_step, odomain=cd, n=4),
+                XPMMultiReg(self._vert.fields.count, lane.v_count, odomain=cd, n=4),
+                XPMMultiReg(lane.busy, self._status.fields.busy[n], odomain="sys", n=4),
+                XPMMultiReg(lane.error, self._status.fields.error[n], odomain="sys", n=4),
+            ]
+            self.specials += lane.mem
+            rdport = lane.mem.get_port()
+            self.specials += rdport
+            self.comb += rdport.adr.eq(self._mem_sel.fields.addr)
+            rddata.append(rdport.dat_r)
+        self.comb += self._mem_data.status.eq(Array(rddata)[self._mem_sel.fields.lane])
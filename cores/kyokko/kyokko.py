@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 from migen import *
 from litex.soc.interconnect import stream
+from litex.soc.interconnect.packet import Header, HeaderField
 from cores.kyokko.phy.phy_usp_gty import USPGTY4
 import os.path
 from litex.build.xilinx import XilinxPlatform
 
 from cores.xpm_fifo import XPMAsyncStreamFIFO
+from cores.kyokko.layout import kyokkoPriorityDesc
 
 # create_ip -vlnv xilinx.com:ip:fifo_generator:* -module_name 
 _xilinx_fifo_66x512_async_ip = {
@@ -100,10 +102,93 @@ class Kyokko(Module):
     def do_finalize(self):
         self.specials += Instance("kyokko_cb_wrapper", **self.kyokko_params)
 
+# Priority message header, where K2MM frames carry their magic
+_priority_magic = 0x5052
+_priority_header = Header({"magic": HeaderField(0, 0, 16)}, 2, swap_field_bytes=True)
+
+class _PriorityTxMux(Module):
+    """ Send priority messages between data frames
+
+    A waiting message is sent as soon as the current data frame ends, ahead
+    of the frames queued behind it. Each message is a one-beat link frame:
+    the priority header, then the message data.
+    """
+    def __init__(self, lanes=4):
+        self.sink_data = sink_data = stream.Endpoint([("data", 64 * lanes)])
+        self.sink_prio = sink_prio = stream.Endpoint(kyokkoPriorityDesc(lanes))
+        self.source    = source    = stream.Endpoint([("data", 64 * lanes)])
+
+        # # #
+
+        header = Record([("magic", 16)])
+        self.comb += header.magic.eq(_priority_magic)
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            If(sink_prio.valid,
+                source.valid.eq(1),
+                *_priority_header.encode(header, source.data),
+                source.data[16:].eq(sink_prio.data),
+                source.last.eq(1),
+                sink_prio.ready.eq(source.ready)
+            ).Else(
+                sink_data.connect(source),
+                If(source.valid & source.ready & ~source.last,
+                    NextState("DATA")
+                )
+            )
+        )
+        fsm.act("DATA",
+            sink_data.connect(source),
+            If(source.valid & source.ready & source.last,
+                NextState("IDLE")
+            )
+        )
+
+class _PriorityRxDemux(Module):
+    """ Take priority messages out of the received link frames
+
+    `sink` has no backpressure. A message the priority FIFO cannot take is
+    dropped and counted in `dropped`.
+    """
+    def __init__(self, lanes=4):
+        self.sink        = sink        = stream.Endpoint([("data", 64 * lanes)])
+        self.source_data = source_data = stream.Endpoint([("data", 64 * lanes)])
+        self.source_prio = source_prio = stream.Endpoint(kyokkoPriorityDesc(lanes))
+
+        self.dropped = Signal(32)
+
+        # # #
+
+        first  = Signal(reset=1)
+        header = Record([("magic", 16)])
+        is_prio = Signal()
+        self.comb += [
+            *_priority_header.decode(sink.data, header),
+            is_prio.eq(first & sink.last & (header.magic == _priority_magic)),
+            If(is_prio,
+                source_prio.valid.eq(sink.valid),
+                source_prio.data.eq(sink.data[16:]),
+                source_prio.last.eq(1),
+            ).Else(
+                sink.connect(source_data),
+            ),
+        ]
+        self.sync += [
+            If(sink.valid,
+                first.eq(sink.last)
+            ),
+            If(source_prio.valid & ~source_prio.ready,
+                self.dropped.eq(self.dropped + 1)
+            ),
+        ]
+
 from litex.soc.interconnect.csr import *
 from migen.genlib.cdc import PulseSynchronizer, BusSynchronizer, MultiReg
 class KyokkoBlock(Module, AutoCSR):
-    def __init__(self, platform, pads, refclk, cd="sys", cd_freerun="sys", lanes=4):
+    def __init__(self, platform, pads, refclk, cd="sys", cd_freerun="sys", lanes=4, with_priority=False,
+        freerun_clk_freq=int(100e6), watchdog_wait_ms=None, watchdog_max_shift=4,
+        watchdog_soft_err_limit=1000):
         _dp_layout = stream.EndpointDescription([
                 ("data", 64 * lanes),
                 # ("keep", (64 * lanes) // 8)
@@ -138,10 +223,10 @@ class KyokkoBlock(Module, AutoCSR):
         ])
 
         # Status Register
-        self.specials += MultiReg(channel_up, self._status.fields.channel_up, odomain=cd, n=2)
+        self.specials += MultiReg(channel_up, self._status.fields.channel_up, odomain="sys", n=2)
         
         lane_up = Signal(lanes)
-        self.specials += MultiReg(lane_up, self._status.fields.lane_up, odomain=cd, n=2)
+        self.specials += MultiReg(lane_up, self._status.fields.lane_up, odomain="sys", n=2)
         import util.xilinx_ila
         for ep in [cdc_tx.source, cdc_rx.sink]:
             for s in [ep.valid, ep.ready, ep.last]:
@@ -162,9 +247,22 @@ class KyokkoBlock(Module, AutoCSR):
         else:
             self.gt_refclk = refclk
 
+        # Automatic recovery
+        # The core reset is a pulse, the GT reset runs inside the core
+        from cores.kyokko.aurora import _LinkWatchdog, _watchdog_wait, add_watchdog_csrs
+        self.submodules.watchdog = watchdog = ClockDomainsRenamer(cd_freerun)(
+            _LinkWatchdog(
+                wait           = _watchdog_wait(freerun_clk_freq, 0, watchdog_wait_ms),
+                max_shift      = watchdog_max_shift,
+                soft_err_limit = watchdog_soft_err_limit))
+        self.specials += MultiReg(channel_up, watchdog.channel_up, odomain=cd_freerun, n=2)
+        add_watchdog_csrs(self, watchdog, cd_freerun)
+        core_reset = Signal()
+        self.comb += core_reset.eq(self._reset.fields.reset_pb | watchdog.reset)
+
         self.core_params = dict(
             i_clk         = ClockSignal(cd_freerun),
-            i_reset       = self._reset.fields.reset_pb,
+            i_reset       = core_reset,
             o_channel_up  = channel_up,
             o_lane_up     = lane_up,
             o_user_clk    = ClockSignal(cd="datapath"),
@@ -185,6 +283,52 @@ class KyokkoBlock(Module, AutoCSR):
             o_gtytxp            = pads.tx_p,
             i_gt_refclk     = self.gt_refclk,
         )
+        if with_priority:
+            self._add_priority(lanes, cd)
+
+    def _add_priority(self, lanes, cd):
+        """ Priority message endpoints (`sink_prio_tx`, `source_prio_rx`)
+
+        Messages bypass `cdc_tx` through their own small CDC FIFOs and are
+        carried in-band: they wait at most for the end of the data frame on
+        the link, not for the frames queued in `cdc_tx`. The first beat of a
+        data frame must not start with the priority header (K2MM frames
+        start with their own magic).
+        """
+        self.sink_prio_tx   = stream.Endpoint(kyokkoPriorityDesc(lanes))
+        self.source_prio_rx = stream.Endpoint(kyokkoPriorityDesc(lanes))
+
+        self.submodules.cdc_prio_tx = cdc_prio_tx = ClockDomainsRenamer({"write" : cd, "read" : "datapath"})(
+            XPMAsyncStreamFIFO(self.sink_prio_tx.description, depth=16, buffered=False, sync_stages=4, reset="source"))
+        self.submodules.cdc_prio_rx = cdc_prio_rx = ClockDomainsRenamer({"write" : "datapath", "read" : cd})(
+            XPMAsyncStreamFIFO(self.source_prio_rx.description, depth=16, buffered=False, sync_stages=4))
+        self.submodules.prio_tx = prio_tx = ClockDomainsRenamer("datapath")(_PriorityTxMux(lanes))
+        self.submodules.prio_rx = prio_rx = ClockDomainsRenamer("datapath")(_PriorityRxDemux(lanes))
+        self.comb += [
+            self.sink_prio_tx.connect(cdc_prio_tx.sink),
+            cdc_prio_tx.source.connect(prio_tx.sink_prio),
+            self.cdc_tx.source.connect(prio_tx.sink_data),
+            prio_rx.source_data.connect(self.cdc_rx.sink),
+            prio_rx.source_prio.connect(cdc_prio_rx.sink),
+            cdc_prio_rx.source.connect(self.source_prio_rx),
+        ]
+
+        self._prio_rx_dropped = CSRStatus(32, description="Priority messages dropped on RX FIFO overflow")
+        self.submodules.prio_dropped_sync = dropped_sync = BusSynchronizer(32, "datapath", "sys")
+        self.comb += [
+            dropped_sync.i.eq(prio_rx.dropped),
+            self._prio_rx_dropped.status.eq(dropped_sync.o),
+        ]
+
+        self.core_params.update(
+            i_s_axis_tx_tdata   = prio_tx.source.data,
+            i_s_axis_tx_tlast   = prio_tx.source.last,
+            i_s_axis_tx_tvalid  = prio_tx.source.valid,
+            o_s_axis_tx_tready  = prio_tx.source.ready,
+            o_m_axis_rx_tdata   = prio_rx.sink.data,
+            o_m_axis_rx_tlast   = prio_rx.sink.last,
+            o_m_axis_rx_tvalid  = prio_rx.sink.valid,
+        )
 
     def do_finalize(self):
         self.specials += Instance("kyokko_gty4", **self.core_params, name="kyokko_gty4_i")
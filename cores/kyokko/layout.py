@@ -4,6 +4,25 @@ def kyokkoStreamDesc(lanes=4):
     return EndpointDescription(
         [
             ("data", 64 * lanes),
-            # ("keep", (64 * lanes) // 8)
+            ("keep", (64 * lanes) // 8)
         ]
-    )
\ No newline at end of file
+    )
+# RX user data, `error` marks frames truncated by an overflow
+def kyokkoRxStreamDesc(lanes=4):
+    from litex.soc.interconnect.stream import EndpointDescription
+    return EndpointDescription(
+        [
+            ("data", 64 * lanes),
+            ("keep", (64 * lanes) // 8),
+            ("error", 1),
+        ]
+    )
+# Priority message (KyokkoBlock `with_priority`): one link beat less the
+# 16-bit header
+def kyokkoPriorityDesc(lanes=4):
+    from litex.soc.interconnect.stream import EndpointDescription
+    return EndpointDescription(
+        [
+            ("data", 64 * lanes - 16),
+        ]
+    )
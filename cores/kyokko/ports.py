@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+import re
+from collections import namedtuple
+
+from migen import *
+from litex.build.generic_platform import PlatformInfo
+
+from cores.kyokko.adapter import k2mm_to_link, link_to_k2mm
+
+# (name, number) of the GTY pads and of the reference clock of one port
+LinkPortSpec = namedtuple("LinkPortSpec", ["pads", "refclk"])
+
+LinkPort = namedtuple("LinkPort", ["link", "k2mm", "ctrl", "pads"])
+
+def tfoil_ports(quads):
+    """ Trefoil ports on GTY `quads` (e.g. [120, 121, 221]); each pair of
+    quads shares the clock generator reference of its odd quad """
+    return [LinkPortSpec(("GTY{}".format(q), 0), ("MGTREFCLK_{}_".format(q | 1), 0)) for q in quads]
+
+def vcu1525_ports(n=2):
+    return [LinkPortSpec(("qsfp", i), ("qsfp{}_refclk1".format(i), 0)) for i in range(n)]
+
+def _platform_info(platform, name, number):
+    """ PlatformInfo of a resource, requested or not """
+    cm = platform.constraint_manager
+    for resource in cm.available + [r for r, obj in cm.matched]:
+        if resource[0] == name and resource[1] == number:
+            for element in resource[2:]:
+                if isinstance(element, PlatformInfo):
+                    return element.info
+    return {}
+
+def _refclk_quad(platform, name, number):
+    """ (x, y) of the quad a reference clock enters: its own `quad` info,
+    else the quad of "MGTREFCLK_<bank>_" or of port n for "<port><n>_refclk" """
+    from cores.kyokko.aurora import _parse_quad
+    info = _platform_info(platform, name, number)
+    if "quad" not in info:
+        m = re.fullmatch(r"MGTREFCLK_(\d+)_", name)
+        if m is not None:
+            info = _platform_info(platform, "GTY" + m.group(1), 0)
+        m = re.match(r"([a-z]+)(\d+)_refclk", name)
+        if m is not None:
+            info = _platform_info(platform, m.group(1), int(m.group(2)))
+    if "quad" not in info:
+        raise ValueError("Cannot locate the quad of {}{}".format(name, number))
+    return _parse_quad(info["quad"])
+
+def add_link_ports(soc, platform, specs, phy="aurora", locked=0, cd="sys",
+    cd_freerun="clk100", freerun_clk_freq=int(100e6), with_k2mm=True, ila_ports=(0,),
+    link_kwargs=None, k2mm_kwargs=None):
+    """ Add one link per `specs` entry to `soc`
+
+    Port n is `ky_<n>` (Aurora64b66b with `phy="aurora"`, KyokkoBlock with
+    `phy="kyokko"`), `k2mm_<n>` and `k2mmctrl_<n>` (without `with_k2mm`,
+    only the link). The K2MMs and the user side of the links run in clock
+    domain `cd`, their CSRs in sys. Ports on the same reference clock share one
+    IBUFDS_GTE4. A reference clock reaches two quads above and below its
+    own in the same column. Returns a list of `LinkPort`.
+    """
+    from cores.tf.framing import K2MM, K2MMControl
+    from cores.kyokko.aurora import Aurora64b66b, _parse_quad
+    from cores.kyokko.kyokko import KyokkoBlock
+    if phy not in ["aurora", "kyokko"]:
+        raise ValueError("Unknown link PHY: {}".format(phy))
+
+    pads = [platform.request(*spec.pads) for spec in specs]
+
+    # Reference clocks, buffered here when shared
+    refclks = {}
+    for spec, p in zip(specs, pads):
+        refclks.setdefault(spec.refclk, []).append(p)
+    for (name, number), users in refclks.items():
+        rx, ry = _refclk_quad(platform, name, number)
+        for p in users:
+            x, y = _parse_quad(p.platform_info['quad'])
+            if x != rx or abs(y - ry) > 2:
+                raise ValueError("{}{} cannot reach {}".format(name, number, p.platform_info['quad']))
+        pad = platform.request(name, number)
+        if len(users) == 1:
+            refclks[(name, number)] = pad
+            continue
+        refclk = Signal(name="gtref_{}{}".format(name, number))
+        soc.specials += Instance("IBUFDS_GTE4",
+            name = "gtref_{}{}_b".format(name, number),
+            i_I   = pad.p,
+            i_IB  = pad.n,
+            i_CEB = 0b0,
+            o_O   = refclk)
+        refclks[(name, number)] = refclk
+
+    ports = []
+    for n, (spec, p) in enumerate(zip(specs, pads)):
+        if phy == "aurora":
+            link = Aurora64b66b(platform, p, refclks[spec.refclk], cd=cd,
+                cd_freerun=cd_freerun, freerun_clk_freq=freerun_clk_freq,
+                with_ila=n in ila_ports, **dict(link_kwargs or {}))
+        else:
+            link = KyokkoBlock(platform, p, refclks[spec.refclk], cd=cd,
+                cd_freerun=cd_freerun, freerun_clk_freq=freerun_clk_freq, **dict(link_kwargs or {}))
+        setattr(soc.submodules, "ky_{}".format(n), link)
+        soc.comb += link.init_clk_locked.eq(locked)
+
+        k2mm = ctrl = None
+        if with_k2mm:
+            k2mm = ClockDomainsRenamer(cd)(K2MM(dw=256, **dict(k2mm_kwargs or {})))
+            ctrl = K2MMControl(k2mm, dw=256, cd=cd)
+            setattr(soc.submodules, "k2mm_{}".format(n), k2mm)
+            setattr(soc.submodules, "k2mmctrl_{}".format(n), ctrl)
+            soc.comb += [
+                link_to_k2mm(link.source_user_rx, k2mm.sink_packet_rx),
+                k2mm_to_link(k2mm.source_packet_tx, link.sink_user_tx),
+                ctrl.source_ctrl.connect(k2mm.sink_tester_ctrl),
+            ]
+        ports.append(LinkPort(link, k2mm, ctrl, p))
+    return ports
@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+from migen import *
+from liteeth.common import eth_udp_user_description
+from litex.soc.interconnect.stream import Endpoint
+
+from cores.kyokko.adapter import k2mm_to_link, link_to_k2mm
+from cores.kyokko.layout import kyokkoStreamDesc
+
+class DUT(Module):
+    """ K2MM -> link -> K2MM through the adapters """
+    def __init__(self, lanes=4):
+        self.tx   = Endpoint(eth_udp_user_description(64 * lanes))
+        self.link = Endpoint(kyokkoStreamDesc(lanes))
+        self.rx   = Endpoint(eth_udp_user_description(64 * lanes))
+        self.comb += [
+            k2mm_to_link(self.tx, self.link),
+            link_to_k2mm(self.link, self.rx),
+        ]
+
+def test(lanes=4):
+    dut = DUT(lanes)
+    nbytes = 8 * lanes
+
+    def gen():
+        yield dut.tx.valid.eq(1)
+        yield dut.rx.ready.eq(1)
+        # Body beat: all bytes valid, no last_be
+        yield dut.tx.last.eq(0)
+        yield dut.tx.last_be.eq(0)
+        yield
+        assert (yield dut.link.keep) == 2**nbytes - 1
+        assert (yield dut.rx.last_be) == 0
+        # Last beat with 1..nbytes valid bytes
+        for n in range(1, nbytes + 1):
+            yield dut.tx.last.eq(1)
+            yield dut.tx.last_be.eq(1 << (n - 1))
+            yield
+            assert (yield dut.link.keep) == 2**n - 1
+            assert (yield dut.rx.last_be) == 1 << (n - 1)
+        # Producers without last_be send full beats
+        yield dut.tx.last_be.eq(0)
+        yield
+        assert (yield dut.link.keep) == 2**nbytes - 1
+        assert (yield dut.rx.last_be) == 1 << (nbytes - 1)
+
+    run_simulation(dut, gen())
+    print("keep/last_be round trip OK for {} bytes per beat".format(nbytes))
+
+if __name__ == "__main__":
+    test()
+    test(lanes=1)
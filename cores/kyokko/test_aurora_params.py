@@ -0,0 +1,14 @@
+#!/usr/bin/python3
+from cores.kyokko.aurora import _check_line_rate, _parse_quad
+
+if __name__ == "__main__":
+    for line_rate, refclk in [(25.78125, 161.1328125), (10.3125, 156.25), (28.125, 156.25), (32.75, 409.375)]:
+        _check_line_rate(line_rate, refclk)
+    for line_rate, refclk in [(40.0, 156.25), (25.78125, 20.0), (25.78125, 900.0)]:
+        try:
+            _check_line_rate(line_rate, refclk)
+        except ValueError as e:
+            print("rejected: {}".format(e))
+        else:
+            raise AssertionError("{} Gbps / {} MHz accepted".format(line_rate, refclk))
+    assert _parse_quad("Quad_X1Y12") == (1, 12)
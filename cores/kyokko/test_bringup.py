@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+from migen import *
+from cores.kyokko.aurora import _BringupTimer
+
+class DUT(Module):
+    def __init__(self):
+        self.submodules.timer = _BringupTimer(["locked", "reset_done", "channel_up"])
+
+    def run_sim(self, **args):
+        t = self.timer
+        result = []
+
+        def test():
+            st = t.stages
+            yield st["locked"].eq(1)
+            for _ in range(10):
+                yield
+            yield st["reset_done"].eq(1)
+            for _ in range(20):
+                yield
+            yield st["channel_up"].eq(1)
+            yield
+            # Link reset: reset_done drops and comes back
+            yield t.restart.eq(1)
+            yield
+            yield t.restart.eq(0)
+            yield st["reset_done"].eq(0)
+            yield st["channel_up"].eq(0)
+            for _ in range(5):
+                yield
+            yield st["reset_done"].eq(1)
+            for _ in range(7):
+                yield
+            yield st["channel_up"].eq(1)
+            for _ in range(3):
+                yield
+            for name in ["locked", "reset_done", "channel_up"]:
+                result.append((yield t.timestamps[name]))
+
+        run_simulation(self, test(), **args)
+        print("timestamps after restart: {}".format(result))
+        # locked stayed high, the others are timed from the restart
+        assert result == [0, 5, 12]
+
+if __name__ == "__main__":
+    dut = DUT()
+    dut.run_sim()
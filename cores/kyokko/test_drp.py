@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+import random
+
+from migen import *
+from cores.kyokko.drp import DRPArbiter, drp_layout
+
+class DUT(Module):
+    def __init__(self, nports=4, masters=2):
+        self.ports = [Record(drp_layout) for _ in range(nports)]
+        self.submodules.arbiter = DRPArbiter(self.ports, masters=masters, timeout=32)
+
+    def run_sim(self, accesses=20, **args):
+        regs = [{} for _ in self.ports]
+        results = [[] for _ in self.arbiter.sinks]
+
+        @passive
+        def drp_port(n, port, dead=False):
+            # GTY DRP model: rdy a few cycles after en
+            while True:
+                yield
+                if (yield port.en):
+                    addr, we, di = (yield port.addr), (yield port.we), (yield port.di)
+                    if dead:
+                        continue
+                    for _ in range(random.randint(1, 5)):
+                        yield
+                    if we:
+                        regs[n][addr] = di
+                    yield port.do.eq(regs[n].get(addr, 0))
+                    yield port.rdy.eq(1)
+                    yield
+                    yield port.rdy.eq(0)
+
+        def master(m):
+            sink, source = self.arbiter.sinks[m], self.arbiter.sources[m]
+            yield source.ready.eq(1)
+            for i in range(accesses):
+                port = random.randrange(len(self.ports) - 1)
+                addr = (m << 4) | (i % 4)
+                we = i < 4
+                yield sink.port.eq(port)
+                yield sink.addr.eq(addr)
+                yield sink.data.eq((m << 12) | (port << 8) | i)
+                yield sink.we.eq(we)
+                yield sink.valid.eq(1)
+                yield
+                while (yield sink.ready) == 0:
+                    yield
+                yield sink.valid.eq(0)
+                while (yield source.valid) == 0:
+                    yield
+                results[m].append((yield source.data))
+                yield
+            # Unresponsive and nonexistent ports
+            for port in [len(self.ports) - 1, len(self.ports)]:
+                yield sink.port.eq(port)
+                yield sink.valid.eq(1)
+                yield
+                while (yield source.valid) == 0:
+                    yield
+                results[m].append("error" if (yield source.error) else None)
+                yield sink.valid.eq(0)
+                yield
+
+        generators = [master(m) for m in range(len(self.arbiter.sinks))]
+        generators += [drp_port(n, p, dead=n == len(self.ports) - 1) for n, p in enumerate(self.ports)]
+        run_simulation(self, generators, **args)
+
+        for m, r in enumerate(results):
+            assert len(r) == accesses + 2
+            assert r[-2:] == ["error", "error"]
+            # Writes return the written value, reads the last written one
+            assert all(d >> 12 == m for d in r[:accesses] if d), r
+        print("accesses per master: {}".format([len(r) for r in results]))
+
+if __name__ == "__main__":
+    random.seed(1)
+    dut = DUT()
+    dut.run_sim()
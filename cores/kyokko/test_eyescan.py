@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+import random
+
+from migen import *
+from cores.kyokko.drp import DRPArbiter, drp_layout
+from cores.kyokko.eyescan import *
+from cores.kyokko.eyescan import _EyeScanLane
+
+class DUT(Module):
+    def __init__(self, lanes=2, depth=64):
+        self.ports = [Record(drp_layout) for _ in range(lanes)]
+        self.submodules.arbiter = DRPArbiter(self.ports, masters=lanes)
+        self.lanes = []
+        for n in range(lanes):
+            lane = _EyeScanLane(n, depth)
+            self.submodules += lane
+            self.specials += lane.mem
+            self.comb += [
+                lane.source.connect(self.arbiter.sinks[n]),
+                self.arbiter.sources[n].connect(lane.sink),
+            ]
+            self.lanes.append(lane)
+
+def _signed(x, w):
+    return x - (1 << w) if x & (1 << (w - 1)) else x
+
+def _errors(lane, h, v, ut):
+    # Eye opening of +-8 horizontal and +-20 vertical, UT=1 sees a few more
+    return 0 if abs(h) < 8 and abs(v) < 20 else 10 * (lane + 1) + ut
+
+@passive
+def gty(n, port, regs):
+    # DRP and eye scan state machine model
+    countdown = 0
+    while True:
+        yield
+        if countdown:
+            countdown -= 1
+            if countdown == 0:
+                r = regs[n]
+                vs = r.get(RX_EYESCAN_VS, 0)
+                vo = (vs >> 2) & 0x7f
+                vo = -vo if vs & (1 << 10) else vo
+                ho = _signed(r.get(ES_HORZ_OFFSET, 0) >> 4, 12)
+                r[ES_ERROR_COUNT] = _errors(n, ho, vo, (vs >> 9) & 1)
+                r[ES_SAMPLE_COUNT] = 100
+                r[ES_CONTROL_STATUS] = 0b0101
+        if (yield port.en):
+            addr, we, di = (yield port.addr), (yield port.we), (yield port.di)
+            for _ in range(random.randint(1, 3)):
+                yield
+            if we:
+                regs[n][addr] = di
+                if addr == ES_CONTROL:
+                    if di >> 10 == 1:
+                        countdown = 20
+                        regs[n]["runs"] = regs[n].get("runs", 0) + 1
+                    else:
+                        regs[n][ES_CONTROL_STATUS] = 0
+            yield port.do.eq(regs[n].get(addr, 0))
+            yield port.rdy.eq(1)
+            yield
+            yield port.rdy.eq(0)
+
+def run(lanes=2, h=(-12, 4, 7), v=(-40, 20, 5), depth=64):
+    dut = DUT(lanes, depth)
+    # A count of 0 scans one point, the scan stops once the memory is full
+    hn, vn = max(h[2], 1), max(v[2], 1)
+    points = min(hn * vn, depth)
+    regs = [{ES_CONTROL: 0x0300} for _ in range(lanes)]
+
+    result = []
+    def control():
+        for lane in dut.lanes:
+            yield lane.prescale.eq(3)
+            yield lane.h_start.eq(h[0] & 0xfff)
+            yield lane.h_step.eq(h[1])
+            yield lane.h_count.eq(h[2])
+            yield lane.v_start.eq(v[0])
+            yield lane.v_step.eq(v[1])
+            yield lane.v_count.eq(v[2])
+            yield lane.start.eq(1)
+        yield
+        for lane in dut.lanes:
+            yield lane.start.eq(0)
+        yield
+        cycles = 0
+        while True:
+            b = []
+            for lane in dut.lanes:
+                b.append((yield lane.busy))
+            if not any(b):
+                break
+            yield
+            cycles += 1
+        for n, lane in enumerate(dut.lanes):
+            words = []
+            for a in range(points):
+                words.append((yield lane.mem[a]))
+            result.append(words)
+            assert (yield lane.error) == 0
+            assert (yield lane.busy) == 0
+        print("{} lanes, {} points each, {} cycles".format(lanes, points, cycles))
+
+    run_simulation(dut, [control()] + [gty(n, p, regs) for n, p in enumerate(dut.ports)])
+
+    for n, words in enumerate(result):
+        for j in range((points + hn - 1) // hn):
+            row = ""
+            for i in range(min(hn, points - j * hn)):
+                w = words[j * hn + i]
+                ho, vo = h[0] + i * h[1], v[0] + j * v[1]
+                assert w & 0xffff == 200
+                assert w >> 16 == _errors(n, ho, vo, 0) + _errors(n, ho, vo, 1), (n, ho, vo, hex(w))
+                row += "." if w >> 16 == 0 else "#"
+            print("lane{} v={:4d} {}".format(n, v[0] + j * v[1], row))
+        # Prescale kept, eye scan enables untouched, scan stopped
+        assert regs[n][ES_CONTROL] == 0x0303
+        # Each stored point measured with both UT signs, nothing beyond
+        assert regs[n]["runs"] == 2 * points
+
+if __name__ == "__main__":
+    random.seed(1)
+    run()
+    # More points than memory: row 0 (inside the eye) is not overwritten
+    run(lanes=1, h=(-12, 4, 10), v=(-10, 10, 7))
+    # Counts of 0
+    run(lanes=1, h=(0, 4, 0), v=(0, 10, 0))
+    run(lanes=1, h=(-12, 4, 3), v=(0, 10, 0))
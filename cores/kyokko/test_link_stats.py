@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+from migen import *
+from cores.kyokko.aurora import _LinkStats
+
+class DUT(Module):
+    def __init__(self):
+        self.submodules.stats = _LinkStats(lanes=2, width=4)
+
+    def run_sim(self, **args):
+        s = self.stats
+        result = {}
+
+        def test():
+            yield s.lane_up.eq(0b11)
+            yield s.channel_up.eq(1)
+            for _ in range(10):
+                yield
+            # Lane 1 drops, then the channel
+            yield s.lane_up.eq(0b01)
+            yield
+            yield s.channel_up.eq(0)
+            yield s.hard_err.eq(1)
+            yield
+            yield s.hard_err.eq(0)
+            yield s.lane_up.eq(0b00)
+            for _ in range(3):
+                yield
+            yield s.lane_up.eq(0b11)
+            yield s.channel_up.eq(1)
+            for _ in range(5):
+                yield
+            # Soft error burst longer than the counter range
+            yield s.soft_err.eq(1)
+            for _ in range(20):
+                yield
+            yield s.soft_err.eq(0)
+            yield
+            for name in ["soft_errors", "hard_errors", "channel_down", "uptime"]:
+                result[name] = (yield getattr(s, name))
+            result["lane_down"] = []
+            for l in s.lane_down:
+                result["lane_down"].append((yield l))
+
+        run_simulation(self, test(), **args)
+        print(result)
+        assert result["soft_errors"] == 15
+        assert result["hard_errors"] == 1
+        assert result["channel_down"] == 1
+        assert result["lane_down"] == [1, 1]
+        assert result["uptime"] == 15
+
+if __name__ == "__main__":
+    dut = DUT()
+    dut.run_sim()
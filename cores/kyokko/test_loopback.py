@@ -0,0 +1,44 @@
+#!/usr/bin/python3
+from migen import *
+from migen.fhdl.structure import _Assign
+from migen.fhdl.tools import list_signals
+from litex_boards.platforms.xilinx_vcu1525 import Platform
+
+from cores.kyokko.aurora import Aurora64b66b, _LoopbackControl
+
+def _instance(fragment, of):
+    inst, = [s for s in fragment.specials if isinstance(s, Instance) and s.of == of]
+    return {item.name: item.expr for item in inst.items if hasattr(item, "expr")}
+
+def run_sim():
+    dut = _LoopbackControl()
+    resets = []
+
+    def test():
+        # Normal operation, near-end PMA loopback, far-end PMA loopback
+        for mode in [0, 0b010, 0b100]:
+            yield dut.mode.eq(mode)
+            for _ in range(8):
+                yield
+                resets.append((yield dut.reset))
+
+    run_simulation(dut, test())
+    return resets
+
+if __name__ == "__main__":
+    resets = run_sim()
+    # One reset pulse per mode change, none while the mode is held
+    assert sum(resets[:8]) == 0
+    assert sum(resets[8:16]) == 1
+    assert sum(resets[16:]) == 1
+
+    # The CSR reaches the core's loopback port and the reset sequencer
+    platform = Platform()
+    aurora = Aurora64b66b(platform, platform.request("qsfp", 0), platform.request("qsfp0_refclk1"),
+        with_ila=False)
+    f = aurora.get_fragment()
+    assert _instance(f, aurora.refname)["loopback"] is aurora.loopback
+    ext_reset = _instance(f, "aurora_reset_seq")["ext_reset_in"]
+    drivers = [s for s in f.comb if isinstance(s, _Assign) and s.l is ext_reset]
+    assert len(drivers) == 1
+    assert any(sig is aurora.loopback_ctrl.reset for sig in list_signals(drivers[0].r))
@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+from migen import *
+from litex_boards.platforms import ted_tfoil, xilinx_vcu1525
+
+from cores.kyokko.ports import LinkPortSpec, add_link_ports, tfoil_ports, vcu1525_ports
+
+class _SoC(Module):
+    def __init__(self, platform, specs, cd="sys", phy="kyokko"):
+        self.ports = add_link_ports(self, platform, specs, phy=phy, cd=cd, ila_ports=())
+
+if __name__ == "__main__":
+    specs = tfoil_ports([120, 121, 122])
+    assert [s.refclk for s in specs] == [("MGTREFCLK_121_", 0), ("MGTREFCLK_121_", 0), ("MGTREFCLK_123_", 0)]
+
+    soc = _SoC(ted_tfoil.Platform(), specs)
+    assert [soc.ky_0, soc.ky_1, soc.ky_2] == [p.link for p in soc.ports]
+    assert [soc.k2mm_0, soc.k2mm_1, soc.k2mm_2] == [p.k2mm for p in soc.ports]
+    # 120/121 share one buffer, 122 alone buffers its own reference clock
+    bufs = [s for s in soc._fragment.specials if isinstance(s, Instance) and s.of == "IBUFDS_GTE4"]
+    assert len(bufs) == 1
+    assert soc.ky_0.get_refclk() is soc.ky_1.get_refclk()
+    assert soc.ky_2.get_refclk() is not soc.ky_0.get_refclk()
+
+    # A reference clock reaches two quads up and down of its own, not across
+    # columns, whether shared or not
+    for quads in [[120, 125], [121, 221], [120, 124], [124]]:
+        specs = [LinkPortSpec(("GTY{}".format(q), 0), ("MGTREFCLK_121_", 0)) for q in quads]
+        try:
+            _SoC(ted_tfoil.Platform(), specs)
+        except ValueError as e:
+            print("rejected: {}".format(e))
+        else:
+            raise AssertionError("{} accepted".format(quads))
+
+    # Aurora links, shared and per-port reference clocks
+    soc = _SoC(ted_tfoil.Platform(), tfoil_ports([122, 123]), phy="aurora")
+    assert soc.ky_0.ip_params["i_refclk_in"] is soc.ky_1.ip_params["i_refclk_in"]
+    soc = _SoC(xilinx_vcu1525.Platform(), vcu1525_ports(), phy="aurora")
+    assert [p.pads.platform_info["quad"] for p in soc.ports] == ["Quad_X1Y12", "Quad_X1Y11"]
+
+    # K2MM on a datapath clock, CSRs stay in sys
+    soc = _SoC(ted_tfoil.Platform(), tfoil_ports([121]), cd="dp")
+    assert set(soc.k2mm_0.get_fragment().sync) == {"dp"}
+    ctrl = soc.k2mmctrl_0.get_fragment()
+    cdc = [s for s in ctrl.specials if getattr(s, "of", None) == "xpm_fifo_axis"]
+    assert len(cdc) == 1
+    clocks = {i.name: i.expr.cd for i in cdc[0].items if i.name in ("s_aclk", "m_aclk")}
+    assert clocks == {"s_aclk": "sys", "m_aclk": "dp"}
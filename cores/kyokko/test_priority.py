@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+import random
+
+from migen import *
+from litex_boards.platforms import ted_tfoil
+
+from cores.kyokko.kyokko import KyokkoBlock, _PriorityTxMux, _PriorityRxDemux
+
+class DUT(Module):
+    def __init__(self):
+        self.submodules.tx = tx = _PriorityTxMux(lanes=1)
+        self.submodules.rx = rx = _PriorityRxDemux(lanes=1)
+        # Link: the core takes a beat when `link_ready`, no backpressure on RX
+        self.link_ready = Signal()
+        self.comb += [
+            tx.source.ready.eq(self.link_ready),
+            rx.sink.valid.eq(tx.source.valid & self.link_ready),
+            rx.sink.data.eq(tx.source.data),
+            rx.sink.last.eq(tx.source.last),
+        ]
+
+    def run_sim(self, frames=[40, 3, 25, 30], messages=[10, 30, 31, 100], **args):
+        """ `messages`: cycles at which a priority message is sent """
+        out = []   # (cycle, beat) on the link
+        data = []  # (data, last) received
+        prio = []  # Priority messages received
+
+        def data_driver():
+            ep = self.tx.sink_data
+            n = 0
+            for length in frames:
+                for i in range(length):
+                    yield ep.data.eq(n)
+                    yield ep.last.eq(i == length - 1)
+                    yield ep.valid.eq(1)
+                    yield
+                    while (yield ep.ready) == 0:
+                        yield
+                    n += 1
+            yield ep.valid.eq(0)
+            for _ in range(100):
+                yield
+
+        def prio_driver():
+            ep = self.tx.sink_prio
+            cycle = 0
+            for at in messages:
+                while cycle < at:
+                    yield
+                    cycle += 1
+                yield ep.data.eq(0x8000 | at)
+                yield ep.valid.eq(1)
+                yield
+                cycle += 1
+                while (yield ep.ready) == 0:
+                    yield
+                    cycle += 1
+                yield ep.valid.eq(0)
+
+        @passive
+        def link():
+            # Link model: the core accepts a beat now and then
+            cycle = 0
+            while True:
+                yield self.link_ready.eq(random.random() > 0.2)
+                yield self.rx.source_prio.ready.eq(1)
+                yield
+                cycle += 1
+                if (yield self.rx.sink.valid):
+                    out.append(cycle)
+                if (yield self.rx.source_data.valid):
+                    data.append(((yield self.rx.source_data.data), (yield self.rx.source_data.last)))
+                if (yield self.rx.source_prio.valid):
+                    prio.append(((yield self.rx.source_prio.data), cycle))
+
+        run_simulation(self, [data_driver(), prio_driver(), link()], **args)
+
+        # Data frames intact, messages out of band
+        assert [d for d, _ in data] == list(range(sum(frames)))
+        ends = [sum(frames[:i + 1]) - 1 for i in range(len(frames))]
+        assert [i for i, (_, last) in enumerate(data) if last] == ends
+        assert [d for d, _ in prio] == [0x8000 | at for at in messages]
+        # The first message overtakes the queued frames, sent after the
+        # 40-beat frame in flight
+        first_prio = out.index(prio[0][1])
+        assert first_prio <= frames[0]
+        print("first message after {} link beats".format(first_prio))
+
+    def run_drop(self):
+        """ Messages the priority FIFO cannot take are counted, data passes """
+        data = []
+
+        def test():
+            for d, last in [(1, 0), (2, 1), (3, 1)]:
+                yield self.tx.sink_data.data.eq(d)
+                yield self.tx.sink_data.last.eq(last)
+                yield self.tx.sink_data.valid.eq(1)
+                yield
+                while (yield self.tx.sink_data.ready) == 0:
+                    yield
+            yield self.tx.sink_data.valid.eq(0)
+            # A message while the receiver is full
+            yield self.tx.sink_prio.data.eq(0x1234)
+            yield self.tx.sink_prio.valid.eq(1)
+            yield
+            yield self.tx.sink_prio.valid.eq(0)
+            for _ in range(4):
+                yield
+            assert (yield self.rx.dropped) == 1
+
+        @passive
+        def link():
+            while True:
+                yield self.link_ready.eq(1)
+                yield
+                if (yield self.rx.source_data.valid):
+                    data.append((yield self.rx.source_data.data))
+
+        run_simulation(self, [test(), link()])
+        assert data == [1, 2, 3]
+
+if __name__ == "__main__":
+    random.seed(1)
+    DUT().run_sim()
+    DUT().run_drop()
+
+    # The core's data ports go through the priority lane
+    platform = ted_tfoil.Platform()
+    ky = KyokkoBlock(platform, platform.request("GTY121", 0), platform.request("MGTREFCLK_121_", 0),
+        with_priority=True)
+    core, = [s for s in ky.get_fragment().specials if isinstance(s, Instance) and s.of == "kyokko_gty4"]
+    ports = {item.name: item.expr for item in core.items if hasattr(item, "expr")}
+    assert ports["s_axis_tx_tvalid"] is ky.prio_tx.source.valid
+    assert ports["m_axis_rx_tvalid"] is ky.prio_rx.sink.valid
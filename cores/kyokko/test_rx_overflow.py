@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+import random
+
+from migen import *
+from cores.kyokko.aurora import _RXOverflowGuard
+from cores.kyokko.layout import kyokkoRxStreamDesc
+
+class DUT(Module):
+    def __init__(self):
+        self.submodules.guard = _RXOverflowGuard(kyokkoRxStreamDesc(lanes=1))
+
+    def run_sim(self, nframes=200, **args):
+        g = self.guard
+        frames = [[(i << 8) | n for n in range(1, random.randint(1, 8) + 1)] for i in range(nframes)]
+        out, stats = [], []
+
+        def link():
+            # Aurora RX: no backpressure, idle cycles between beats
+            for beats in frames:
+                for n, data in enumerate(beats):
+                    while random.random() < 0.3:
+                        yield g.sink.valid.eq(0)
+                        yield
+                    yield g.sink.data.eq(data)
+                    yield g.sink.last.eq(n == len(beats) - 1)
+                    yield g.sink.valid.eq(1)
+                    yield
+            yield g.sink.valid.eq(0)
+            for _ in range(10):
+                yield
+            for name in ["dropped_beats", "dropped_frames", "truncated_frames"]:
+                stats.append((yield getattr(g, name)))
+
+        @passive
+        def fifo():
+            # Slow consumer with bursts of backpressure
+            beats = []
+            full = False
+            while True:
+                if random.random() < 0.1:
+                    full = not full
+                yield g.source.ready.eq(not full)
+                yield
+                if not full and (yield g.source.valid):
+                    beats.append((yield g.source.data))
+                    if (yield g.source.last):
+                        out.append((beats, (yield g.source.error)))
+                        beats = []
+
+        run_simulation(self, [link(), fifo()], **args)
+
+        by_id = {f[0] >> 8: f for f in frames}
+        truncated = 0
+        received = 0
+        for beats, error in out:
+            data = [b for b in beats if b]
+            ids = set(b >> 8 for b in data)
+            assert len(ids) <= 1, beats
+            if error:
+                truncated += 1
+                if data:
+                    f = by_id[ids.pop()]
+                    # Prefix of the frame, possibly followed by its last beat
+                    assert data[:-1] == f[:len(data) - 1] and data[-1] in f
+            else:
+                assert data == by_id[ids.pop()]
+            received += len(data)
+        dropped_beats, dropped_frames, truncated_frames = stats
+        print("frames {}, complete {}, truncated {}, dropped {}, dropped beats {}".format(
+            nframes, len(out) - truncated, truncated_frames, dropped_frames, dropped_beats))
+        assert truncated == truncated_frames > 0
+        assert len(out) + dropped_frames == nframes
+        assert received + dropped_beats == sum(len(f) for f in frames)
+
+if __name__ == "__main__":
+    random.seed(1)
+    dut = DUT()
+    dut.run_sim()
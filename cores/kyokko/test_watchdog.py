@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+from migen import *
+from migen.fhdl.tools import list_signals
+from litex_boards.platforms.xilinx_vcu1525 import Platform
+
+from cores.kyokko.aurora import Aurora64b66b, _LinkWatchdog, _reset_seq_params, _watchdog_wait
+
+class DUT(Module):
+    def __init__(self):
+        self.submodules.wd = _LinkWatchdog(wait=20, max_shift=2, soft_err_limit=3, err_window=50)
+
+    def run_sim(self, **args):
+        wd = self.wd
+        resets = []
+
+        @passive
+        def monitor():
+            cycle = 0
+            while True:
+                if (yield wd.reset):
+                    resets.append(cycle)
+                cycle += 1
+                yield
+
+        def test():
+            # Link never comes up: exponential backoff 20, 40, 80, 80 ... (+2 cycles per attempt)
+            for _ in range(300):
+                yield
+            gaps = [b - a for a, b in zip(resets, resets[1:])]
+            print("resets while down: {}, intervals {}".format(resets, gaps))
+            assert gaps[:3] == [42, 82, 82]
+
+            # Link up for a while: backoff back to `wait`
+            yield wd.channel_up.eq(1)
+            for _ in range(30):
+                yield
+            n = len(resets)
+            yield wd.channel_up.eq(0)
+            for _ in range(25):
+                yield
+            assert len(resets) == n + 1
+
+            # Soft error burst on a live link
+            yield wd.channel_up.eq(1)
+            for _ in range(10):
+                yield
+            n = len(resets)
+            for _ in range(5):
+                yield wd.soft_err.eq(1)
+                yield
+            yield wd.soft_err.eq(0)
+            for _ in range(3):
+                yield
+            assert len(resets) == n + 1
+            recoveries, downtime = (yield wd.recoveries), (yield wd.downtime)
+            assert recoveries == len(resets)
+            print("recoveries {}, downtime {} cycles".format(recoveries, downtime))
+
+        run_simulation(self, [test(), monitor()], **args)
+
+def run_recovery(wait, freerun_clk_freq=int(10e3), pma_init_ms=1000, lane_up_ms=80, cycles=40000):
+    """ Recover a dropped link through a model of aurora_reset_seq: each
+    reset restarts reset_pb/PMA_INIT, the channel comes up `lane_up_ms`
+    after PMA_INIT is released. Returns (cycle the link came up, recoveries). """
+    wd = _LinkWatchdog(wait=wait)
+    params = _reset_seq_params(freerun_clk_freq, pma_init_ms)
+    bringup = (params["p_RSTPB_ASSERT_CYCLE"] + params["p_PMAINIT_ASSERT_CYCLE"] + 4
+        + lane_up_ms * freerun_clk_freq // 1000)
+    result = {"up": None}
+
+    def test():
+        remaining = None # Link dropped: down until reset
+        yield wd.enable.eq(1)
+        for cycle in range(cycles):
+            if (yield wd.reset):
+                remaining = bringup
+            elif remaining is not None and remaining > 0:
+                remaining -= 1
+            up = remaining == 0
+            if up and result["up"] is None:
+                result["up"] = cycle
+            yield wd.channel_up.eq(up)
+            yield
+        result["recoveries"] = (yield wd.recoveries)
+
+    run_simulation(wd, test())
+    return result["up"], result["recoveries"]
+
+if __name__ == "__main__":
+    dut = DUT()
+    dut.run_sim()
+
+    # With the real reset sequence timing (1 s PMA_INIT) a dropped link
+    # comes back after one recovery; a 10 ms backoff keeps resetting it
+    up, recoveries = run_recovery(_watchdog_wait(int(10e3), 1000))
+    print("link up after {} cycles, {} recoveries".format(up, recoveries))
+    assert up is not None and recoveries == 1
+    up, recoveries = run_recovery(10 * int(10e3) // 1000)
+    assert up is None and recoveries > 1
+    try:
+        _watchdog_wait(int(100e6), 1000, wait_ms=10)
+    except ValueError as e:
+        print("rejected: {}".format(e))
+    else:
+        raise AssertionError("10 ms watchdog wait accepted")
+
+    # Off after reset, backoff in milliseconds of init_clk, reset sequence
+    # parameters from the same PMA_INIT time
+    platform = Platform()
+    aurora = Aurora64b66b(platform, platform.request("qsfp", 0), platform.request("qsfp0_refclk1"),
+        with_ila=False)
+    assert aurora._recovery.fields.enable.reset.value == 0
+    backoff, = [s for s in list_signals(aurora.watchdog.get_fragment()) if s.backtrace[-1][0] == "backoff"]
+    assert backoff.reset.value == 2200 * 100000
+    seq, = [s for s in aurora.get_fragment().specials if isinstance(s, Instance) and s.of == "aurora_reset_seq"]
+    params = {item.name: item.value for item in seq.items if isinstance(item, Instance.Parameter)}
+    assert params["PMAINIT_ASSERT_CYCLE"] == 100000000
+    assert params["RSTPB_ASSERT_CYCLE"] == 100
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+from migen import *
+from migen.fhdl import verilog
+from litex.soc.interconnect.stream import EndpointDescription
+
+from cores.xpm_fifo import XPMStreamFIFO, XPMAsyncStreamFIFO
+
+def test_xpm_params():
+    layout = EndpointDescription([("data", 64)])
+    fifo = XPMStreamFIFO(layout, depth=512, packet=True, prog_full=400, prog_empty=16, with_counts=True)
+    p = fifo.xpm_params
+    assert p["p_PACKET_FIFO"] == "true"
+    assert p["p_USE_ADV_FEATURES"] == "1606"
+    assert p["p_PROG_FULL_THRESH"] == 400 and p["p_PROG_EMPTY_THRESH"] == 16
+    assert p["p_WR_DATA_COUNT_WIDTH"] == 10
+    assert XPMAsyncStreamFIFO(layout).xpm_params["p_USE_ADV_FEATURES"] == "1000"
+    try:
+        XPMStreamFIFO(layout, depth=16, prog_full=15)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_deep_buffer():
+    """ K2MM deep buffers are UltraRAM FIFOs on both link directions """
+    from cores.tf.framing import K2MM, K2MMControl
+    k2mm = K2MM(dw=256, deep_buffer_depth=16384)
+    for fifo in [k2mm.tx_deep, k2mm.rx_deep]:
+        assert fifo.xpm_params["p_FIFO_MEMORY_TYPE"] == "ultra"
+        assert fifo.xpm_params["p_FIFO_DEPTH"] == 16384
+    ctrl = K2MMControl(k2mm, dw=256)
+    assert len(ctrl._rx_deep_level.status) == 15
+    # Sync FIFOs only use the K2MM's own clock domain, also when renamed
+    for cd in ["sys", "dp"]:
+        k2mm = ClockDomainsRenamer(cd)(K2MM(dw=256, deep_buffer_depth=16384))
+        v = str(verilog.convert(k2mm, ios=set(sum([ep.flatten() for ep in k2mm.get_ios()], []))))
+        assert "{}_clk".format(cd) in v and "write_clk" not in v and "read_clk" not in v
+    assert not hasattr(K2MM(dw=256), "rx_deep")
+    try:
+        XPMStreamFIFO(EndpointDescription([("data", 64)]), memory_type="uram")
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_packet_mode(packet):
+    """ Frames are only released once complete in packet mode """
+    fifo = XPMStreamFIFO(EndpointDescription([("data", 32)]), depth=16, xpm=False, packet=packet)
+    first_out = []
+
+    def writer():
+        for i in range(4):
+            yield fifo.sink.data.eq(i)
+            yield fifo.sink.last.eq(i == 3)
+            yield fifo.sink.valid.eq(1)
+            yield
+            # Slow producer
+            yield fifo.sink.valid.eq(0)
+            for _ in range(5):
+                yield
+        for _ in range(10):
+            yield
+
+    @passive
+    def reader():
+        cycle = 0
+        yield fifo.source.ready.eq(1)
+        while True:
+            yield
+            cycle += 1
+            if (yield fifo.source.valid) and not first_out:
+                first_out.append(cycle)
+
+    run_simulation(fifo, [writer(), reader()])
+    return first_out[0]
+
+if __name__ == "__main__":
+    test_xpm_params()
+    test_deep_buffer()
+    cut_through, packet = test_packet_mode(False), test_packet_mode(True)
+    print("first beat out at cycle: cut-through {}, packet mode {}".format(cut_through, packet))
+    assert packet > 3 * 6 > cut_through
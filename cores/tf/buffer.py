@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+from migen import *
+from litex.soc.interconnect.stream import Endpoint
+
+class StoreAndForwardBuffer(Module):
+    """ Release frames only once they are complete and error free
+
+    A frame is written into `depth` words of memory and made visible to the
+    reader on its last beat. Frames with `error` set on any beat, and frames
+    longer than the buffer, are discarded (`dropped`), so nothing of a bad
+    frame reaches the output.
+    """
+    def __init__(self, description, depth=256):
+        self.sink   = sink   = Endpoint(description)
+        self.source = source = Endpoint(description)
+
+        self.dropped = Signal(32)
+
+        # # #
+
+        depth = 2**log2_int(depth, False)
+        aw = log2_int(depth)
+        word = Record([("payload", description.payload_layout), ("param", description.param_layout), ("last", 1)])
+        word_out = Record(word.layout)
+        self.specials.mem = mem = Memory(len(word), depth)
+        self.specials.wrport = wrport = mem.get_port(write_capable=True)
+        self.specials.rdport = rdport = mem.get_port(has_re=True)
+
+        # Pointers carry one extra bit to tell full from empty
+        wr_ptr  = Signal(aw + 1)
+        commit  = Signal(aw + 1)
+        rd_ptr  = Signal(aw + 1)
+        free    = Signal(aw + 1) # First word still in use, including the output register
+        bad     = Signal()
+        discard = Signal()
+        full    = Signal()
+
+        has_error = hasattr(sink, "error")
+        error = (sink.error != 0) if has_error else 0
+
+        self.comb += [
+            word.payload.eq(sink.payload),
+            word.param.eq(sink.param),
+            word.last.eq(sink.last),
+            wrport.adr.eq(wr_ptr[:aw]),
+            wrport.dat_w.eq(word.raw_bits()),
+            free.eq(rd_ptr - source.valid),
+            full.eq((wr_ptr[:aw] == free[:aw]) & (wr_ptr[aw] != free[aw])),
+            sink.ready.eq(discard | ~full | (commit == free)),
+        ]
+        self.sync += [
+            If(sink.valid & sink.ready,
+                If(discard,
+                    If(sink.last,
+                        discard.eq(0)
+                    )
+                ).Elif(full,
+                    # Frame longer than the buffer
+                    wr_ptr.eq(commit),
+                    bad.eq(0),
+                    discard.eq(~sink.last),
+                    self.dropped.eq(self.dropped + 1)
+                ).Else(
+                    wr_ptr.eq(wr_ptr + 1),
+                    bad.eq(bad | error),
+                    If(sink.last,
+                        bad.eq(0),
+                        If(bad | error,
+                            wr_ptr.eq(commit),
+                            self.dropped.eq(self.dropped + 1)
+                        ).Else(
+                            commit.eq(wr_ptr + 1)
+                        )
+                    )
+                )
+            )
+        ]
+        self.comb += wrport.we.eq(sink.valid & sink.ready & ~discard & ~full)
+
+        # Read side, one registered word ahead
+        fetch = Signal()
+        self.comb += [
+            fetch.eq((rd_ptr != commit) & (~source.valid | source.ready)),
+            rdport.adr.eq(rd_ptr[:aw]),
+            rdport.re.eq(fetch),
+            word_out.raw_bits().eq(rdport.dat_r),
+            source.payload.eq(word_out.payload),
+            source.param.eq(word_out.param),
+            source.last.eq(word_out.last),
+        ]
+        self.sync += [
+            If(fetch,
+                rd_ptr.eq(rd_ptr + 1),
+                source.valid.eq(1)
+            ).Elif(source.ready,
+                source.valid.eq(0)
+            )
+        ]
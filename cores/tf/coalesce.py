@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+from migen import *
+from litex.soc.interconnect.stream import Endpoint, EndpointDescription, SyncFIFO
+
+from cores.tf.packet import K2MMPacket
+
+def message_description(slot_dw, dw):
+    """ Small message (one `slot_dw`-bit word) with K2MM parameters """
+    return EndpointDescription(
+        [("data", slot_dw), ("error", 1)],
+        K2MMPacket.packet_user_description(dw).param_layout)
+
+def _check_header(dw):
+    if K2MMPacket.get_header(dw).length < 15:
+        raise ValueError("Coalescing fields do not fit in a {}-bit K2MM header".format(dw))
+
+class K2MMCoalescer(Module):
+    """ Pack small messages into K2MM frames
+
+    Messages (one `slot_dw`-bit word each) bound for the same destination
+    (`ip_address`, `dst_port`) are packed `dw // slot_dw` per beat into one
+    frame; other parameters are taken from the first message. A frame is
+    closed when the destination changes, when `threshold` messages are
+    packed, or `timeout` cycles after its first message. The message count
+    goes in the `nmsg` header field.
+
+    Frames are collected in a FIFO before being sent, so up to `max_beats`
+    beats of the next frame can be packed while one is on the link.
+    """
+    def __init__(self, dw=256, slot_dw=64, max_beats=16, timeout=256):
+        _check_header(dw)
+        assert dw % slot_dw == 0
+        spb = dw // slot_dw
+        max_msgs = spb * max_beats
+        user_params = K2MMPacket.packet_user_description(dw).param_layout
+
+        self.sink   = sink   = Endpoint(message_description(slot_dw, dw))
+        self.source = source = Endpoint(K2MMPacket.packet_user_description(dw))
+
+        self.threshold = Signal(max=max_msgs + 1, reset=max_msgs)
+        self.timeout   = Signal(32, reset=timeout)
+        self.frames    = Signal(32)
+        self.messages  = Signal(32)
+
+        # # #
+
+        self.submodules.data_fifo = data_fifo = SyncFIFO([("data", dw), ("error", dw // 8)], 2 * max_beats)
+        self.submodules.desc_fifo = desc_fifo = SyncFIFO(
+            user_params + [("beats", bits_for(max_beats))], 4)
+
+        # Packing
+        slots  = Array(Signal(slot_dw) for _ in range(spb))
+        errors = Array(Signal() for _ in range(spb))
+        idx    = Signal(max=max(spb, 2))
+        nmsg   = Signal(max=max_msgs + 1)
+        beats  = Signal(max=max_beats + 1)
+        timer  = Signal(32)
+        params = Record(user_params)
+
+        accept, push_beat, flush = Signal(), Signal(), Signal()
+        full, other_dest, expired = Signal(), Signal(), Signal()
+        writable = Signal()
+        self.comb += [
+            writable.eq(data_fifo.sink.ready & desc_fifo.sink.ready),
+            other_dest.eq(sink.valid & (nmsg != 0) &
+                ((sink.ip_address != params.ip_address) | (sink.dst_port != params.dst_port))),
+            expired.eq((nmsg != 0) & (timer == 0)),
+            # Close frame without taking a message
+            flush.eq(writable & (other_dest | expired)),
+            accept.eq(writable & sink.valid & ~other_dest & ~expired),
+            sink.ready.eq(accept),
+            full.eq(accept & (nmsg + 1 >= self.threshold)),
+            push_beat.eq((accept & ((idx == spb - 1) | full)) | (flush & (idx != 0))),
+        ]
+
+        # Beat being written: packed slots plus the incoming message
+        beat_data  = [Signal(slot_dw) for _ in range(spb)]
+        beat_error = [Signal() for _ in range(spb)]
+        for i in range(spb):
+            self.comb += [
+                beat_data[i].eq(slots[i]),
+                beat_error[i].eq(errors[i]),
+                If(accept & (idx == i),
+                    beat_data[i].eq(sink.data),
+                    beat_error[i].eq(sink.error),
+                )
+            ]
+        self.comb += [
+            data_fifo.sink.valid.eq(push_beat),
+            data_fifo.sink.data.eq(Cat(*beat_data)),
+            data_fifo.sink.error.eq(Cat(*[Replicate(e, slot_dw // 8) for e in beat_error])),
+            desc_fifo.sink.valid.eq(full | flush),
+            desc_fifo.sink.beats.eq(beats + push_beat),
+            desc_fifo.sink.nmsg.eq(nmsg + accept),
+        ]
+        for name, _ in user_params:
+            if name != "nmsg":
+                self.comb += getattr(desc_fifo.sink, name).eq(
+                    Mux(nmsg == 0, getattr(sink, name), getattr(params, name)))
+
+        self.sync += [
+            If(nmsg != 0,
+                timer.eq(timer - 1)
+            ),
+            If(accept,
+                slots[idx].eq(sink.data),
+                errors[idx].eq(sink.error),
+                idx.eq(idx + 1),
+                If(idx == spb - 1,
+                    idx.eq(0)
+                ),
+                nmsg.eq(nmsg + 1),
+                If(nmsg == 0,
+                    params.eq(sink.param),
+                    timer.eq(self.timeout),
+                ),
+                self.messages.eq(self.messages + 1),
+            ),
+            If(push_beat,
+                beats.eq(beats + 1),
+                [e.eq(0) for e in errors],
+            ),
+            If(full | flush,
+                idx.eq(0),
+                nmsg.eq(0),
+                beats.eq(0),
+                self.frames.eq(self.frames + 1),
+            ),
+        ]
+
+        # Output
+        count = Signal(max=max_beats + 1)
+        self.comb += [
+            source.valid.eq(desc_fifo.source.valid & data_fifo.source.valid),
+            source.last.eq(count == desc_fifo.source.beats - 1),
+            source.data.eq(data_fifo.source.data),
+            source.error.eq(data_fifo.source.error),
+            source.length.eq(desc_fifo.source.beats * (dw // 8)),
+            data_fifo.source.ready.eq(source.valid & source.ready),
+            desc_fifo.source.ready.eq(source.valid & source.ready & source.last),
+        ]
+        for name, _ in user_params:
+            if name != "length":
+                self.comb += getattr(source, name).eq(getattr(desc_fifo.source, name))
+        self.sync += If(source.valid & source.ready,
+            count.eq(count + 1),
+            If(source.last,
+                count.eq(0)
+            )
+        )
+
+class K2MMSplitter(Module):
+    """ Unpack frames of `K2MMCoalescer` into messages, one per cycle """
+    def __init__(self, dw=256, slot_dw=64):
+        _check_header(dw)
+        assert dw % slot_dw == 0
+        spb = dw // slot_dw
+
+        self.sink   = sink   = Endpoint(K2MMPacket.packet_user_description(dw))
+        self.source = source = Endpoint(message_description(slot_dw, dw))
+
+        # # #
+
+        first = Signal(reset=1)
+        idx   = Signal(max=max(spb, 2))
+        rem   = Signal(16)
+        rem_now = Signal(16)
+        slots  = Array(sink.data[i*slot_dw:(i + 1)*slot_dw] for i in range(spb))
+        errors = Array(sink.error[i*slot_dw//8] for i in range(spb))
+        beat_done = Signal()
+        self.comb += [
+            rem_now.eq(Mux(first, sink.nmsg, rem)),
+            source.valid.eq(sink.valid & (rem_now != 0)),
+            source.data.eq(slots[idx]),
+            source.error.eq(errors[idx]),
+            source.param.eq(sink.param),
+            beat_done.eq((rem_now == 0) | (source.ready & ((idx == spb - 1) | (rem_now == 1)))),
+            sink.ready.eq(beat_done),
+        ]
+        self.sync += [
+            If(source.valid & source.ready,
+                rem.eq(rem_now - 1),
+                idx.eq(idx + 1),
+                first.eq(0),
+            ),
+            If(sink.valid & beat_done,
+                idx.eq(0),
+                If(sink.last,
+                    first.eq(1)
+                ).Else(
+                    first.eq(0)
+                )
+            ),
+        ]
@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+from functools import reduce
+from operator import xor
+
+from migen import *
+from litex.soc.interconnect.stream import Endpoint
+
+CRC32  = 0xEDB88320 # IEEE 802.3 (reflected)
+CRC32C = 0x82F63B78 # Castagnoli (reflected)
+
+def _crc_matrix(dw, poly, width=32):
+    """ Parallel form of a reflected CRC over one `dw`-bit beat
+
+    Data bits are shifted in LSB first (byte 0 of the beat first, as zlib).
+    Returns, for each CRC bit, (state mask, data mask): the next CRC bit is
+    the XOR of the previous CRC bits and data bits selected by the masks.
+    """
+    crc = [(1 << i, 0) for i in range(width)]
+    for n in range(dw):
+        fb_s, fb_d = crc[0]
+        fb_d ^= 1 << n
+        crc = crc[1:] + [(0, 0)]
+        for i in range(width):
+            if (poly >> i) & 1:
+                crc[i] = (crc[i][0] ^ fb_s, crc[i][1] ^ fb_d)
+    return crc
+
+def _bits(mask):
+    return [i for i in range(mask.bit_length()) if (mask >> i) & 1]
+
+def _xor(sigs):
+    return reduce(xor, sigs) if len(sigs) else 0
+
+class _CRCPipeline(Module):
+    """ Two-stage pipelined parallel CRC32
+
+    Stage 1 registers the data contribution of a beat, split in `chunk`-bit
+    slices so each XOR tree stays shallow. Stage 2 folds it into the running
+    CRC; only that fold (~32 + dw/chunk inputs per bit) sits in the feedback
+    loop. Beats move through the stages together with their payload so the
+    result is aligned with the beat in stage 2.
+    """
+    def __init__(self, dw, poly=CRC32, chunk=128, init=0xffffffff):
+        self.data  = Signal(dw)
+        self.first = Signal() # Beat in stage 1 starts a frame
+        self.ce1   = Signal() # Load stage 1
+        self.ce2   = Signal() # Stage 1 -> stage 2
+        self.value = Signal(32) # CRC up to (incl.) the beat in stage 2, final XOR applied
+
+        # # #
+
+        matrix = _crc_matrix(dw, poly)
+        chunk = min(chunk, dw)
+        nchunks = (dw + chunk - 1) // chunk
+
+        partial = [Signal(32, reset_less=True) for _ in range(nchunks)]
+        for c in range(nchunks):
+            lo, hi = c * chunk, min((c + 1) * chunk, dw)
+            self.sync += If(self.ce1,
+                [partial[c][i].eq(_xor([self.data[b] for b in _bits(matrix[i][1]) if lo <= b < hi]))
+                    for i in range(32)]
+            )
+
+        crc = Signal(32, reset=init)
+        # State contribution when restarting from `init`
+        init_term = reduce(xor, [1 << i for i in range(32)
+            if bin(matrix[i][0] & init).count("1") & 1], 0)
+        state = Signal(32)
+        self.comb += [
+            If(self.first,
+                state.eq(init_term)
+            ).Else(
+                [state[i].eq(_xor([crc[b] for b in _bits(matrix[i][0])])) for i in range(32)]
+            ),
+            self.value.eq(~crc),
+        ]
+        self.sync += If(self.ce2,
+            crc.eq(reduce(xor, partial, state))
+        )
+
+class _Stage(Record):
+    def __init__(self, description):
+        Record.__init__(self, [
+            ("valid", 1), ("first", 1), ("last", 1),
+            ("payload", description.payload_layout),
+            ("param", description.param_layout),
+        ])
+
+class CRCInserter(Module):
+    """ Append a CRC32 trailer beat to every frame
+
+    The CRC covers every beat of the frame (whole beats, padding included);
+    the trailer carries it in its low 32 bits. The datapath runs through the
+    same two stages as the CRC so the trailer follows the last beat without
+    a bubble.
+    """
+    def __init__(self, description, poly=CRC32):
+        self.sink   = sink   = Endpoint(description)
+        self.source = source = Endpoint(description)
+
+        # # #
+
+        dw = len(sink.data)
+        self.submodules.crc = crc = _CRCPipeline(dw, poly)
+
+        s1, s2 = _Stage(description), _Stage(description)
+        in_first = Signal(reset=1)
+        trailer  = Signal()
+        trailer_crc = Signal(32)
+        trailer_param = Record(description.param_layout)
+
+        ce1, ce2, out = Signal(), Signal(), Signal()
+        self.comb += [
+            out.eq(s2.valid & source.ready & ~trailer),
+            ce2.eq(~trailer & (~s2.valid | out)),
+            ce1.eq(~s1.valid | ce2),
+            sink.ready.eq(ce1),
+            crc.data.eq(sink.data),
+            crc.first.eq(s1.first),
+            crc.ce1.eq(ce1 & sink.valid),
+            crc.ce2.eq(ce2 & s1.valid),
+        ]
+        self.sync += [
+            If(ce1,
+                s1.valid.eq(sink.valid),
+                s1.first.eq(in_first),
+                s1.last.eq(sink.last),
+                s1.payload.eq(sink.payload),
+                s1.param.eq(sink.param),
+                If(sink.valid,
+                    in_first.eq(sink.last)
+                )
+            ),
+            If(ce2,
+                s2.eq(s1)
+            ),
+            If(out & s2.last,
+                trailer.eq(1),
+                trailer_crc.eq(crc.value),
+                trailer_param.eq(s2.param),
+            ).Elif(trailer & source.ready,
+                trailer.eq(0)
+            )
+        ]
+        self.comb += [
+            If(trailer,
+                source.valid.eq(1),
+                source.last.eq(1),
+                source.param.eq(trailer_param),
+                source.data.eq(trailer_crc),
+            ).Else(
+                source.valid.eq(s2.valid),
+                source.last.eq(0),
+                source.payload.eq(s2.payload),
+                source.param.eq(s2.param),
+            ),
+            source.first.eq(0),
+        ]
+
+class CRCChecker(Module):
+    """ Check and strip the CRC32 trailer beat
+
+    The beat before the trailer goes out as `last`, with all `error` bits set
+    when the CRC does not match. A beat is held in stage 2 until the next one
+    shows whether it ends the frame.
+    """
+    def __init__(self, description, poly=CRC32):
+        self.sink   = sink   = Endpoint(description)
+        self.source = source = Endpoint(description)
+
+        self.crc_errors = Signal(32)
+        self.frames     = Signal(32)
+
+        # # #
+
+        dw = len(sink.data)
+        self.submodules.crc = crc = _CRCPipeline(dw, poly)
+
+        s1, s2 = _Stage(description), _Stage(description)
+        in_first = Signal(reset=1)
+        s2_trailer = Signal()
+        mismatch = Signal()
+
+        ce1, ce2, out = Signal(), Signal(), Signal()
+        self.comb += [
+            s2_trailer.eq(s2.last),
+            # A data beat leaves once its successor is known
+            out.eq(s2.valid & ~s2_trailer & s1.valid & source.ready),
+            ce2.eq(~s2.valid | s2_trailer | out),
+            ce1.eq(~s1.valid | ce2),
+            sink.ready.eq(ce1),
+            crc.data.eq(sink.data),
+            crc.first.eq(s1.first),
+            crc.ce1.eq(ce1 & sink.valid & ~sink.last),
+            crc.ce2.eq(ce2 & s1.valid & ~s1.last),
+            mismatch.eq(crc.value != s1.payload.data[:32]),
+        ]
+        self.sync += [
+            If(ce1,
+                s1.valid.eq(sink.valid),
+                s1.first.eq(in_first),
+                s1.last.eq(sink.last),
+                s1.payload.eq(sink.payload),
+                s1.param.eq(sink.param),
+                If(sink.valid,
+                    in_first.eq(sink.last)
+                )
+            ),
+            If(ce2,
+                s2.eq(s1)
+            ),
+            If(out & s1.last,
+                self.frames.eq(self.frames + 1),
+                If(mismatch,
+                    self.crc_errors.eq(self.crc_errors + 1)
+                )
+            )
+        ]
+        self.comb += [
+            source.valid.eq(s2.valid & ~s2_trailer & s1.valid),
+            source.first.eq(s2.first),
+            source.last.eq(s1.last),
+            source.payload.eq(s2.payload),
+            source.param.eq(s2.param),
+            If(s1.last & mismatch,
+                source.error.eq(Replicate(1, len(source.error)))
+            ),
+        ]
@@ -5,18 +5,29 @@ from migen import *
 from litex.soc.interconnect.csr import CSRStatus
 from liteeth.common import eth_udp_user_description
 from litex.soc.interconnect.packet import Arbiter, Depacketizer, Dispatcher, Packetizer
+from migen.genlib.cdc import BusSynchronizer, MultiReg
 from litex.soc.interconnect.stream import Endpoint, EndpointDescription, SyncFIFO
 
+from cores.tf.buffer import StoreAndForwardBuffer
+from cores.tf.crc import CRCInserter, CRCChecker
 from cores.tf.packet import K2MMPacket
 from cores.tf.tfg import TestFrameGenerator
 from cores.tf.tfc import TestFrameChecker
 from util.epbuf import SkidBufferInsert
 
 class K2MMPacketTX(Module):
-    def __init__(self, udp_port=50000, dw=32):
+    def __init__(self, udp_port=50000, dw=32, with_crc=False):
         self.sink = sink = Endpoint(K2MMPacket.packet_user_description(dw))
         self.source = source = Endpoint(eth_udp_user_description(dw))
         
+        # CRC32 trailer (optional)
+        trailer_length = 0
+        if with_crc:
+            self.submodules.crc = crc = CRCInserter(source.description)
+            self.comb += crc.source.connect(source)
+            source = crc.sink
+            trailer_length = dw // 8
+
         self.submodules.packetizer = packetizer = Packetizer(
             K2MMPacket.packet_description(dw),
             source.description,
@@ -41,25 +52,34 @@ class K2MMPacketTX(Module):
             source.src_port.eq(udp_port),
             source.dst_port.eq(udp_port),
             source.ip_address.eq(sink.ip_address),
-            source.length.eq(sink.length + K2MMPacket.get_header(dw).length),
+            source.length.eq(sink.length + K2MMPacket.get_header(dw).length + trailer_length),
             If(source.valid & source.last & source.ready,
                 NextState("IDLE")
             )
         )
 
 class K2MMPacketRX(Module):
-    def __init__(self, dw=32):
+    def __init__(self, dw=32, with_crc=False):
         self.sink = sink = Endpoint(eth_udp_user_description(dw))
         self.source = source = Endpoint(K2MMPacket.packet_user_description(dw))
 
         # # #
         
+        # CRC32 trailer check (optional), bad frames end with `error` set
+        trailer_length = 0
+        if with_crc:
+            self.submodules.crc = crc = CRCChecker(sink.description)
+            self.comb += self.sink.connect(crc.sink)
+            self.crc_errors = crc.crc_errors
+            sink = crc.source
+            trailer_length = dw // 8
+
         self.submodules.dpkt0 = depacketizer = Depacketizer(
             sink.description,
             K2MMPacket.packet_description(dw),
             K2MMPacket.get_header(dw)
         )
-        self.comb += self.sink.connect(depacketizer.sink)
+        self.comb += sink.connect(depacketizer.sink)
 
         self.submodules.fsm = fsm = FSM(reset_state="IDLE")
         fsm.act("IDLE",
@@ -70,13 +90,13 @@ class K2MMPacketRX(Module):
                 )
             )
         )
+        _user_fields = {k for k, _ in K2MMPacket.get_header(dw).get_user_layout()}
         self.comb += [
-            # FIXME: flag for "user" header fields
-            depacketizer.source.connect(source, keep={"last", "pf", "pr", "nr", "data"}),
+            depacketizer.source.connect(source, keep={"last", "data", "error"} | _user_fields),
             source.src_port.eq(sink.src_port),
             source.dst_port.eq(sink.dst_port),
             source.ip_address.eq(sink.ip_address),
-            source.length.eq(sink.length - K2MMPacket.get_header(dw).length)
+            source.length.eq(sink.length - K2MMPacket.get_header(dw).length - trailer_length)
         ]
         fsm.act("RECEIVE",
             depacketizer.source.connect(source, keep={"valid", "ready"}),
@@ -120,20 +140,44 @@ class K2MMProbe(Module):
         )
         
 class _K2MMPacketParser(Module):
-    def __init__(self, dw=32, bufferrized=True, fifo_depth=256):
+    """ K2MM packetizer/depacketizer with link-side buffers
+
+    `buffer_mode`:
+    - "cut-through": beats are forwarded as they arrive, through
+      `fifo_depth` deep FIFOs if `bufferrized` (no FIFO otherwise, for the
+      lowest latency).
+    - "store-and-forward": TX frames leave only once complete; RX frames are
+      held after the (optional) CRC check until complete, and frames with
+      `error` set are dropped (`rx_dropped`). Frames longer than
+      `fifo_depth` are dropped both ways (`tx_dropped`, `rx_dropped`).
+    """
+    def __init__(self, dw=32, bufferrized=True, fifo_depth=256, with_crc=False, buffer_mode="cut-through"):
         
         # TX/RX packet
-        ptx = K2MMPacketTX(dw=dw)
+        ptx = K2MMPacketTX(dw=dw, with_crc=with_crc)
         ptx = SkidBufferInsert({"sink": DIR_SINK})(ptx)
         self.submodules.ptx = ptx
 
-        prx = K2MMPacketRX(dw=dw)
+        prx = K2MMPacketRX(dw=dw, with_crc=with_crc)
         prx = SkidBufferInsert({"source": DIR_SOURCE})(prx)
         self.submodules.prx = prx
         
         self.sink, self.source = ptx.sink, prx.source
-        from cores.xpm_fifo import XPMStreamFIFO
-        if bufferrized:
+        if buffer_mode == "store-and-forward":
+            self.submodules.tx_buffer = tx_buffer = StoreAndForwardBuffer(ptx.source.description, depth=fifo_depth)
+            self.submodules.rx_buffer = rx_buffer = StoreAndForwardBuffer(prx.source.description, depth=fifo_depth)
+            self.comb += [
+                ptx.source.connect(tx_buffer.sink),
+                prx.source.connect(rx_buffer.sink),
+            ]
+            self.source = rx_buffer.source
+            self.source_packet_tx = tx_buffer.source
+            self.sink_packet_rx = prx.sink
+            self.tx_dropped = tx_buffer.dropped
+            self.rx_dropped = rx_buffer.dropped
+        elif buffer_mode != "cut-through":
+            raise ValueError("Unknown buffer mode: {}".format(buffer_mode))
+        elif bufferrized:
             self.submodules.tx_buffer = tx_buffer = SyncFIFO(ptx.source.description, depth=fifo_depth, buffered=True)
             self.submodules.rx_buffer = rx_buffer = SyncFIFO(prx.sink.description, depth=fifo_depth, buffered=True)
             self.comb += [
@@ -199,16 +243,64 @@ class K2MMTester(Module):
         
 from litex.soc.interconnect.stream import Endpoint, DIR_SOURCE, DIR_SINK
 class K2MM(Module):
-    def __init__(self, dw=32, cd="sys"):
+    def __init__(self, dw=32, cd="sys", with_reliable=False, reliable_params=None, with_error_injector=False, with_crc=False,
+        link_mode="framing", buffer_mode="cut-through", bufferrized=True, fifo_depth=256, deep_buffer_depth=0):
         
         # Packet parser
-        self.submodules.packet = packet = _K2MMPacketParser(dw=dw)
+        self.submodules.packet = packet = _K2MMPacketParser(dw=dw, with_crc=with_crc, buffer_mode=buffer_mode,
+            bufferrized=bufferrized, fifo_depth=fifo_depth)
         self.source_packet_tx = Endpoint(packet.source_packet_tx.description, name="source_packet_tx")
         self.sink_packet_rx = Endpoint(packet.sink_packet_rx.description, name="sink_packet_rx")
-        self.comb += [
-            packet.source_packet_tx.connect(self.source_packet_tx),
-            self.sink_packet_rx.connect(packet.sink_packet_rx)
-        ]
+        link_source, link_sink = packet.source_packet_tx, packet.sink_packet_rx
+
+        # Link without frame delimiting (e.g. Aurora streaming mode)
+        if link_mode == "streaming":
+            from cores.tf.streaming import K2MMStreamTX, K2MMStreamRX
+            self.submodules.stream_tx = stream_tx = K2MMStreamTX(dw=dw)
+            self.submodules.stream_rx = stream_rx = K2MMStreamRX(dw=dw)
+            self.comb += [
+                link_source.connect(stream_tx.sink),
+                stream_rx.source.connect(link_sink),
+            ]
+            link_source, link_sink = stream_tx.source, stream_rx.sink
+        elif link_mode != "framing":
+            raise ValueError("Unknown link mode: {}".format(link_mode))
+
+        # Deep link-side buffers in UltraRAM (deep_buffer_depth * dw bits each way),
+        # absorb bursts without backpressure reaching the link
+        if deep_buffer_depth:
+            from cores.xpm_fifo import XPMStreamFIFO
+            self.submodules.tx_deep = tx_deep = XPMStreamFIFO(link_source.description,
+                depth=deep_buffer_depth, buffered=True, with_counts=True, memory_type="ultra")
+            self.submodules.rx_deep = rx_deep = XPMStreamFIFO(link_sink.description,
+                depth=deep_buffer_depth, buffered=True, with_counts=True, memory_type="ultra")
+            self.comb += [
+                link_source.connect(tx_deep.sink),
+                rx_deep.source.connect(link_sink),
+            ]
+            link_source, link_sink = tx_deep.source, rx_deep.sink
+
+        self.comb += link_source.connect(self.source_packet_tx)
+        if with_error_injector:
+            from cores.tf.reliable import LinkErrorInjector
+            self.submodules.injector = injector = LinkErrorInjector(self.sink_packet_rx.description)
+            self.comb += [
+                self.sink_packet_rx.connect(injector.sink),
+                injector.source.connect(link_sink),
+            ]
+        else:
+            self.comb += self.sink_packet_rx.connect(link_sink)
+
+        # Reliable delivery (optional)
+        packet_sink, packet_source = packet.sink, packet.source
+        if with_reliable:
+            from cores.tf.reliable import K2MMReliable
+            self.submodules.reliable = reliable = K2MMReliable(dw=dw, **dict(reliable_params or {}))
+            self.comb += [
+                reliable.source_link.connect(packet.sink),
+                packet.source.connect(reliable.sink_link),
+            ]
+            packet_sink, packet_source = reliable.sink, reliable.source
 
         # function modules
         self.submodules.probe = probe = K2MMProbe(dw=dw)
@@ -226,18 +318,18 @@ class K2MM(Module):
                 probe.source,
                 tester.source,
             ],
-            packet.sink
+            packet_sink
         )
  
         # Dispatcher
         self.submodules.dispatcher = dispatcher = Dispatcher(
-            packet.source,
+            packet_source,
             [
                 tester.sink,
                 probe.sink
             ]
         )
-        self.comb += [dispatcher.sel.eq(packet.source.pf)]
+        self.comb += [dispatcher.sel.eq(packet_source.pf)]
 
     def get_ios(self):
         return [
@@ -249,8 +341,26 @@ class K2MM(Module):
 
 from litex.soc.interconnect.csr_eventmanager import AutoCSR, CSRStatus, CSRStorage, CSRField
 class K2MMControl(Module, AutoCSR):
-    def __init__(self, k2mm : K2MM, dw=32):
+    """ CSRs of a K2MM running in clock domain `cd`
+
+    With `cd` other than "sys", `source_ctrl` is in `cd` through an XPM
+    async FIFO (`xpm=False` for simulation), counters cross over with
+    BusSynchronizer and settings with MultiReg (change them while the
+    K2MM is idle).
+    """
+    def __init__(self, k2mm : K2MM, dw=32, cd="sys", xpm=True):
+        self.cd = cd
         self.source_ctrl = Endpoint(k2mm.sink_tester_ctrl.description)
+        ctrl = self.source_ctrl
+        if cd != "sys":
+            ctrl = Endpoint(k2mm.sink_tester_ctrl.description)
+            from cores.xpm_fifo import XPMAsyncStreamFIFO
+            self.submodules.cdc_ctrl = cdc_ctrl = ClockDomainsRenamer({"write" : "sys", "read" : cd})(
+                XPMAsyncStreamFIFO(ctrl.description, depth=16, xpm=xpm))
+            self.comb += [
+                ctrl.connect(cdc_ctrl.sink),
+                cdc_ctrl.source.connect(self.source_ctrl),
+            ]
         self._probe_len = CSRStorage(
             description = "Test frame length",
             fields = [
@@ -272,7 +382,76 @@ class K2MMControl(Module, AutoCSR):
         )
 
         self.comb += [
-            self.source_ctrl.length.eq(self._probe_len.fields.length),
-            self._probe_status.fields.ready.eq(self.source_ctrl.ready),
-            self.source_ctrl.valid.eq(self._probe_ctrl.fields.enable & self._probe_ctrl.re)
+            ctrl.length.eq(self._probe_len.fields.length),
+            self._probe_status.fields.ready.eq(ctrl.ready),
+            ctrl.valid.eq(self._probe_ctrl.fields.enable & self._probe_ctrl.re)
         ]
+
+        if hasattr(k2mm.packet.prx, "crc_errors"):
+            self._crc_errors = CSRStatus(32, description="Received frames with bad CRC32", name="crc_errors")
+            self._add_status(self._crc_errors, k2mm.packet.prx.crc_errors)
+        if hasattr(k2mm.packet, "tx_dropped"):
+            self._tx_dropped = CSRStatus(32, description="Frames to send dropped by the store-and-forward buffer (too long)", name="tx_dropped")
+            self._add_status(self._tx_dropped, k2mm.packet.tx_dropped)
+        if hasattr(k2mm.packet, "rx_dropped"):
+            self._rx_dropped = CSRStatus(32, description="Received frames dropped by the store-and-forward buffer", name="rx_dropped")
+            self._add_status(self._rx_dropped, k2mm.packet.rx_dropped)
+        if hasattr(k2mm, "rx_deep"):
+            self._tx_deep_level = CSRStatus(len(k2mm.tx_deep.wr_data_count), description="TX deep buffer occupancy [beats]", name="tx_deep_level")
+            self._rx_deep_level = CSRStatus(len(k2mm.rx_deep.wr_data_count), description="RX deep buffer occupancy [beats]", name="rx_deep_level")
+            self._add_status(self._tx_deep_level, k2mm.tx_deep.wr_data_count)
+            self._add_status(self._rx_deep_level, k2mm.rx_deep.wr_data_count)
+        if hasattr(k2mm, "reliable"):
+            self._add_reliable_csrs(k2mm.reliable)
+        if hasattr(k2mm, "injector"):
+            self._add_injector_csrs(k2mm.injector)
+
+    def _add_status(self, csr, sig):
+        if self.cd == "sys":
+            self.comb += csr.status.eq(sig)
+        else:
+            sync = BusSynchronizer(len(sig), self.cd, "sys")
+            self.submodules += sync
+            self.comb += [
+                sync.i.eq(sig),
+                csr.status.eq(sync.o),
+            ]
+
+    def _add_setting(self, sig, value):
+        if self.cd == "sys":
+            self.comb += sig.eq(value)
+        else:
+            self.specials += MultiReg(value, sig, odomain=self.cd)
+
+    def _add_reliable_csrs(self, reliable):
+        self._rl_timeout = CSRStorage(32, reset=reliable.timeout.reset.value,
+            description="Retransmission timeout [cycles]", name="rl_timeout")
+        self._add_setting(reliable.timeout, self._rl_timeout.storage)
+        for name, sig, desc in [
+            ("rl_occupancy",   reliable.tx.occupancy,   "Replay buffer occupancy [beats]"),
+            ("rl_retransmits", reliable.tx.retransmits, "Go-back events (NAK or timeout)"),
+            ("rl_replayed",    reliable.tx.replayed,    "Retransmitted frames"),
+            ("rl_tx_beats",    reliable.tx.tx_beats,    "Transmitted beats incl. retransmissions"),
+            ("rl_rx_beats",    reliable.rx.rx_beats,    "Delivered beats (goodput)"),
+            ("rl_rx_frames",   reliable.rx.rx_frames,   "Delivered frames"),
+            ("rl_rx_errors",   reliable.rx.rx_errors,   "Received frames with error"),
+            ("rl_rx_dropped",  reliable.rx.rx_dropped,  "Received out-of-sequence frames"),
+        ]:
+            csr = CSRStatus(len(sig), description=desc, name=name)
+            setattr(self, "_" + name, csr)
+            self._add_status(csr, sig)
+
+    def _add_injector_csrs(self, injector):
+        self._inj_ctrl = CSRStorage(
+            description = "Link error injector",
+            fields = [
+                CSRField("enable", size=1, description="Inject errors into received frames"),
+                CSRField("drop",   size=1, description="0 = set `error`, 1 = drop frame"),
+            ],
+            name="inj_ctrl")
+        self._inj_threshold = CSRStorage(32, description="Error rate (threshold / 2^32 per frame)", name="inj_threshold")
+        self._inj_count = CSRStatus(32, description="Injected errors", name="inj_count")
+        self._add_setting(injector.enable, self._inj_ctrl.fields.enable)
+        self._add_setting(injector.drop, self._inj_ctrl.fields.drop)
+        self._add_setting(injector.threshold, self._inj_threshold.storage)
+        self._add_status(self._inj_count, injector.injected)
@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+from functools import reduce
+
+from migen import *
+from migen.genlib.cdc import BusSynchronizer, MultiReg
+from liteeth.common import eth_udp_user_description
+from litex.soc.interconnect.csr import AutoCSR, CSRStatus, CSRStorage
+from litex.soc.interconnect.stream import Endpoint, SyncFIFO
+
+from cores.tf.packet import K2MMPacket
+
+def _lseq_slice(signal):
+    field = K2MMPacket.header_fields["lseq"]
+    start = field.byte * 8 + field.offset
+    return signal[start:start + field.width]
+
+class _LagTX(Module):
+    def __init__(self, description, links):
+        self.sink    = sink = Endpoint(description)
+        self.sources = [Endpoint(description) for _ in range(links)]
+        self.links_up = Signal(links)
+        self.frames   = [Signal(32) for _ in range(links)]
+
+        # # #
+
+        lseq    = Signal(8)
+        in_pkt  = Signal()
+        cur     = Signal(max=max(links, 2)) # Link of the ongoing frame
+        last    = Signal(max=max(links, 2)) # Link of the previous frame
+        pick    = Signal(max=max(links, 2))
+        any_up  = Signal()
+        route   = Signal(max=max(links, 2))
+
+        # Next link that is up, round-robin after the previous one
+        cases = {}
+        for i in range(links):
+            choice = []
+            for j in reversed(range(i + 1, i + 1 + links)):
+                t = j % links
+                choice = [If(self.links_up[t], pick.eq(t)).Else(*choice)]
+            cases[i] = choice
+        self.comb += [
+            any_up.eq(self.links_up != 0),
+            Case(last, cases),
+            route.eq(Mux(in_pkt, cur, pick)),
+        ]
+
+        for i, source in enumerate(self.sources):
+            self.comb += If((route == i) & (in_pkt | any_up),
+                sink.connect(source),
+                If(~in_pkt,
+                    _lseq_slice(source.data).eq(lseq)
+                )
+            )
+            self.sync += If(source.valid & source.ready & source.last,
+                self.frames[i].eq(self.frames[i] + 1)
+            )
+
+        self.sync += If(sink.valid & sink.ready,
+            in_pkt.eq(~sink.last),
+            If(~in_pkt,
+                cur.eq(pick),
+                last.eq(pick),
+                lseq.eq(lseq + 1),
+            )
+        )
+
+class _LagRX(Module):
+    def __init__(self, description, links, fifo_depth, timeout):
+        self.sinks  = [Endpoint(description) for _ in range(links)]
+        self.source = source = Endpoint(description)
+        self.timeout = Signal(32, reset=timeout)
+        self.lost    = Signal(32)
+
+        # # #
+
+        # Per-link FIFOs absorb the skew between links (reorder buffer)
+        heads = []
+        for sink in self.sinks:
+            fifo = SyncFIFO(description, fifo_depth, buffered=True)
+            self.submodules += fifo
+            self.comb += sink.connect(fifo.sink)
+            heads.append(fifo.source)
+
+        expected = Signal(8)
+        busy     = Signal()
+        cur      = Signal(max=max(links, 2))
+        match    = Signal(max=max(links, 2))
+        matched  = Signal()
+        sel      = Signal(max=max(links, 2))
+
+        # Each link delivers in order, so the expected frame is at a head
+        for i in reversed(range(links)):
+            self.comb += If(heads[i].valid & (_lseq_slice(heads[i].data) == expected),
+                match.eq(i),
+                matched.eq(1),
+            )
+        self.comb += sel.eq(Mux(busy, cur, match))
+        for i, head in enumerate(heads):
+            self.comb += If((busy | matched) & (sel == i),
+                head.connect(source),
+                # Restore the header the CRC was computed on
+                If(~busy,
+                    _lseq_slice(source.data).eq(0)
+                )
+            )
+        self.sync += If(source.valid & source.ready,
+            busy.eq(~source.last),
+            cur.eq(sel),
+            If(source.last,
+                expected.eq(expected + 1)
+            )
+        )
+
+        # A frame lost on a failing link: skip to the closest waiting frame
+        timer = Signal(32)
+        dists = []
+        for head in heads:
+            dist = Signal(9)
+            self.comb += dist.eq(Mux(head.valid, (_lseq_slice(head.data) - expected)[:8], 2**8))
+            dists.append(dist)
+        closest = Signal(9)
+        self.comb += closest.eq(reduce(lambda a, b: Mux(a < b, a, b), dists))
+        self.sync += [
+            If(busy | matched | (closest[8] == 1),
+                timer.eq(0)
+            ).Elif(timer == self.timeout,
+                timer.eq(0),
+                expected.eq(expected + closest[:8]),
+                self.lost.eq(self.lost + closest[:8]),
+            ).Else(
+                timer.eq(timer + 1)
+            )
+        ]
+
+class K2MMLinkAggregator(Module, AutoCSR):
+    """ Stripe one K2MM link-side stream across several links
+
+    Sits between a `K2MM` (`source_packet_tx`/`sink_packet_rx`) and `links`
+    link ports. Whole frames are sent round-robin over the links that are
+    up (`link_status`, e.g. channel_up, masked by the `mask` CSR) with an
+    8-bit aggregation sequence number in the K2MM header (`lseq`,
+    dw >= 128), cleared again on reception. The receiver buffers each link
+    in a `fifo_depth`-beat FIFO and releases frames in sequence order; a
+    frame missing for `timeout` cycles (lost on a failing link) is skipped
+    and counted in `lost`. Both ends must aggregate the same links.
+
+    Frames waiting in one link FIFO must stay below 128 so that `lseq` does
+    not wrap.
+
+    The streams and `link_status` are in clock domain `cd`, the CSRs in
+    sys.
+    """
+    def __init__(self, dw=256, links=2, fifo_depth=256, timeout=4096, cd="sys"):
+        description = eth_udp_user_description(dw)
+        self.submodules.tx = tx = ClockDomainsRenamer(cd)(_LagTX(description, links))
+        self.submodules.rx = rx = ClockDomainsRenamer(cd)(_LagRX(description, links, fifo_depth, timeout))
+
+        # K2MM side
+        self.sink   = tx.sink
+        self.source = rx.source
+
+        # Link side
+        self.sources  = tx.sources
+        self.sinks    = rx.sinks
+        self.link_status = Signal(links)
+
+        self.timeout = rx.timeout
+        self.lost    = rx.lost
+        self.frames  = tx.frames
+
+        self._mask    = CSRStorage(links, reset=2**links - 1, description="Links used for transmission")
+        self._timeout = CSRStorage(32, reset=timeout, description="Lost frame timeout [cycles]")
+        self._lost    = CSRStatus(32, description="Frames skipped by the receiver")
+        self._up      = CSRStatus(links, description="Links used now")
+        if cd == "sys":
+            self.comb += [
+                tx.links_up.eq(self.link_status & self._mask.storage),
+                rx.timeout.eq(self._timeout.storage),
+                self._lost.status.eq(rx.lost),
+                self._up.status.eq(tx.links_up),
+            ]
+        else:
+            mask = Signal(links)
+            self.submodules.lost_sync = lost_sync = BusSynchronizer(32, cd, "sys")
+            self.specials += [
+                MultiReg(self._mask.storage, mask, odomain=cd, reset=2**links - 1),
+                MultiReg(self._timeout.storage, rx.timeout, odomain=cd, reset=timeout),
+                MultiReg(tx.links_up, self._up.status, odomain="sys"),
+            ]
+            self.comb += [
+                tx.links_up.eq(self.link_status & mask),
+                lost_sync.i.eq(rx.lost),
+                self._lost.status.eq(lost_sync.o),
+            ]
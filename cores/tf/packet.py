@@ -30,7 +30,24 @@ class K2MMPacket:
         "pr":        _HeaderField(2, 1,  1, user=True),
         "pf":        _HeaderField(2, 0,  1, user=True),
         "addr_size": _HeaderField(3, 0,  8, user=False),
-        "port_size": _HeaderField(4, 0,  8, user=False)
+        "port_size": _HeaderField(4, 0,  8, user=False),
+        # Link layer (cores.tf.reliable)
+        "nk":        _HeaderField(5, 2,  1, user=True),
+        "ak":        _HeaderField(5, 1,  1, user=True),
+        "rd":        _HeaderField(5, 0,  1, user=True),
+        "seq":       _HeaderField(6, 0, 16, user=True),
+        "ack":       _HeaderField(8, 0, 16, user=True),
+        # Segmentation and reassembly (cores.tf.sar)
+        "em":        _HeaderField(5, 4,  1, user=True),
+        "sm":        _HeaderField(5, 3,  1, user=True),
+        "sch":       _HeaderField(10, 0, 8, user=True),
+        "sseq":      _HeaderField(11, 0, 16, user=True),
+        # Message coalescing (cores.tf.coalesce)
+        "nmsg":      _HeaderField(13, 0, 16, user=True),
+        # Link aggregation (cores.tf.lag), rewritten on the link side
+        "lseq":      _HeaderField(15, 0,  8, user=False),
+        # Frame length [beats] for Aurora streaming mode (cores.tf.streaming)
+        "nbeats":    _HeaderField(16, 0, 16, user=False),
     }
     header = Header(header_fields, header_length, swap_field_bytes=True)
 
@@ -0,0 +1,491 @@
+#!/usr/bin/python3
+from migen import *
+from litex.soc.interconnect.stream import Endpoint, EndpointDescription, SyncFIFO
+
+from cores.tf.packet import K2MMPacket
+
+# Header fields owned by the link layer (see K2MMPacket.header_fields)
+_link_fields = {"rd", "ak", "nk", "seq", "ack"}
+
+def _seq_dist(a, b):
+    """(a - b) mod 2^16"""
+    return (a - b)[:16]
+
+class _BeatReader(Module):
+    """ Prefetching reader for a beat memory
+
+    Streams beats from `ptr` while `ptr != limit`. One beat is kept in flight so
+    that a synchronous (BRAM) read port still gives one beat per cycle.
+    With `stop_at_last`, nothing is fetched past a beat flagged `last` so that
+    the owner can reposition `ptr` between frames.
+    """
+    def __init__(self, port, payload_layout, aw, stop_at_last=False):
+        self.source = source = Endpoint(EndpointDescription(payload_layout))
+        self.enable = Signal()
+        self.limit  = Signal(aw + 1)
+        self.load   = Signal()
+        self.load_ptr = Signal(aw + 1)
+        self.ptr    = ptr = Signal(aw + 1)
+
+        # # #
+
+        beat = Record([("payload", payload_layout), ("last", 1)])
+        out_valid = Signal()
+        advance = Signal()
+        fetch = Signal()
+
+        self.comb += [
+            beat.raw_bits().eq(port.dat_r),
+            source.valid.eq(out_valid),
+            source.payload.eq(beat.payload),
+            source.last.eq(beat.last),
+            advance.eq(~out_valid | source.ready),
+            fetch.eq(self.enable & (ptr != self.limit) & advance),
+            port.adr.eq(ptr[:aw]),
+            port.re.eq(advance),
+        ]
+        if stop_at_last:
+            self.comb += If(out_valid & beat.last, fetch.eq(0))
+
+        self.sync += [
+            If(self.load,
+                ptr.eq(self.load_ptr),
+                out_valid.eq(0),
+            ).Elif(advance,
+                out_valid.eq(fetch),
+                If(fetch,
+                    ptr.eq(ptr + 1),
+                )
+            )
+        ]
+
+class _ReliableTX(Module):
+    """ Go-back-N transmitter with replay buffer
+
+    Every frame accepted on `sink` is stored in the replay buffer and numbered.
+    Stored frames are released when the peer acknowledges them, and resent
+    from the oldest unacknowledged frame on NAK or on timeout.
+    """
+    def __init__(self, dw=32, depth=1024, window=32, timeout=65535):
+        desc = K2MMPacket.packet_user_description(dw)
+        self.sink   = sink   = Endpoint(desc)
+        self.source = source = Endpoint(desc)
+
+        # From the receiver
+        self.ack_valid   = Signal()
+        self.ack_seq     = Signal(16)
+        self.nak         = Signal()
+        self.rx_expected = Signal(16)
+        self.ack_request = Signal()
+        self.nak_request = Signal()
+        self.ack_sent    = Signal()
+
+        self.timeout = Signal(32, reset=timeout)
+
+        # Status
+        self.occupancy   = Signal(log2_int(depth) + 1)
+        self.retransmits = Signal(32)
+        self.replayed    = Signal(32)
+        self.tx_beats    = Signal(32)
+
+        # # #
+
+        aw = log2_int(depth)
+        ww = log2_int(window)
+        payload_layout = desc.payload_layout
+        param_layout = [(n, w) for n, w in desc.param_layout if n not in _link_fields]
+
+        beat = Record([("payload", payload_layout), ("last", 1)])
+        entry = Record([("start", aw + 1), ("param", param_layout)])
+
+        self.specials.mem = mem = Memory(len(beat), depth)
+        self.specials.table = table = Memory(len(entry), window)
+        wrport = mem.get_port(write_capable=True)
+        rdport = mem.get_port(has_re=True)
+        table_wr = table.get_port(write_capable=True)
+        table_tx = table.get_port(async_read=True)
+        table_ack = table.get_port(async_read=True)
+        self.specials += wrport, rdport, table_wr, table_tx, table_ack
+
+        wr_ptr   = Signal(aw + 1)
+        free_ptr = Signal(aw + 1)
+        wr_first = Signal(reset=1)
+        next_seq = Signal(16)
+        base_seq = Signal(16)
+        send_seq = Signal(16)
+        sent_hi  = Signal(16)
+        rewind   = Signal()
+
+        self.comb += self.occupancy.eq(wr_ptr - free_ptr)
+
+        # Replay buffer write
+        inflight = _seq_dist(next_seq, base_seq)
+        self.comb += [
+            sink.ready.eq((self.occupancy < depth) & ~(wr_first & (inflight >= window))),
+            beat.payload.eq(sink.payload),
+            beat.last.eq(sink.last),
+            wrport.adr.eq(wr_ptr[:aw]),
+            wrport.dat_w.eq(beat.raw_bits()),
+            wrport.we.eq(sink.valid & sink.ready),
+            entry.start.eq(wr_ptr),
+            [getattr(entry.param, n).eq(getattr(sink, n)) for n, _ in param_layout],
+            table_wr.adr.eq(next_seq[:ww]),
+            table_wr.dat_w.eq(entry.raw_bits()),
+            table_wr.we.eq(sink.valid & sink.ready & wr_first),
+        ]
+        self.sync += [
+            If(sink.valid & sink.ready,
+                wr_ptr.eq(wr_ptr + 1),
+                wr_first.eq(sink.last),
+                If(sink.last,
+                    next_seq.eq(next_seq + 1)
+                )
+            )
+        ]
+
+        # Acknowledge
+        ack_entry = Record(entry.layout)
+        ack_ok = Signal()
+        self.comb += [
+            table_ack.adr.eq(self.ack_seq[:ww]),
+            ack_entry.raw_bits().eq(table_ack.dat_r),
+            ack_ok.eq(self.ack_valid &
+                (_seq_dist(self.ack_seq, base_seq) <= _seq_dist(sent_hi, base_seq))),
+        ]
+        self.sync += [
+            If(ack_ok,
+                base_seq.eq(self.ack_seq),
+                If((self.ack_seq == next_seq) & wr_first,
+                    free_ptr.eq(wr_ptr)
+                ).Else(
+                    free_ptr.eq(ack_entry.start)
+                )
+            )
+        ]
+
+        # Retransmission timer
+        timer = Signal(32)
+        timer_expired = Signal()
+        rewound = Signal()
+        self.comb += timer_expired.eq(timer == self.timeout)
+        self.sync += [
+            If((ack_ok & (self.ack_seq != base_seq)) | (sent_hi == base_seq) | timer_expired,
+                timer.eq(0)
+            ).Else(
+                timer.eq(timer + 1)
+            ),
+            If(timer_expired | (ack_ok & self.nak),
+                rewind.eq(1),
+                self.retransmits.eq(self.retransmits + 1)
+            ).Elif(rewound,
+                rewind.eq(0)
+            )
+        ]
+
+        # Transmit
+        self.submodules.reader = reader = _BeatReader(rdport, payload_layout, aw, stop_at_last=True)
+        tx_entry = Record(entry.layout)
+        self.comb += [
+            table_tx.adr.eq(send_seq[:ww]),
+            tx_entry.raw_bits().eq(table_tx.dat_r),
+            reader.limit.eq(wr_ptr),
+            reader.load_ptr.eq(tx_entry.start),
+        ]
+
+        tx_first = Signal(reset=1)
+        frame_ready = Signal()
+        self.comb += frame_ready.eq((send_seq != next_seq) | ~wr_first)
+        self.sync += If(source.valid & source.ready,
+            tx_first.eq(source.last),
+            self.tx_beats.eq(self.tx_beats + 1)
+        )
+        self.comb += self.ack_sent.eq(source.valid & source.ready & tx_first)
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            If(rewind | (_seq_dist(send_seq, base_seq) > _seq_dist(next_seq, base_seq)),
+                rewound.eq(1),
+                NextValue(send_seq, base_seq),
+            ).Elif(frame_ready,
+                reader.load.eq(1),
+                If(_seq_dist(send_seq, base_seq) < _seq_dist(sent_hi, base_seq),
+                    NextValue(self.replayed, self.replayed + 1)
+                ),
+                NextState("DATA")
+            ).Elif(self.ack_request | self.nak_request,
+                NextState("CONTROL")
+            )
+        )
+        fsm.act("DATA",
+            reader.enable.eq(1),
+            reader.source.connect(source),
+            [getattr(source, n).eq(getattr(tx_entry.param, n)) for n, _ in param_layout],
+            source.rd.eq(1),
+            source.seq.eq(send_seq),
+            source.ak.eq(1),
+            source.ack.eq(self.rx_expected),
+            source.nk.eq(self.nak_request),
+            If(source.valid & source.ready & source.last,
+                NextValue(send_seq, send_seq + 1),
+                If(_seq_dist(send_seq + 1, base_seq) > _seq_dist(sent_hi, base_seq),
+                    NextValue(sent_hi, send_seq + 1)
+                ),
+                NextState("IDLE")
+            )
+        )
+        fsm.act("CONTROL",
+            source.valid.eq(1),
+            source.last.eq(1),
+            source.length.eq(dw // 8),
+            source.ak.eq(1),
+            source.ack.eq(self.rx_expected),
+            source.nk.eq(self.nak_request),
+            If(source.ready,
+                NextState("IDLE")
+            )
+        )
+
+class _ReliableRX(Module):
+    """ Go-back-N receiver
+
+    Frames are held in a store-and-forward buffer and released only once their
+    last beat arrived without `error` and in sequence. Anything else is
+    discarded and answered with a NAK (once per gap).
+    """
+    def __init__(self, dw=32, depth=1024, frames=16):
+        desc = K2MMPacket.packet_user_description(dw)
+        self.sink   = sink   = Endpoint(desc)
+        self.source = source = Endpoint(desc)
+
+        # To the transmitter
+        self.ack_valid   = Signal()
+        self.ack_seq     = Signal(16)
+        self.nak         = Signal()
+        self.expected    = expected = Signal(16)
+        self.ack_request = ack_request = Signal()
+        self.nak_request = nak_request = Signal()
+        self.ack_sent    = Signal()
+
+        # Status
+        self.rx_errors  = Signal(32)
+        self.rx_dropped = Signal(32)
+        self.rx_frames  = Signal(32)
+        self.rx_beats   = Signal(32)
+
+        # # #
+
+        aw = log2_int(depth)
+        payload_layout = desc.payload_layout
+        param_layout = [(n, w) for n, w in desc.param_layout if n not in _link_fields]
+
+        beat = Record([("payload", payload_layout), ("last", 1)])
+        self.specials.mem = mem = Memory(len(beat), depth)
+        wrport = mem.get_port(write_capable=True)
+        rdport = mem.get_port(has_re=True)
+        self.specials += wrport, rdport
+
+        self.submodules.params = params = SyncFIFO(param_layout, frames)
+
+        self.submodules.reader = reader = _BeatReader(rdport, payload_layout, aw)
+
+        wr_ptr     = Signal(aw + 1)
+        commit_ptr = Signal(aw + 1)
+        frame_err  = Signal()
+        nak_sent   = Signal()
+
+        accept = Signal()
+        bad    = Signal()
+        dist   = _seq_dist(sink.seq, expected)
+        self.comb += [
+            accept.eq(sink.rd & (sink.seq == expected)),
+            bad.eq(frame_err | (sink.error != 0)),
+            If(accept,
+                sink.ready.eq(((wr_ptr - reader.ptr)[:aw + 1] < depth) &
+                    (~sink.last | params.sink.ready))
+            ).Else(
+                sink.ready.eq(1)
+            ),
+            beat.payload.eq(sink.payload),
+            beat.last.eq(sink.last),
+            wrport.adr.eq(wr_ptr[:aw]),
+            wrport.dat_w.eq(beat.raw_bits()),
+            wrport.we.eq(sink.valid & sink.ready & accept),
+            [getattr(params.sink, n).eq(getattr(sink, n)) for n, _ in param_layout],
+            params.sink.valid.eq(sink.valid & sink.ready & sink.last & accept & ~bad),
+
+            self.ack_seq.eq(sink.ack),
+            self.ack_valid.eq(sink.valid & sink.ready & sink.last & ~bad & sink.ak),
+            self.nak.eq(sink.nk),
+        ]
+
+        new_ack = Signal()
+        new_nak = Signal()
+        self.sync += [
+            new_ack.eq(0),
+            new_nak.eq(0),
+            If(sink.valid & sink.ready,
+                frame_err.eq(~sink.last & bad),
+                If(accept,
+                    wr_ptr.eq(wr_ptr + 1)
+                ),
+                If(sink.last,
+                    If(bad,
+                        self.rx_errors.eq(self.rx_errors + 1),
+                        wr_ptr.eq(commit_ptr),
+                        new_nak.eq(~nak_sent),
+                        nak_sent.eq(1),
+                    ).Elif(accept,
+                        commit_ptr.eq(wr_ptr + 1),
+                        expected.eq(expected + 1),
+                        nak_sent.eq(0),
+                        new_ack.eq(1),
+                    ).Elif(sink.rd,
+                        self.rx_dropped.eq(self.rx_dropped + 1),
+                        If(dist[15],
+                            # Duplicate: acknowledge again so that the peer moves on
+                            new_ack.eq(1)
+                        ).Else(
+                            # Gap: frames were lost
+                            new_nak.eq(~nak_sent),
+                            nak_sent.eq(1),
+                        )
+                    )
+                )
+            ),
+            If(new_nak,
+                nak_request.eq(1),
+                ack_request.eq(1),
+            ).Elif(new_ack,
+                ack_request.eq(1)
+            ).Elif(self.ack_sent,
+                ack_request.eq(0),
+                nak_request.eq(0),
+            ),
+        ]
+
+        # Deliver committed frames
+        self.comb += [
+            reader.enable.eq(1),
+            reader.limit.eq(commit_ptr),
+            reader.source.connect(source),
+            [getattr(source, n).eq(getattr(params.source, n)) for n, _ in param_layout],
+            params.source.ready.eq(source.valid & source.ready & source.last),
+        ]
+        self.sync += If(source.valid & source.ready,
+            self.rx_beats.eq(self.rx_beats + 1),
+            If(source.last,
+                self.rx_frames.eq(self.rx_frames + 1)
+            )
+        )
+
+class K2MMReliable(Module):
+    """ Optional reliable delivery layer for one K2MM link
+
+    Sits between the K2MM function modules and the packet parser. Frames get a
+    sequence number and are kept in a replay buffer until the peer acknowledges
+    them (cumulative ACK, piggybacked on every frame or sent as a one-beat
+    control frame). A bad (`error`) or out-of-sequence frame is answered with
+    a NAK and the sender goes back to the first unacknowledged frame; a lost
+    ACK/NAK is recovered by the retransmission timer.
+
+    Corruption is only seen through `error`; build K2MM `with_crc` so frames
+    damaged on the wire are flagged as well.
+
+    Both ends of a link must enable the layer. Frames must be shorter than
+    both `depth` (replay buffer) and `rx_depth` (receive buffer) beats.
+
+    Parameters
+    ----------
+    depth : int
+        Replay buffer depth in beats, see `bdp_depth()`.
+    window : int
+        Maximum number of unacknowledged frames.
+    timeout : int
+        Retransmission timeout in cycles (reset value of `timeout`).
+    """
+    def __init__(self, dw=32, depth=1024, window=32, timeout=65535, rx_depth=1024, rx_frames=16):
+        if K2MMPacket.get_header(dw).length < 10:
+            raise ValueError("K2MMReliable needs dw >= 128 (seq/ack do not fit the header beat)")
+        self.submodules.tx = tx = _ReliableTX(dw=dw, depth=depth, window=window, timeout=timeout)
+        self.submodules.rx = rx = _ReliableRX(dw=dw, depth=rx_depth, frames=rx_frames)
+
+        # Application side
+        self.sink   = tx.sink
+        self.source = rx.source
+        # Link side (to/from K2MMPacketTX/K2MMPacketRX)
+        self.source_link = tx.source
+        self.sink_link   = rx.sink
+
+        self.timeout = tx.timeout
+
+        # # #
+
+        self.comb += [
+            tx.ack_valid.eq(rx.ack_valid),
+            tx.ack_seq.eq(rx.ack_seq),
+            tx.nak.eq(rx.nak),
+            tx.rx_expected.eq(rx.expected),
+            tx.ack_request.eq(rx.ack_request),
+            tx.nak_request.eq(rx.nak_request),
+            rx.ack_sent.eq(tx.ack_sent),
+        ]
+
+    @staticmethod
+    def bdp_depth(line_rate, rtt, dw=256, margin=2):
+        """Replay buffer depth (beats, power of 2) for a bandwidth-delay product
+
+        Parameters
+        ----------
+        line_rate : float
+            Link payload rate [bit/s]
+        rtt : float
+            Round trip time incl. the peer's ACK turnaround [s]
+        """
+        beats = int(line_rate * rtt * margin) // dw + 1
+        return 2**bits_for(beats - 1)
+
+class LinkErrorInjector(Module):
+    """ Drop or corrupt frames on a link for test
+
+    Each frame is hit when a 32-bit LFSR drawn at its first beat is below
+    `threshold` (hit rate = threshold / 2^32). A hit frame is either dropped
+    as a whole (`drop` = 1) or passed with `error` set on its last beat.
+    """
+    def __init__(self, description):
+        self.sink   = sink   = Endpoint(description)
+        self.source = source = Endpoint(description)
+
+        self.enable    = Signal()
+        self.drop      = Signal()
+        self.threshold = Signal(32)
+        self.injected  = Signal(32)
+
+        # # #
+
+        lfsr = Signal(32, reset=0xace1ace1)
+        first = Signal(reset=1)
+        hit = Signal()
+        hit_r = Signal()
+        self.comb += hit.eq(Mux(first, self.enable & (lfsr < self.threshold), hit_r))
+        self.sync += [
+            # x^32 + x^22 + x^2 + x + 1
+            lfsr.eq(Cat(lfsr[31] ^ lfsr[21] ^ lfsr[1] ^ lfsr[0], lfsr[:31])),
+            If(sink.valid & sink.ready,
+                first.eq(sink.last),
+                If(first,
+                    hit_r.eq(hit),
+                    If(hit,
+                        self.injected.eq(self.injected + 1)
+                    )
+                )
+            )
+        ]
+        self.comb += [
+            sink.connect(source),
+            If(hit & self.drop,
+                source.valid.eq(0),
+                sink.ready.eq(1),
+            ).Elif(hit & sink.last,
+                source.error.eq(Replicate(1, len(source.error)))
+            )
+        ]
@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+from migen import *
+from litex.soc.interconnect.packet import Arbiter, Dispatcher
+from litex.soc.interconnect.stream import Endpoint, EndpointDescription
+
+from cores.tf.packet import K2MMPacket
+
+_sar_fields = {"sm", "em", "sch", "sseq"}
+
+def sar_message_description(dw):
+    """ K2MM user stream with the message length [beats] as extra parameter """
+    description = K2MMPacket.packet_user_description(dw)
+    return EndpointDescription(
+        description.payload_layout,
+        description.param_layout + [("msg_len", 32)])
+
+def _check_header(dw):
+    if K2MMPacket.get_header(dw).length < 13:
+        raise ValueError("SAR fields do not fit in a {}-bit K2MM header".format(dw))
+
+class _Segmenter(Module):
+    def __init__(self, dw, mtu, channel):
+        self.sink   = sink   = Endpoint(sar_message_description(dw))
+        self.source = source = Endpoint(K2MMPacket.packet_user_description(dw))
+
+        # # #
+
+        beats = Signal(max=mtu)
+        som   = Signal(reset=1)
+        rem   = Signal(32) # Remaining beats at start of segment
+        seq   = Signal(16)
+        rem_now = Signal(32)
+        self.comb += [
+            rem_now.eq(Mux(som, sink.msg_len, rem)),
+            sink.connect(source, omit={"last", "msg_len", "length"} | _sar_fields),
+            source.last.eq(sink.last | (beats == mtu - 1)),
+            source.sm.eq(som),
+            source.em.eq(rem_now <= mtu),
+            source.sch.eq(channel),
+            source.sseq.eq(seq),
+            source.length.eq(Mux(rem_now <= mtu, rem_now, mtu) * (dw // 8)),
+        ]
+        self.sync += If(source.valid & source.ready,
+            beats.eq(beats + 1),
+            If(source.last,
+                beats.eq(0),
+                rem.eq(rem_now - mtu),
+                som.eq(sink.last),
+                seq.eq(seq + 1),
+            )
+        )
+
+class _Reassembler(Module):
+    def __init__(self, dw):
+        self.sink   = sink   = Endpoint(K2MMPacket.packet_user_description(dw))
+        self.source = source = Endpoint(K2MMPacket.packet_user_description(dw))
+
+        self.gaps = Signal(32)
+
+        # # #
+
+        expected = Signal(16)
+        in_msg   = Signal()
+        bad      = Signal() # Message lost a segment
+        ok       = Signal()
+        self.comb += [
+            ok.eq((sink.sseq == expected) & (sink.sm != in_msg)),
+            sink.connect(source, omit={"last", "error"}),
+            source.last.eq(sink.last & sink.em),
+            source.error.eq(sink.error),
+            If(bad | ~ok,
+                source.error.eq(Replicate(1, len(source.error)))
+            ),
+        ]
+        self.sync += If(sink.valid & sink.ready & sink.last,
+            expected.eq(sink.sseq + 1),
+            in_msg.eq(~sink.em),
+            bad.eq(~sink.em & (bad | ~ok)),
+            If(~ok,
+                self.gaps.eq(self.gaps + 1)
+            )
+        )
+
+class K2MMSegmenter(Module):
+    """ Split messages into K2MM frames of at most `mtu` beats
+
+    Each channel has its own message sink; `msg_len` (beats) must be valid
+    with the first beat and held through the message. Channels are
+    interleaved round-robin at frame granularity, so a long message does not
+    block the others. Frames carry start/end-of-message flags, the channel
+    and a per-channel sequence number in the K2MM header (dw >= 128).
+    A frame of `mtu` beats must stay below 64 KiB (16-bit `length`).
+    """
+    def __init__(self, dw=256, mtu=256, channels=1):
+        _check_header(dw)
+        assert mtu * dw // 8 < 2**16, "mtu of {} beats exceeds the 16-bit frame length".format(mtu)
+        self.source = source = Endpoint(K2MMPacket.packet_user_description(dw))
+
+        # # #
+
+        segmenters = [_Segmenter(dw, mtu, i) for i in range(channels)]
+        self.submodules += segmenters
+        self.sinks = [s.sink for s in segmenters]
+        self.sink = self.sinks[0]
+        self.submodules.arbiter = Arbiter([s.source for s in segmenters], source)
+
+class K2MMReassembler(Module):
+    """ Rebuild messages from frames of `K2MMSegmenter`
+
+    Frames of a channel are concatenated in order; `last` marks the end of a
+    message. A missing frame (sequence gap) sets `error` on the rest of the
+    affected message and is counted in `gaps`.
+    """
+    def __init__(self, dw=256, channels=1):
+        _check_header(dw)
+        self.sink = sink = Endpoint(K2MMPacket.packet_user_description(dw))
+
+        self.gaps = Signal(32)
+
+        # # #
+
+        reassemblers = [_Reassembler(dw) for _ in range(channels)]
+        self.submodules += reassemblers
+        self.sources = [r.source for r in reassemblers]
+        self.source = self.sources[0]
+        self.submodules.dispatcher = dispatcher = Dispatcher(sink, [r.sink for r in reassemblers])
+        self.comb += [
+            dispatcher.sel.eq(sink.sch),
+            self.gaps.eq(sum(r.gaps for r in reassemblers)),
+        ]
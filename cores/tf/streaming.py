@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+from migen import *
+from liteeth.common import eth_udp_user_description
+from litex.soc.interconnect.packet import Header
+from litex.soc.interconnect.stream import Endpoint
+
+from cores.tf.packet import K2MMPacket
+
+def _link_header(dw):
+    fields = {k: K2MMPacket.header_fields[k] for k in ["magic", "nbeats"]}
+    header = Header(fields, dw // 8, swap_field_bytes=True)
+    if header.length < 18:
+        raise ValueError("Streaming mode needs dw >= 256 (got {})".format(dw))
+    return header
+
+class K2MMStreamTX(Module):
+    """ Mark frame boundaries for a link without `last` (Aurora streaming)
+
+    The frame length in beats, derived from `length`, is written into the
+    `nbeats` header field. Frames that do not match their `length` are
+    padded with zero beats or truncated, so the receiver never loses the
+    framing; they are counted in `length_errors`.
+    """
+    def __init__(self, dw=256):
+        header = _link_header(dw)
+        self.sink   = sink   = Endpoint(eth_udp_user_description(dw))
+        self.source = source = Endpoint(eth_udp_user_description(dw))
+
+        self.length_errors = Signal(32)
+
+        # # #
+
+        fields = Record([("magic", 16), ("nbeats", 16)])
+        first  = Signal(reset=1)
+        count  = Signal(16)
+        nbeats = Signal(16)
+        nbeats_now = Signal(16)
+        self.comb += [
+            nbeats_now.eq(nbeats),
+            If(first,
+                nbeats_now.eq((sink.length + dw // 8 - 1) >> log2_int(dw // 8)),
+                If(sink.length == 0,
+                    nbeats_now.eq(1)
+                )
+            ),
+            fields.magic.eq(K2MMPacket.magic),
+            fields.nbeats.eq(nbeats_now),
+        ]
+
+        self.submodules.fsm = fsm = FSM(reset_state="SEND")
+        fsm.act("SEND",
+            sink.connect(source),
+            If(first,
+                *header.encode(fields, source.data)
+            ),
+            source.last.eq(count == nbeats_now - 1),
+            If(source.valid & source.ready,
+                NextValue(count, count + 1),
+                NextValue(first, 0),
+                NextValue(nbeats, nbeats_now),
+                If(source.last,
+                    NextValue(count, 0),
+                    NextValue(first, 1),
+                    If(~sink.last,
+                        NextValue(self.length_errors, self.length_errors + 1),
+                        NextState("DISCARD")
+                    )
+                ).Elif(sink.last,
+                    NextValue(self.length_errors, self.length_errors + 1),
+                    NextState("PAD")
+                )
+            )
+        )
+        fsm.act("PAD",
+            source.valid.eq(1),
+            source.last.eq(count == nbeats - 1),
+            If(source.ready,
+                NextValue(count, count + 1),
+                If(source.last,
+                    NextValue(count, 0),
+                    NextValue(first, 1),
+                    NextState("SEND")
+                )
+            )
+        )
+        fsm.act("DISCARD",
+            sink.ready.eq(1),
+            If(sink.valid & sink.last,
+                NextState("SEND")
+            )
+        )
+
+class K2MMStreamRX(Module):
+    """ Recover `last` from the `nbeats` header field
+
+    Beats that do not start with the K2MM magic where a header is expected
+    are dropped until the next header (`resyncs` counts them). `nbeats` is
+    cleared again so that the header matches its CRC.
+    """
+    def __init__(self, dw=256):
+        header = _link_header(dw)
+        self.sink   = sink   = Endpoint(eth_udp_user_description(dw))
+        self.source = source = Endpoint(eth_udp_user_description(dw))
+
+        self.resyncs = Signal(32)
+
+        # # #
+
+        fields = Record([("magic", 16), ("nbeats", 16)])
+        packet = Record([("magic", 16), ("nbeats", 16)])
+        count  = Signal(16)
+        nbeats = Signal(16)
+        self.comb += [
+            header.decode(sink.data, fields),
+            packet.magic.eq(K2MMPacket.magic),
+        ]
+
+        self.submodules.fsm = fsm = FSM(reset_state="HEADER")
+        fsm.act("HEADER",
+            If(fields.magic == K2MMPacket.magic,
+                sink.connect(source, omit={"last", "length"}),
+                *header.encode(packet, source.data),
+                source.last.eq(fields.nbeats <= 1),
+                source.length.eq(fields.nbeats << log2_int(dw // 8)),
+                If(source.valid & source.ready & ~source.last,
+                    NextValue(count, 1),
+                    NextValue(nbeats, fields.nbeats),
+                    NextState("BODY")
+                )
+            ).Else(
+                sink.ready.eq(1),
+                If(sink.valid,
+                    NextValue(self.resyncs, self.resyncs + 1)
+                )
+            )
+        )
+        fsm.act("BODY",
+            sink.connect(source, omit={"last", "length"}),
+            source.last.eq(count == nbeats - 1),
+            source.length.eq(nbeats << log2_int(dw // 8)),
+            If(source.valid & source.ready,
+                NextValue(count, count + 1),
+                If(source.last,
+                    NextState("HEADER")
+                )
+            )
+        )
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+import random
+
+from migen import *
+
+from cores.tf.framing import K2MMPacketTX, K2MMPacketRX
+from cores.tf.coalesce import K2MMCoalescer, K2MMSplitter
+
+class _DUT(Module):
+    def __init__(self, dw=256, slot_dw=64, max_beats=4, timeout=32):
+        self.submodules.cls = cls = K2MMCoalescer(dw=dw, slot_dw=slot_dw, max_beats=max_beats, timeout=timeout)
+        self.submodules.tx  = tx  = K2MMPacketTX(dw=dw)
+        self.submodules.rx  = rx  = K2MMPacketRX(dw=dw)
+        self.submodules.spl = spl = K2MMSplitter(dw=dw, slot_dw=slot_dw)
+        self.comb += [
+            cls.source.connect(tx.sink),
+            tx.source.connect(rx.sink),
+            rx.source.connect(spl.sink),
+        ]
+
+def run(n=200, gap=0.1, dests=2, seed=1, **kwargs):
+    random.seed(seed)
+    dut = _DUT(**kwargs)
+    sent = [(i, random.randrange(dests)) for i in range(n)]
+    received, frames = [], [0]
+
+    def driver():
+        ep = dut.cls.sink
+        for data, dest in sent:
+            yield ep.data.eq(data)
+            yield ep.ip_address.eq(0x0a000000 + dest)
+            yield ep.valid.eq(1)
+            yield
+            while (yield ep.ready) == 0:
+                yield
+            yield ep.valid.eq(0)
+            while random.random() < gap:
+                yield
+        while len(received) < n:
+            yield
+        frames[0] = (yield dut.cls.frames)
+
+    @passive
+    def receiver():
+        ep = dut.spl.source
+        yield ep.ready.eq(1)
+        while True:
+            yield
+            if (yield ep.valid):
+                assert (yield ep.error) == 0
+                received.append(((yield ep.data), (yield ep.ip_address) - 0x0a000000))
+
+    run_simulation(dut, [driver(), receiver()])
+    assert received == sent
+    print("{} messages in {} frames ({:.2f} messages/frame)".format(n, frames[0], n / frames[0]))
+    return n / frames[0]
+
+if __name__ == "__main__":
+    # Bursts to one destination fill frames up to the threshold
+    assert run(dests=1, gap=0.0) > 10
+    # Changing destinations close frames early
+    run(dests=2, gap=0.1)
+    # Sparse messages are flushed by the timeout
+    run(n=20, dests=1, gap=0.98, timeout=8)
+    run(dw=128, slot_dw=32, dests=3, gap=0.3)
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+import random
+import zlib
+
+from migen import *
+from litex.soc.interconnect.stream import Endpoint
+
+from cores.tf.tfg import TestFrameGenerator
+from cores.tf.framing import K2MMPacketTX, K2MMPacketRX
+
+class _BitFlipper(Module):
+    def __init__(self, description):
+        self.sink   = sink   = Endpoint(description)
+        self.source = source = Endpoint(description)
+        self.flip   = Signal(len(sink.data))
+        self.comb += [
+            sink.connect(source),
+            source.data.eq(sink.data ^ self.flip),
+        ]
+
+class _DUT(Module):
+    def __init__(self, dw=256):
+        self.submodules.tfg = tfg = TestFrameGenerator(data_width=dw)
+        self.submodules.tx = tx = K2MMPacketTX(dw=dw, with_crc=True)
+        self.submodules.flipper = flipper = _BitFlipper(tx.source.description)
+        self.submodules.rx = rx = K2MMPacketRX(dw=dw, with_crc=True)
+        self.comb += [
+            tfg.source.connect(tx.sink),
+            tx.source.connect(flipper.sink),
+            flipper.source.connect(rx.sink),
+        ]
+
+def run(dw=256, lengths=[0, 1, 2, 10, 3, 7, 30, 0, 20, 5, 1, 16], seed=1):
+    random.seed(seed)
+    dut = _DUT(dw)
+    # Beat to corrupt per frame (None = clean); beat 0 (header) is left alone
+    # so that the frame still reaches the depacketizer output
+    targets = [random.choice([None, random.randint(1, l + 1)]) for l in lengths]
+    results = {"tx": [], "rx": []}
+
+    def driver():
+        ep = dut.tfg.sink_ctrl
+        for l in lengths:
+            yield ep.length.eq(l)
+            yield ep.valid.eq(1)
+            yield
+            while (yield ep.ready) == 0:
+                yield
+            yield ep.valid.eq(0)
+        while len(results["rx"]) < len(lengths):
+            yield
+        results["crc_errors"] = (yield dut.rx.crc_errors)
+
+    @passive
+    def link_monitor():
+        ep = dut.flipper.sink
+        beats, frame = [], 0
+        while True:
+            if (yield ep.valid) and (yield ep.ready):
+                beats.append((yield ep.data))
+                if (yield ep.last):
+                    results["tx"].append(beats)
+                    beats, frame = [], frame + 1
+            target = targets[frame] if frame < len(targets) else None
+            if target is not None and len(beats) == target:
+                yield dut.flipper.flip.eq(1 << random.randrange(dw))
+            else:
+                yield dut.flipper.flip.eq(0)
+            yield
+
+    @passive
+    def rx_monitor():
+        ep = dut.rx.source
+        beats = 0
+        while True:
+            ready = random.random() > 0.3
+            yield ep.ready.eq(ready)
+            yield
+            if (yield ep.valid) and ready:
+                beats += 1
+                if (yield ep.last):
+                    results["rx"].append((beats, (yield ep.error)))
+                    beats = 0
+
+    run_simulation(dut, [driver(), link_monitor(), rx_monitor()])
+
+    nbytes = dw // 8
+    for i, beats in enumerate(results["tx"]):
+        frame = b"".join(b.to_bytes(nbytes, "little") for b in beats[:-1])
+        assert beats[-1] & 0xffffffff == zlib.crc32(frame), "TX CRC mismatch (frame {})".format(i)
+    for i, (l, target, (beats, err)) in enumerate(zip(lengths, targets, results["rx"])):
+        print("frame {:2d}: len={:2d} corrupted={!s:5} error={:#x}".format(i, l, target is not None, err))
+        assert beats == l + 1
+        assert (err != 0) == (target is not None), "frame {}".format(i)
+    assert results["crc_errors"] == sum(t is not None for t in targets)
+
+if __name__ == "__main__":
+    for dw in [64, 256, 512]:
+        run(dw)
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+from migen import *
+
+from cores.tf.framing import K2MM, K2MMControl
+
+class _DUT(Module):
+    def __init__(self, cd="dp"):
+        self.submodules.k2mm = k2mm = ClockDomainsRenamer(cd)(K2MM(dw=64, with_crc=True))
+        self.submodules.ctrl = ctrl = K2MMControl(k2mm, dw=64, cd=cd, xpm=False)
+        self.comb += [
+            ctrl.source_ctrl.connect(k2mm.sink_tester_ctrl),
+            k2mm.source_packet_tx.connect(k2mm.sink_packet_rx),
+        ]
+
+def run(lengths=[4, 1, 16]):
+    dut = _DUT()
+    results = {"ctrl": []}
+
+    def cpu():
+        # CSR writes in sys
+        for l in lengths:
+            yield dut.ctrl._probe_len.fields.length.eq(l)
+            yield dut.ctrl._probe_ctrl.fields.enable.eq(1)
+            yield dut.ctrl._probe_ctrl.re.eq(1)
+            yield
+            yield dut.ctrl._probe_ctrl.re.eq(0)
+            for _ in range(100):
+                yield
+        results["crc_errors"] = (yield dut.ctrl._crc_errors.status)
+
+    @passive
+    def monitor():
+        ep = dut.k2mm.sink_tester_ctrl
+        while True:
+            if (yield ep.valid) and (yield ep.ready):
+                results["ctrl"].append((yield ep.length))
+            yield
+
+    run_simulation(dut, {"sys": [cpu()], "dp": [monitor()]}, clocks={"sys": 10, "dp": 4})
+    return results
+
+if __name__ == "__main__":
+    results = run()
+    print(results)
+    # Every CSR command reaches the tester in dp exactly once
+    assert results["ctrl"] == [4, 1, 16]
+    assert results["crc_errors"] == 0
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+import random
+from collections import deque
+
+from migen import *
+
+from cores.tf.framing import K2MM
+from cores.tf.lag import K2MMLinkAggregator
+
+class _DUT(Module):
+    def __init__(self, dw=128, links=2, cd="sys"):
+        self.submodules.a = K2MMLinkAggregator(dw=dw, links=links, fifo_depth=64, timeout=64, cd=cd)
+        self.submodules.b = K2MMLinkAggregator(dw=dw, links=links, fifo_depth=64, timeout=64, cd=cd)
+
+def run(dw=128, links=2, nframes=60, fail=None, seed=1, cd="sys"):
+    """ `fail` = (link, cycle): the link drops everything from that cycle on
+
+    With `cd` other than "sys" the datapath runs in `cd`, the CSRs in sys.
+    """
+    random.seed(seed)
+    dut = _DUT(dw, links, cd)
+    frames = [[i] + [(i << 16) | n for n in range(1, random.randint(1, 6))] for i in range(nframes)]
+    received, discarded = [], set()
+    tx_frames, lost = [], []
+    state = {"cycle": 0}
+
+    def driver():
+        ep = dut.a.sink
+        yield dut.a.link_status.eq(2**links - 1)
+        for beats in frames:
+            for n, data in enumerate(beats):
+                yield ep.data.eq(data)
+                yield ep.last.eq(n == len(beats) - 1)
+                yield ep.valid.eq(1)
+                yield
+                while (yield ep.ready) == 0:
+                    yield
+                yield ep.valid.eq(0)
+        while len(received) + len(discarded) < nframes:
+            yield
+        for f in dut.a.frames:
+            tx_frames.append((yield f))
+        lost.append((yield dut.b.lost))
+
+    @passive
+    def link(i, latency):
+        tx, rx = dut.a.sources[i], dut.b.sinks[i]
+        queue, first = deque(), True
+        while True:
+            cycle = state["cycle"]
+            dead = fail is not None and fail[0] == i and cycle >= fail[1]
+            if dead and fail[1] == cycle:
+                discarded.update(b[1] & 0xffff for b in queue if b[2])
+                queue.clear()
+                yield dut.a.link_status.eq(2**links - 1 - 2**i)
+            # Transmit
+            ready = dead or random.random() > 0.3
+            yield tx.ready.eq(ready)
+            # Receive after `latency` cycles
+            if queue and queue[0][0] <= cycle:
+                _, data, _first, last = queue[0]
+                yield rx.data.eq(data)
+                yield rx.last.eq(last)
+                yield rx.valid.eq(1)
+            else:
+                yield rx.valid.eq(0)
+            yield
+            if (yield rx.valid) and (yield rx.ready):
+                queue.popleft()
+            if ready and (yield tx.valid):
+                data, last = (yield tx.data), (yield tx.last)
+                if dead:
+                    if first:
+                        discarded.add(data & 0xffff)
+                else:
+                    queue.append((cycle + latency, data, first, last))
+                first = bool(last)
+
+    @passive
+    def clock():
+        while True:
+            yield
+            state["cycle"] += 1
+
+    @passive
+    def receiver():
+        ep = dut.b.source
+        beats = []
+        while True:
+            ready = random.random() > 0.1
+            yield ep.ready.eq(ready)
+            yield
+            if ready and (yield ep.valid):
+                beats.append((yield ep.data) & 0xffffffff)
+                if (yield ep.last):
+                    received.append(beats)
+                    beats = []
+
+    generators = [driver(), clock(), receiver()]
+    generators += [link(i, 10 + 17 * i) for i in range(links)]
+    if cd == "sys":
+        run_simulation(dut, generators)
+    else:
+        run_simulation(dut, {cd: generators}, clocks={"sys": 10, cd: 4})
+
+    expected = [f for f in frames if f[0] not in discarded]
+    assert received == expected
+    print("links={} frames per link={} delivered={} lost={}".format(links, tx_frames, len(received), len(discarded)))
+    assert lost[0] == len(discarded)
+    assert all(n > 0 for n in tx_frames)
+
+class _CRCDUT(Module):
+    def __init__(self, dw=256, links=2):
+        self.submodules.k2mm = k2mm = K2MM(dw=dw, with_crc=True)
+        self.submodules.k2mm_peer = k2mm_peer = K2MM(dw=dw, with_crc=True)
+        self.submodules.a = a = K2MMLinkAggregator(dw=dw, links=links, fifo_depth=64, timeout=64)
+        self.submodules.b = b = K2MMLinkAggregator(dw=dw, links=links, fifo_depth=64, timeout=64)
+        self.comb += [
+            k2mm.source_packet_tx.connect(a.sink),
+            a.source.connect(k2mm.sink_packet_rx),
+            k2mm_peer.source_packet_tx.connect(b.sink),
+            b.source.connect(k2mm_peer.sink_packet_rx),
+            a.link_status.eq(2**links - 1),
+            b.link_status.eq(2**links - 1),
+        ]
+        for i in range(links):
+            self.comb += [
+                a.sources[i].connect(b.sinks[i]),
+                b.sources[i].connect(a.sinks[i]),
+            ]
+
+def run_crc(lengths=[0, 1, 4, 2, 7, 3]):
+    """ lseq is rewritten after the CRC: frames must still check clean """
+    dut = _CRCDUT()
+    result = {"status": []}
+
+    def test():
+        ep = dut.k2mm.sink_tester_ctrl
+        for l in lengths:
+            yield ep.length.eq(l)
+            yield ep.valid.eq(1)
+            yield
+            while (yield ep.ready) == 0:
+                yield
+            yield ep.valid.eq(0)
+            n = len(result["status"])
+            while len(result["status"]) == n:
+                yield
+        result["crc_errors"] = []
+        for k in [dut.k2mm, dut.k2mm_peer]:
+            result["crc_errors"].append((yield k.packet.prx.crc_errors))
+
+    @passive
+    def status():
+        ep = dut.k2mm.source_tester_status
+        while True:
+            if (yield ep.valid):
+                result["status"].append((yield ep.err))
+            yield
+
+    run_simulation(dut, [test(), status()])
+    assert result["status"] == [0] * len(lengths)
+    assert result["crc_errors"] == [0, 0], result["crc_errors"]
+
+if __name__ == "__main__":
+    run()
+    run(links=4, dw=256)
+    run(fail=(1, 200))
+    run(fail=(1, 200), cd="dp")
+    run_crc()
+
+    # Datapath in dp: CSRs cross over instead of being read directly
+    lag = K2MMLinkAggregator(dw=128, cd="dp")
+    assert set(lag.tx.get_fragment().sync) == set(lag.rx.get_fragment().sync) == {"dp"}
+    assert {"sys", "dp"} <= set(lag.get_fragment().sync)
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+from migen.fhdl.module import Module
+from migen.fhdl.bitcontainer import *
+from migen import *
+from cores.tf.framing import K2MM
+
+"""
+ +--- k2mm ---+     +- injector -+     +- k2mm_peer -+
+ |    source_tx| --> |            | --> |sink_rx      |
+ |     sink_rx | <-- |            | <-- |source_tx    |
+ +-------------+     +------------+     +-------------+
+"""
+class _DUT(Module):
+    def __init__(self, dw=128, threshold=0, drop=0):
+        _params = dict(depth=256, window=16, timeout=512, rx_depth=256)
+        self.submodules.k2mm = k2mm = K2MM(dw=dw,
+            with_reliable=True, reliable_params=_params, with_error_injector=True)
+        self.submodules.k2mm_peer = k2mm_peer = K2MM(dw=dw,
+            with_reliable=True, reliable_params=_params, with_error_injector=True)
+        self.comb += [
+            k2mm.source_packet_tx.connect(k2mm_peer.sink_packet_rx),
+            k2mm_peer.source_packet_tx.connect(k2mm.sink_packet_rx),
+        ]
+        for inj in [k2mm.injector, k2mm_peer.injector]:
+            self.comb += [
+                inj.enable.eq(threshold != 0),
+                inj.drop.eq(drop),
+                inj.threshold.eq(threshold),
+            ]
+        self.status = []
+
+    def put_request(self, length):
+        ep = self.k2mm.sink_tester_ctrl
+        yield ep.length.eq(length)
+        yield ep.valid.eq(1)
+        yield
+        while (yield ep.ready) == 0:
+            yield
+        yield ep.valid.eq(0)
+        n = len(self.status)
+        while len(self.status) == n:
+            yield
+
+    def tfg_test(self, frames):
+        for l in frames:
+            yield from self.put_request(l)
+        yield
+        self.stats = {}
+        for k2mm in [self.k2mm, self.k2mm_peer]:
+            for name in ["retransmits", "replayed", "tx_beats"]:
+                self.stats[name] = self.stats.get(name, 0) + (yield getattr(k2mm.reliable.tx, name))
+            self.stats["rx_beats"] = self.stats.get("rx_beats", 0) + (yield k2mm.reliable.rx.rx_beats)
+
+    @passive
+    def status_handler(self):
+        ep = self.k2mm.source_tester_status
+        while True:
+            if (yield ep.valid):
+                self.status.append(((yield ep.length), (yield ep.err), (yield ep.latency)))
+            yield
+
+    def run_sim(self, frames, **args):
+        _generators = {
+            "sys" : [
+                self.tfg_test(frames),
+                self.status_handler(),
+            ],
+        }
+        _clocks = {
+            "sys" : 10,
+        }
+        run_simulation(self, clocks=_clocks, generators=_generators, **args)
+
+if __name__ == "__main__":
+    _frames = [0, 1, 2, 10, 50, 3, 7, 30, 0, 20]
+    for threshold, drop in [(0, 0), (2**30, 0), (2**30, 1)]:
+        dut = _DUT(threshold=threshold, drop=drop)
+        dut.run_sim(_frames)
+        assert len(dut.status) == len(_frames)
+        for (length, err, latency), l in zip(dut.status, _frames):
+            assert err == 0, "corrupted frame delivered"
+            assert length == (l + 1) * 16
+        print("error rate: {:.2f} ({}), latency: max {} cycles, go-back: {}, replayed: {}, goodput: {:.2f}".format(
+            threshold / 2**32, "drop" if drop else "corrupt",
+            max(s[2] for s in dut.status),
+            dut.stats["retransmits"], dut.stats["replayed"],
+            dut.stats["rx_beats"] / dut.stats["tx_beats"]))
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+import random
+
+from migen import *
+
+from cores.tf.framing import K2MMPacketTX, K2MMPacketRX
+from cores.tf.sar import K2MMSegmenter, K2MMReassembler
+
+class _DUT(Module):
+    def __init__(self, dw=128, mtu=4, channels=2):
+        self.submodules.seg = seg = K2MMSegmenter(dw=dw, mtu=mtu, channels=channels)
+        self.submodules.tx  = tx  = K2MMPacketTX(dw=dw)
+        self.submodules.rx  = rx  = K2MMPacketRX(dw=dw)
+        self.submodules.rsm = rsm = K2MMReassembler(dw=dw, channels=channels)
+        self.comb += [
+            seg.source.connect(tx.sink),
+            tx.source.connect(rx.sink),
+            rx.source.connect(rsm.sink),
+        ]
+
+def run(dw=128, mtu=4, messages=[[1, 4, 5, 9, 2, 17], [30, 1, 8, 3]], seed=1):
+    random.seed(seed)
+    dut = _DUT(dw, mtu, len(messages))
+    received = [[] for _ in messages]
+    link = []
+
+    def driver(ch):
+        ep = dut.seg.sinks[ch]
+        n = 0
+        for length in messages[ch]:
+            yield ep.msg_len.eq(length)
+            for i in range(length):
+                yield ep.data.eq((ch << 24) | n)
+                yield ep.last.eq(i == length - 1)
+                yield ep.valid.eq(1)
+                yield
+                while (yield ep.ready) == 0:
+                    yield
+                yield ep.valid.eq(0)
+                n += 1
+                while random.random() < 0.2:
+                    yield
+
+    @passive
+    def receiver(ch):
+        ep = dut.rsm.sources[ch]
+        beats = []
+        while True:
+            ready = random.random() > 0.2
+            yield ep.ready.eq(ready)
+            yield
+            if (yield ep.valid) and ready:
+                assert (yield ep.error) == 0
+                beats.append((yield ep.data))
+                if (yield ep.last):
+                    received[ch].append(beats)
+                    beats = []
+
+    @passive
+    def link_monitor():
+        ep = dut.seg.source
+        while True:
+            if (yield ep.valid) and (yield ep.ready) and (yield ep.last):
+                link.append((yield ep.sch))
+            yield
+
+    def checker():
+        while any(len(r) < len(m) for r, m in zip(received, messages)):
+            yield
+
+    generators = [driver(ch) for ch in range(len(messages))]
+    generators += [receiver(ch) for ch in range(len(messages))]
+    run_simulation(dut, generators + [link_monitor(), checker()])
+
+    for ch, (sent, got) in enumerate(zip(messages, received)):
+        n = 0
+        for length, beats in zip(sent, got):
+            assert beats == [(ch << 24) | (n + i) for i in range(length)], "channel {}".format(ch)
+            n += length
+        print("channel {}: {} messages ok".format(ch, len(got)))
+    switches = sum(a != b for a, b in zip(link, link[1:]))
+    print("{} frames on link, {} channel switches".format(len(link), switches))
+    assert switches > 0
+
+if __name__ == "__main__":
+    run()
+    run(dw=256, mtu=16, messages=[[100, 33, 16], [1, 2, 64], [47]])
+
+    # Frames of mtu beats must fit the 16-bit length field
+    try:
+        K2MMSegmenter(dw=256, mtu=2048)
+    except AssertionError:
+        pass
+    else:
+        raise AssertionError("mtu=2048 accepted at dw=256")
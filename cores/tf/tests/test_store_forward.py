@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+import math
+import random
+
+from migen import *
+from litex.soc.interconnect.stream import EndpointDescription
+
+from cores.tf.buffer import StoreAndForwardBuffer
+from cores.tf.framing import K2MM, K2MMControl, _K2MMPacketParser
+
+def test_buffer(depth=16, nframes=60, seed=1):
+    """ Only complete, error-free frames that fit the buffer come out """
+    random.seed(seed)
+    dut = StoreAndForwardBuffer(EndpointDescription([("data", 32), ("error", 1)]), depth=depth)
+    frames = []
+    for i in range(nframes):
+        n = random.randint(1, depth + 4 if i % 10 == 9 else depth // 2)
+        bad = random.randrange(n) if random.random() < 0.2 else None
+        frames.append(([(i << 8) | k for k in range(n)], bad))
+    expected = [beats for beats, bad in frames if bad is None and len(beats) <= depth]
+    out, done, dropped = [], {}, []
+
+    def writer():
+        for i, (beats, bad) in enumerate(frames):
+            for k, data in enumerate(beats):
+                yield dut.sink.data.eq(data)
+                yield dut.sink.error.eq(k == bad)
+                yield dut.sink.last.eq(k == len(beats) - 1)
+                yield dut.sink.valid.eq(1)
+                yield
+                while not (yield dut.sink.ready):
+                    yield
+            done[i] = len(out)
+            yield dut.sink.valid.eq(0)
+        # Drained, and the last frame's drop counted
+        while len(out) < len(expected):
+            yield
+        yield
+        dropped.append((yield dut.dropped))
+
+    @passive
+    def reader():
+        beats, started = [], {}
+        while True:
+            ready = random.random() > 0.3
+            yield dut.source.ready.eq(ready)
+            yield
+            if ready and (yield dut.source.valid):
+                data = (yield dut.source.data)
+                # Nothing of a frame is released before its last beat is in
+                assert data >> 8 in done, hex(data)
+                beats.append(data)
+                if (yield dut.source.last):
+                    out.append(beats)
+                    beats = []
+
+    run_simulation(dut, [writer(), reader()])
+    assert out == expected
+    assert dropped[0] == nframes - len(expected)
+    print("store-and-forward: {} frames in, {} out, {} dropped".format(nframes, len(out), dropped[0]))
+
+class _Loop(Module):
+    def __init__(self, dw, **kwargs):
+        self.submodules.parser = parser = _K2MMPacketParser(dw=dw, **kwargs)
+        self.comb += parser.source_packet_tx.connect(parser.sink_packet_rx)
+
+def latency(dw=256, beats=8, **kwargs):
+    """ Cycles from the first payload beat in to the first beat out """
+    dut = _Loop(dw, **kwargs)
+    p = dut.parser
+    result = {}
+
+    def gen():
+        yield p.source.ready.eq(1)
+        for k in range(beats):
+            yield p.sink.data.eq(k)
+            yield p.sink.length.eq(beats * dw // 8)
+            yield p.sink.last.eq(k == beats - 1)
+            yield p.sink.valid.eq(1)
+            yield
+            while not (yield p.sink.ready):
+                yield
+        yield p.sink.valid.eq(0)
+        while "first" not in result:
+            yield
+
+    @passive
+    def monitor():
+        cycle = None
+        while True:
+            if cycle is None and (yield p.sink.valid):
+                cycle = 0
+            if cycle is not None:
+                if (yield p.source.valid) and "first" not in result:
+                    result["first"] = cycle
+                cycle += 1
+            yield
+
+    run_simulation(dut, [gen(), monitor()])
+    return result["first"]
+
+def tx_drop(dw=64, fifo_depth=16):
+    """ A frame to send longer than the buffer is counted, not sent """
+    p = _K2MMPacketParser(dw=dw, fifo_depth=fifo_depth, buffer_mode="store-and-forward")
+    sent = []
+
+    def gen():
+        yield p.source_packet_tx.ready.eq(1)
+        for beats in [2 * fifo_depth, 4]:
+            for k in range(beats):
+                yield p.sink.data.eq(k)
+                yield p.sink.length.eq(beats * dw // 8)
+                yield p.sink.last.eq(k == beats - 1)
+                yield p.sink.valid.eq(1)
+                yield
+                while not (yield p.sink.ready):
+                    yield
+        yield p.sink.valid.eq(0)
+        for _ in range(50):
+            if (yield p.source_packet_tx.valid) and (yield p.source_packet_tx.last):
+                sent.append(1)
+            yield
+        sent.append((yield p.tx_dropped))
+
+    run_simulation(p, gen())
+    return sent
+
+def bram36(width, depth):
+    """ RAMB36 count, 512x72 aspect ratio """
+    return math.ceil(width / 72) * math.ceil(depth / 512)
+
+def buffer_cost(dw=256, fifo_depth=256, **kwargs):
+    p = _K2MMPacketParser(dw=dw, fifo_depth=fifo_depth, **kwargs)
+    if not hasattr(p, "tx_buffer"):
+        return 0
+    total = 0
+    for buf in [p.tx_buffer, p.rx_buffer]:
+        width = buf.mem.width if hasattr(buf, "mem") else len(buf.fifo.din)
+        total += bram36(width, fifo_depth)
+    return total
+
+if __name__ == "__main__":
+    for seed in range(8):
+        test_buffer(seed=seed)
+    # Long frames to send: one dropped and counted, the short one sent
+    assert tx_drop() == [1, 1]
+    ctrl = K2MMControl(K2MM(dw=64, buffer_mode="store-and-forward"), dw=64)
+    assert hasattr(ctrl, "_tx_dropped") and hasattr(ctrl, "_rx_dropped")
+    # Buffer settings reach the parser through K2MM
+    assert not hasattr(K2MM(dw=64, bufferrized=False).packet, "tx_buffer")
+    assert K2MM(dw=64, fifo_depth=16).packet.tx_buffer.depth == 16
+    random.seed(1)
+    modes = [
+        ("cut-through, no FIFO",     dict(buffer_mode="cut-through", bufferrized=False)),
+        ("cut-through, 256 FIFO",    dict(buffer_mode="cut-through")),
+        ("store-and-forward, 256",   dict(buffer_mode="store-and-forward")),
+    ]
+    print("{:24s} | latency 1 / 8 / 32 beats | RAMB36 (est.)".format("mode"))
+    results = {}
+    for name, kwargs in modes:
+        l = [latency(beats=n, **kwargs) for n in [1, 8, 32]]
+        results[name] = l
+        print("{:24s} | {:6d} {:6d} {:6d}       | {}".format(name, *l, buffer_cost(**kwargs)))
+    # Cut-through latency does not depend on the frame size, store-and-forward does
+    ct, sf = results["cut-through, no FIFO"], results["store-and-forward, 256"]
+    assert ct[0] == ct[2]
+    assert sf[2] - sf[0] >= 31
+    assert ct[0] <= results["cut-through, 256 FIFO"][0]
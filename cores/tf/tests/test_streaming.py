@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+from migen import *
+from cores.tf.framing import K2MM
+from cores.tf.streaming import K2MMStreamRX, K2MMStreamTX
+
+"""
+ +--- k2mm ---+   (no tlast)   +- k2mm_peer -+
+ |    source_tx| ------------> |sink_rx      |
+ |     sink_rx | <------------ |source_tx    |
+ +-------------+               +-------------+
+"""
+class _DUT(Module):
+    def __init__(self, dw=256, with_crc=False):
+        self.submodules.k2mm = k2mm = K2MM(dw=dw, link_mode="streaming", with_crc=with_crc)
+        self.submodules.k2mm_peer = k2mm_peer = K2MM(dw=dw, link_mode="streaming", with_crc=with_crc)
+        # Aurora streaming mode: only data and valid cross the link
+        self.comb += [
+            k2mm.source_packet_tx.connect(k2mm_peer.sink_packet_rx, keep={"valid", "ready", "data"}),
+            k2mm_peer.source_packet_tx.connect(k2mm.sink_packet_rx, keep={"valid", "ready", "data"}),
+        ]
+        self.status = []
+        self.link_beats = 0
+
+    def put_request(self, length):
+        ep = self.k2mm.sink_tester_ctrl
+        yield ep.length.eq(length)
+        yield ep.valid.eq(1)
+        yield
+        while (yield ep.ready) == 0:
+            yield
+        yield ep.valid.eq(0)
+        n = len(self.status)
+        while len(self.status) == n:
+            yield
+
+    @passive
+    def status_handler(self):
+        ep = self.k2mm.source_tester_status
+        while True:
+            if (yield ep.valid):
+                self.status.append(((yield ep.length), (yield ep.err)))
+            yield
+
+    @passive
+    def link_monitor(self):
+        ep = self.k2mm.source_packet_tx
+        while True:
+            if (yield ep.valid) and (yield ep.ready):
+                self.link_beats += 1
+            yield
+
+    def run_sim(self, frames, **args):
+        def _test():
+            for l in frames:
+                yield from self.put_request(l)
+            if hasattr(self.k2mm.packet.prx, "crc_errors"):
+                self.crc_errors = []
+                for k in [self.k2mm, self.k2mm_peer]:
+                    self.crc_errors.append((yield k.packet.prx.crc_errors))
+        run_simulation(self, [_test(), self.status_handler(), self.link_monitor()], **args)
+
+class _ResyncDUT(Module):
+    def __init__(self, dw=256):
+        self.submodules.tx = tx = K2MMStreamTX(dw=dw)
+        self.submodules.rx = rx = K2MMStreamRX(dw=dw)
+
+def test_resync(dw=256):
+    """ Garbage beats and a wrong `length` must not break the framing """
+    dut = _ResyncDUT(dw)
+    frames = [(3, 3), (1, 1), (4, 2), (2, 5), (2, 2)] # (nbeats from length, beats sent)
+    out = []
+
+    def driver():
+        for i in range(4):
+            yield
+        yield dut.tx.source.ready.eq(1)
+        ep = dut.tx.sink
+        for nbeats, sent in frames:
+            for i in range(sent):
+                yield ep.length.eq(nbeats * dw // 8)
+                yield ep.data.eq(i + 1)
+                yield ep.last.eq(i == sent - 1)
+                yield ep.valid.eq(1)
+                yield
+                while (yield ep.ready) == 0:
+                    yield
+            yield ep.valid.eq(0)
+        for i in range(8):
+            yield
+
+    @passive
+    def link():
+        # Garbage on the link before the first header
+        for i in range(3):
+            yield dut.rx.sink.data.eq(0x1234 + i)
+            yield dut.rx.sink.valid.eq(1)
+            yield
+        # TX -> RX without `last`
+        while True:
+            for name in ["valid", "data"]:
+                yield getattr(dut.rx.sink, name).eq((yield getattr(dut.tx.source, name)))
+            yield
+
+    @passive
+    def receiver():
+        beats = 0
+        yield dut.rx.source.ready.eq(1)
+        while True:
+            yield
+            if (yield dut.rx.source.valid):
+                beats += 1
+                if (yield dut.rx.source.last):
+                    out.append(beats)
+                    beats = 0
+
+    def stats():
+        yield from driver()
+        stats.result = ((yield dut.tx.length_errors), (yield dut.rx.resyncs))
+
+    run_simulation(dut, [stats(), link(), receiver()])
+    assert out == [n for n, _ in frames], out
+    assert stats.result == (2, 3)
+    print("resync: frames {}, length errors {}, dropped beats {}".format(out, *stats.result))
+
+if __name__ == "__main__":
+    _frames = [0, 1, 2, 10, 3, 7, 30, 0, 20]
+    dut = _DUT()
+    dut.run_sim(_frames)
+    assert len(dut.status) == len(_frames)
+    for (length, err), l in zip(dut.status, _frames):
+        assert err == 0
+        assert length == (l + 1) * 32
+    # No link beats besides header and payload
+    assert dut.link_beats == sum(l + 2 for l in _frames)
+    test_resync()
+
+    # The stamped nbeats must not break the CRC at either end
+    dut = _DUT(with_crc=True)
+    dut.run_sim(_frames)
+    assert [err for length, err in dut.status] == [0] * len(_frames)
+    assert dut.crc_errors == [0, 0], dut.crc_errors
+
+    # Link efficiency for small frames (lanes = 4, 64-bit blocks per beat).
+    # Framing mode costs at least one extra control block per frame for the
+    # separator (SEP/SEP7), streaming mode none.
+    lanes = 4
+    print("payload beats | streaming | framing")
+    for payload in [1, 2, 4, 8, 16]:
+        beats = payload + 1 # K2MM header
+        streaming = payload / beats
+        framing = payload / (beats + 1 / lanes)
+        print("{:13d} | {:9.3f} | {:7.3f}".format(payload, streaming, framing))
@@ -1,29 +1,82 @@
 from migen import *
 from litex.soc.interconnect import stream
+from litex.soc.interconnect.packet import PacketFIFO
 
 class XPMStreamFIFO(Module):
+    """ Stream FIFO on `xpm_fifo_axis` (or LiteX FIFOs with `xpm=False`)
+
+    `packet`: only release complete frames (PACKET_FIFO).
+    `prog_full`/`prog_empty`: thresholds in words for the `prog_full` and
+    `prog_empty` outputs (write and read side respectively).
+    `with_counts`: expose `wr_data_count`/`rd_data_count`.
+    `xpm_fifo_axis` is first-word-fall-through; `buffered` adds an output
+    register stage for timing, leave it off for the lowest latency.
+    `memory_type`: FIFO_MEMORY_TYPE, "ultra" puts deep FIFOs in UltraRAM
+    (4K x 72 per block) instead of BRAM. Ignored with `xpm=False`.
+    `cd`: clock domain of a `sync_fifo` (async FIFOs use "write"/"read").
+    """
     def __init__(self, layout, 
         depth=16,
         sync_fifo = True,
         sync_stages=2,
         buffered=False,
         xpm=True,
-        reset="sink"):
+        reset="sink",
+        packet=False,
+        prog_full=None,
+        prog_empty=None,
+        with_counts=False,
+        memory_type="auto",
+        cd="sys"):
         cd_sink="write"
         cd_source="read"
         self.sink = stream.Endpoint(layout)
         self.source = stream.Endpoint(layout)
+
+        count_width = log2_int(depth) + 1
+        self.prog_full     = Signal()
+        self.prog_empty    = Signal()
+        self.wr_data_count = Signal(count_width)
+        self.rd_data_count = Signal(count_width)
+
         if xpm == False:
             if sync_fifo is True:
-                fifo = stream.AsyncFIFO(layout, depth=depth, buffered=buffered)
+                if packet:
+                    fifo = PacketFIFO(layout, depth, buffered=buffered)
+                    level = fifo.payload_fifo.level
+                else:
+                    fifo = stream.SyncFIFO(layout, depth, buffered=buffered)
+                    level = fifo.level
+                self.comb += [
+                    self.wr_data_count.eq(level),
+                    self.rd_data_count.eq(level),
+                    self.prog_full.eq(level >= (prog_full or depth)),
+                    self.prog_empty.eq(level <= (prog_empty or 0)),
+                ]
             else:
-                fifo = stream.SyncFIFO(layout, depth, buffered=buffered)
+                if packet or prog_full or prog_empty or with_counts:
+                    raise NotImplementedError("Packet mode, thresholds and counts need xpm=True for async FIFOs")
+                fifo = stream.AsyncFIFO(layout, depth=depth, buffered=buffered)
             self.submodules.fifo = fifo
             self.comb += [
                 self.sink.connect(fifo.sink),
                 fifo.source.connect(self.source)
             ]
         else:
+            if memory_type not in ["auto", "block", "distributed", "ultra"]:
+                raise ValueError("Unknown FIFO memory type: {}".format(memory_type))
+            for name, thresh in [("prog_full", prog_full), ("prog_empty", prog_empty)]:
+                if thresh is not None and not 3 <= thresh <= depth - 3:
+                    raise ValueError("{} threshold {} out of range for depth {}".format(name, thresh, depth))
+            # Advanced features: prog_full, wr_data_count, prog_empty, rd_data_count
+            adv_features = 0x1000
+            if prog_full is not None:
+                adv_features |= 1 << 1
+            if prog_empty is not None:
+                adv_features |= 1 << 9
+            if with_counts:
+                adv_features |= (1 << 2) | (1 << 10)
+
             desc = self.sink.description
             data_layout = [
                 ("payload", desc.payload_layout),
@@ -33,13 +86,25 @@ class XPMStreamFIFO(Module):
             self._fifo_in  = fifo_in  = Record(data_layout)
             self._fifo_out = fifo_out = Record(data_layout)
 
+            if buffered:
+                self.submodules.buffer = buffer = ClockDomainsRenamer(cd if sync_fifo else cd_source)(
+                    stream.Buffer(layout))
+                self.comb += buffer.source.connect(self.source)
+                fifo_source = buffer.sink
+            else:
+                fifo_source = self.source
+
             self.comb += [
                 fifo_in.payload.eq(self.sink.payload),
                 fifo_in.param.eq(self.sink.param),
 
-                self.source.payload.eq(fifo_out.payload),
-                self.source.param.eq(fifo_out.param),
+                fifo_source.payload.eq(fifo_out.payload),
+                fifo_source.param.eq(fifo_out.param),
             ]
+            if sync_fifo:
+                cd_reset = cd
+            else:
+                cd_reset = cd_sink if reset == "sink" else cd_source
             _tdata_len = ((len(fifo_in.raw_bits()) + 7) // 8) * 8
             _padding_len = _tdata_len - len(fifo_in.raw_bits())
 
@@ -49,14 +114,18 @@ class XPMStreamFIFO(Module):
                 p_CLOCKING_MODE       = "common_clock" if sync_fifo else "independent_clock",
                 p_ECC_MODE            = "no_ecc",
                 p_FIFO_DEPTH          = depth,
-                p_FIFO_MEMORY_TYPE    = "auto",
-                p_PROG_EMPTY_THRESH   = 10,
+                p_FIFO_MEMORY_TYPE    = memory_type,
+                p_PACKET_FIFO         = "true" if packet else "false",
+                p_PROG_EMPTY_THRESH   = prog_empty if prog_empty is not None else 10,
+                p_PROG_FULL_THRESH    = prog_full if prog_full is not None else 10,
+                p_RD_DATA_COUNT_WIDTH = count_width,
+                p_WR_DATA_COUNT_WIDTH = count_width,
                 p_SIM_ASSERT_CHK      = 1,
                 p_TDATA_WIDTH         = _tdata_len,
                 p_TDEST_WIDTH         = 1,
                 p_TID_WIDTH           = 1,
                 p_TUSER_WIDTH         = 1,
-                p_USE_ADV_FEATURES    = "1000",
+                p_USE_ADV_FEATURES    = "{:04X}".format(adv_features),
                 o_almost_empty_axis   = Signal(),
                 o_almost_full_axis    = Signal(),
                 o_dbiterr_axis        = Signal(),
@@ -65,20 +134,20 @@ class XPMStreamFIFO(Module):
                 o_m_axis_tdest        = Signal(),
                 o_m_axis_tid          = Signal(),
                 o_m_axis_tkeep        = Signal(_tdata_len // 8),
-                o_m_axis_tlast        = self.source.last,
+                o_m_axis_tlast        = fifo_source.last,
                 o_m_axis_tstrb        = Signal(_tdata_len // 8),
-                o_m_axis_tuser        = self.source.first,
-                o_m_axis_tvalid       = self.source.valid,
-                i_m_axis_tready       = self.source.ready,
-                o_prog_empty_axis     = Signal(),
-                o_prog_full_axis      = Signal(),
-                o_rd_data_count_axis  = Signal(),
+                o_m_axis_tuser        = fifo_source.first,
+                o_m_axis_tvalid       = fifo_source.valid,
+                i_m_axis_tready       = fifo_source.ready,
+                o_prog_empty_axis     = self.prog_empty,
+                o_prog_full_axis      = self.prog_full,
+                o_rd_data_count_axis  = self.rd_data_count,
                 o_sbiterr_axis        = Signal(),
-                o_wr_data_count_axis  = Signal(),
+                o_wr_data_count_axis  = self.wr_data_count,
                 i_injectdbiterr_axis  = 0b0,
                 i_injectsbiterr_axis  = 0b0,
-                i_s_aclk              = ClockSignal() if sync_fifo else ClockSignal(cd_sink),
-                i_s_aresetn           = (~ResetSignal(cd_sink)) if reset == "sink" else (~ResetSignal(cd_source)),
+                i_s_aclk              = ClockSignal(cd) if sync_fifo else ClockSignal(cd_sink),
+                i_s_aresetn           = ~ResetSignal(cd_reset),
                 i_s_axis_tdata        = Cat(fifo_in.raw_bits(), Replicate(C(0b0), _padding_len)),
                 i_s_axis_tdest        = 0b0,
                 i_s_axis_tid          = 0b0,
@@ -102,26 +171,30 @@ class XPMAsyncStreamFIFO(XPMStreamFIFO):
         sync_stages=2, 
         buffered=False,
         xpm=True,
-        reset="sink"):
+        reset="sink",
+        **kwargs):
         XPMStreamFIFO.__init__(self, layout, 
             depth=depth, 
             sync_fifo=False, 
             sync_stages=sync_stages, 
             buffered=buffered, 
             xpm=xpm,
-            reset=reset)
+            reset=reset,
+            **kwargs)
 
 class XPMSyncStreamFIFO(XPMStreamFIFO):
     def __init__(self, layout, 
         depth=16,
         buffered=False,
-        xpm=True):
+        xpm=True,
+        **kwargs):
         XPMStreamFIFO.__init__(self, layout, 
             depth=depth, 
             sync_fifo=True, 
             sync_stages=0, 
             buffered=buffered, 
-            xpm=xpm)
+            xpm=xpm,
+            **kwargs)
 
 class _XPMMultiRegImpl(Module):
     def __init__(self, i, o, odomain, n, reset=0):
@@ -45,6 +45,7 @@ from litescope import LiteScopeAnalyzer
 
 from bench.platform import Platform
 from cores.tf.framing import K2MMControl, K2MM
+from cores.kyokko.adapter import k2mm_to_link, link_to_k2mm
 
 class _CRG(Module):
     def __init__(self, clk, clk_gt, rst=0):
@@ -267,8 +268,8 @@ class SimSoC(SoCCore):
         )
         self.submodules.k2mm_qsfp0 = k2mm_qsfp0 = K2MM(dw=256)
         self.comb += [
-            kyokko.source_user_rx.connect(k2mm_qsfp0.sink_packet_rx, omit={"last_be", "error", "src_port", "dst_port", "ip_address", "length"}),
-            k2mm_qsfp0.source_packet_tx.connect(kyokko.sink_user_tx, omit={"last_be", "error", "src_port", "dst_port", "ip_address", "length"}),
+            link_to_k2mm(kyokko.source_user_rx, k2mm_qsfp0.sink_packet_rx),
+            k2mm_to_link(k2mm_qsfp0.source_packet_tx, kyokko.sink_user_tx),
         ]
         self.submodules.k2mmctrl_0 = k2mmctrl_0 = K2MMControl(k2mm_qsfp0, dw=256)
         self.comb += k2mmctrl_0.source_ctrl.connect(k2mm_qsfp0.sink_tester_ctrl)
@@ -284,8 +285,8 @@ class SimSoC(SoCCore):
         )
         self.submodules.k2mm_qsfp1 = k2mm_qsfp1 = K2MM(dw=256)
         self.comb += [
-            ky1.source_user_rx.connect(k2mm_qsfp1.sink_packet_rx, omit={"last_be", "error", "src_port", "dst_port", "ip_address", "length"}),
-            k2mm_qsfp1.source_packet_tx.connect(ky1.sink_user_tx, omit={"last_be", "error", "src_port", "dst_port", "ip_address", "length"}),
+            link_to_k2mm(ky1.source_user_rx, k2mm_qsfp1.sink_packet_rx),
+            k2mm_to_link(k2mm_qsfp1.source_packet_tx, ky1.sink_user_tx),
         ]
         self.submodules.k2mmctrl_1 = k2mmctrl_1 = K2MMControl(k2mm_qsfp1, dw=256)
         self.comb += k2mmctrl_1.source_ctrl.connect(k2mm_qsfp1.sink_tester_ctrl)
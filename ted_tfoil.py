@@ -27,9 +27,10 @@ from migen.genlib.resetsync import AsyncResetSynchronizer
 from litex_boards.platforms import ted_tfoil
 from localbuilder import LocalBuilder
 from cores.i2c_multiport import I2CMasterMP
+from cores.kyokko.ports import add_link_ports, tfoil_ports
 
 class _CRG(Module):
-    def __init__(self, platform, sys_clk_freq):
+    def __init__(self, platform, sys_clk_freq, dp_clk_freq=None):
         self.rst = Signal(reset_less=True)
         self.locked = Signal(reset_less=True)
         
@@ -43,6 +44,12 @@ class _CRG(Module):
         pll.register_clkin(platform.request(*platform.default_clk_name), platform.default_clk_freq)
         pll.create_clkout(self.cd_pll4x, sys_clk_freq*4, buf=None, with_reset=False)
         pll.create_clkout(self.cd_idelay, 400e6)
+        if dp_clk_freq is not None:
+            # Datapath (K2MM) clock, independent of the CPU
+            self.clock_domains.cd_dp = ClockDomain()
+            # No clock-group false path: the sys/dp synchronizers carry their own
+            # constraints (XPM CDC, mr_ff on MultiReg), any other crossing must fail timing
+            pll.create_clkout(self.cd_dp, dp_clk_freq)
         self.comb += [
             self.locked.eq(pll.locked),
             pll.reset.eq((~platform.request("cpu_resetn")) | self.rst),    
@@ -64,7 +71,7 @@ class _CRG(Module):
         self.submodules.idelayctrl = USIDELAYCTRL(cd_ref=self.cd_idelay, cd_sys=self.cd_sys)
 
 class BaseSoC(SoCCore):
-    def __init__(self, sys_clk_freq=int(200e6), disable_sdram=False, **kwargs):
+    def __init__(self, sys_clk_freq=int(200e6), disable_sdram=False, quads=(121,), dp_clk_freq=None, **kwargs):
         platform = ted_tfoil.Platform()
 
         SoCCore.__init__(self, platform, sys_clk_freq,
@@ -72,7 +79,7 @@ class BaseSoC(SoCCore):
             ident_version  = True,
             **kwargs)
 
-        self.submodules.crg = _CRG(platform, sys_clk_freq)
+        self.submodules.crg = _CRG(platform, sys_clk_freq, dp_clk_freq)
 
         if not disable_sdram:
             if not self.integrated_main_ram_size:
@@ -126,27 +133,14 @@ class BaseSoC(SoCCore):
         self.submodules.sb_si5341_o = GPIOOut(pads = sb_si5341_o_pads)
         self.submodules.sb_si5341_i = GPIOIn(pads = sb_si5341_i_pads)
 
-        self._add_aurora(platform)
-
-    def _add_aurora(self, platform):
-        from cores.tf.framing import K2MMControl, K2MM
-        from cores.kyokko.aurora import Aurora64b66b
-        # Port #1
-        self.submodules.ky_0 = kyokko = Aurora64b66b(
-            platform,
-            platform.request("GTY121", 0),
-            platform.request("MGTREFCLK_121_", 0),
-            cd_freerun="clk125",
-            freerun_clk_freq=int(125e6)
-        )
-        self.submodules.k2mm_0 = k2mm = K2MM(dw=256)
-        self.comb += [
-            kyokko.init_clk_locked.eq(self.crg.locked),
-            kyokko.source_user_rx.connect(k2mm.sink_packet_rx, omit={"last_be", "error", "src_port", "dst_port", "ip_address", "length"}),
-            k2mm.source_packet_tx.connect(kyokko.sink_user_tx, omit={"last_be", "error", "src_port", "dst_port", "ip_address", "length"}),
-        ]
-        self.submodules.k2mmctrl_0 = k2mmctrl_0 = K2MMControl(k2mm, dw=256)
-        self.comb += k2mmctrl_0.source_ctrl.connect(k2mm.sink_tester_ctrl)
+        self._add_aurora(platform, quads, cd="sys" if dp_clk_freq is None else "dp")
+
+    def _add_aurora(self, platform, quads, cd="sys"):
+        ports = add_link_ports(self, platform, tfoil_ports(quads), cd=cd,
+            locked=self.crg.locked, cd_freerun="clk125", freerun_clk_freq=int(125e6))
+
+        from cores.kyokko.drp import DRPControl
+        self.submodules.gt_drp = DRPControl(sum([p.link.drp for p in ports], []), cd="clk125")
     
     def do_finalize(self):
         self.platform.finalize_tcl_ip()
@@ -158,6 +152,8 @@ def main():
     parser.add_argument("--load",         action="store_true", help="Load bitstream")
     parser.add_argument("--sys-clk-freq", default=200e6,       help="System clock frequency (default: 200MHz)")
     parser.add_argument("--disable-sdram", action="store_true", help="Build without onboard memory controller (default: false)")
+    parser.add_argument("--dp-clk-freq",  default=None,        help="K2MM datapath clock frequency, e.g. 400e6 (default: sys clock)")
+    parser.add_argument("--quads",        default="121",       help="Comma separated GTY quads, one link port each (default: 121)")
     builder_args(parser)
     soc_core_args(parser)
     args = parser.parse_args()
@@ -165,6 +161,8 @@ def main():
     soc = BaseSoC(
         disable_sdram = True if args.disable_sdram else False,
         sys_clk_freq = int(float(args.sys_clk_freq)),
+        quads = [int(q) for q in args.quads.split(",")],
+        dp_clk_freq = None if args.dp_clk_freq is None else int(float(args.dp_clk_freq)),
         **soc_core_argdict(args)
     )
     builder = LocalBuilder(soc, **builder_argdict(args))
@@ -1,18 +1,40 @@
-from migen import Module, ModuleTransformer
-from  litex.soc.interconnect.stream import DIR_SOURCE, DIR_SINK, Endpoint, PipeReady, PipeValid
+import math
+import re
+from fnmatch import fnmatchcase
+
+from migen import Module, ModuleTransformer, Cat, If
+from migen.fhdl.visit import NodeTransformer
+from migen.genlib.fsm import FSM, NextValue
+from  litex.soc.interconnect.stream import DIR_SOURCE, DIR_SINK, Endpoint
 
 class _SkidBuffer(Module):
+    """ Single-stage skid buffer: valid/data and ready are both registered,
+    one cycle of latency and no bubbles """
     def __init__(self, layout):
         self.sink = sink = Endpoint(layout)
         self.source = source = Endpoint(layout)
 
-        self.submodules.pv = pv = PipeValid(layout)
-        self.comb += self.sink.connect(pv.sink)
+        # # #
+
+        skid = Endpoint(layout)
+        def data(ep):
+            return Cat(ep.first, ep.last, ep.payload.raw_bits(), ep.param.raw_bits())
 
-        self.submodules.pr = pr = PipeReady(layout)
-        self.comb += [
-            pv.source.connect(pr.sink),
-            pr.source.connect(self.source)
+        # The skid register catches the beat accepted while the output stalls
+        self.comb += sink.ready.eq(~skid.valid)
+        self.sync += [
+            If(~source.valid | source.ready,
+                If(skid.valid,
+                    data(source).eq(data(skid)),
+                    skid.valid.eq(0)
+                ).Else(
+                    data(source).eq(data(sink))
+                ),
+                source.valid.eq(skid.valid | sink.valid)
+            ).Elif(sink.valid & sink.ready,
+                data(skid).eq(data(sink)),
+                skid.valid.eq(1)
+            )
         ]
 
 # Add buffers on Endpoints (can be used to improve timings)
@@ -37,3 +59,118 @@ class SkidBufferInsert(ModuleTransformer):
                 setattr(submodule, name, buf.source)
             else:
                 raise ValueError
+
+class _SignalReplacer(NodeTransformer):
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def visit_Signal(self, node):
+        return self.mapping.get(id(node), node)
+
+    def visit_unknown(self, node):
+        if isinstance(node, NextValue):
+            return NextValue(self.visit(node.target), self.visit(node.value))
+        return node
+
+def _walk(module, path=""):
+    yield path, module
+    for name, submodule in module._submodules:
+        subpath = path if name is None else (path + "." + name if path else name)
+        yield from _walk(submodule, subpath)
+
+# Insert pipeline stages on endpoints anywhere in a module tree
+class PipelineInsert(ModuleTransformer):
+    """ Insert pipeline stages on the endpoints of a whole module tree (e.g. a SoC)
+
+    `budget` maps endpoint paths (submodule names and endpoint attribute
+    joined by ".", shell-style wildcards allowed, e.g. "k2mm_*.packet.ptx.sink")
+    to a number of stages, or to (stages, direction) for endpoints whose name
+    does not start with "sink"/"source". `stage` is the buffer class
+    (`_SkidBuffer`, or LiteX `PipeValid`). Connections that are already made are
+    rerouted through the stages, so it can be applied to a finished SoC before
+    it is built. Endpoint signals used in Instances of other modules are not
+    rerouted.
+    """
+    def __init__(self, budget, stage=_SkidBuffer):
+        self.budget = budget
+        self.stage = stage
+        self.inserted = {}
+
+    def _lookup(self, path):
+        for pattern, value in self.budget.items():
+            if fnmatchcase(path, pattern):
+                stages, direction = value if isinstance(value, tuple) else (value, None)
+                if direction is None:
+                    name = path.rsplit(".", 1)[-1]
+                    direction = DIR_SINK if name.startswith("sink") else DIR_SOURCE if name.startswith("source") else None
+                if direction is None:
+                    raise ValueError("Direction of {} unknown".format(path))
+                return stages, direction
+        return 0, None
+
+    def transform_instance(self, top):
+        done = set()
+        for path, module in list(_walk(top)):
+            for name, endpoint in list(vars(module).items()):
+                if not isinstance(endpoint, Endpoint) or id(endpoint) in done:
+                    continue
+                full_name = path + "." + name if path else name
+                stages, direction = self._lookup(full_name)
+                if stages == 0:
+                    continue
+                done.add(id(endpoint))
+                self._insert(top, module, name, endpoint, stages, direction)
+                self.inserted[full_name] = stages
+
+    def _insert(self, top, owner, name, endpoint, stages, direction):
+        bufs = [self.stage(endpoint.description) for _ in range(stages)]
+        outer = bufs[0].sink if direction == DIR_SINK else bufs[-1].source
+
+        # Reroute everything outside of `owner` to the outer end of the chain
+        mapping = {id(a): b for a, b in zip(endpoint.flatten(), outer.flatten())}
+        replacer = _SignalReplacer(mapping)
+        inside = set(id(m) for _, m in _walk(owner))
+        for _, module in _walk(top):
+            if id(module) in inside:
+                continue
+            f = module._fragment
+            f.comb = replacer.visit(f.comb)
+            f.sync = {cd: replacer.visit(stmts) for cd, stmts in f.sync.items()}
+            if isinstance(module, FSM):
+                module.actions = {state: replacer.visit(stmts) for state, stmts in module.actions.items()}
+
+        owner.submodules += bufs
+        for a, b in zip(bufs, bufs[1:]):
+            owner.comb += a.source.connect(b.sink)
+        if direction == DIR_SINK:
+            owner.comb += bufs[-1].source.connect(endpoint)
+        else:
+            owner.comb += endpoint.connect(bufs[0].sink)
+        setattr(owner, name, outer)
+
+def frequency_budget(patterns, clk_freq, stage_freq=250e6):
+    """ One stage on each of `patterns` per `stage_freq` of `clk_freq` above the
+    first (`stage_freq`: what such a path closes at without extra stages) """
+    stages = max(0, math.ceil(clk_freq / stage_freq) - 1)
+    return {pattern: stages for pattern in patterns}
+
+def timing_report_budget(report, patterns, budget=None):
+    """ Add one stage to each pattern of `budget` that shows up in a failing
+    path of a Vivado `report_timing` text report
+
+    Patterns are compared with the Source/Destination cells, with "." mapped
+    to "_" as in the generated Verilog names.
+    """
+    budget = dict(budget or {})
+    hits = set()
+    for path in report.split("Slack")[1:]:
+        if not path.lstrip(" :(").startswith("VIOLATED"):
+            continue
+        cells = re.findall(r"^\s*(?:Source|Destination):\s+(\S+)", path, re.MULTILINE)
+        for pattern in patterns:
+            flat = pattern.replace(".", "_")
+            if any(fnmatchcase(cell, "*" + flat + "*") for cell in cells):
+                hits.add(pattern)
+    for pattern in hits:
+        budget[pattern] = budget.get(pattern, 0) + 1
+    return budget
@@ -0,0 +1,54 @@
+import re
+
+from migen import *
+from migen.fhdl.tools import list_targets
+
+# Clock region columns, rows
+_CLOCK_REGIONS = {
+    "xcvu9p":  (6, 15),
+    "xcvu13p": (8, 16),
+}
+
+def quad_clock_regions(part, quads, width=2):
+    """ Clock regions next to GTY `quads` (names from platform_info), as
+    (x0, y0, x1, y1): `width` columns from the GTY side, rows of the quads """
+    for prefix, (cols, rows) in _CLOCK_REGIONS.items():
+        if part.startswith(prefix):
+            break
+    else:
+        raise ValueError("Clock regions of {} unknown".format(part))
+    xy = [re.match(r"Quad_X(\d+)Y(\d+)$", q).groups() for q in quads]
+    if len(set(x for x, y in xy)) != 1:
+        raise ValueError("Quads must be in one GTY column")
+    ys = [int(y) for x, y in xy]
+    # Same left/right rule as C_UCOLUMN_USED
+    x0, x1 = (0, width - 1) if xy[0][0] == "0" else (cols - width, cols - 1)
+    return x0, min(ys), x1, max(ys)
+
+class PblockTagger(ModuleTransformer):
+    """ Tag the registers and instances of a module (and its submodules)
+    with PBLOCK=`name`, for `add_cells_to_pblock` """
+    def __init__(self, name):
+        self.name = name
+
+    def transform_fragment(self, i, f):
+        for targets in f.sync.values():
+            for sig in list_targets(targets):
+                sig.attr.add(("PBLOCK", self.name))
+        for special in f.specials:
+            if isinstance(special, Instance):
+                special.attr.add(("PBLOCK", self.name))
+
+def add_port_pblock(platform, name, modules, pads, width=2):
+    """ Constrain `modules` (Aurora, K2MM... of one port) to the clock
+    regions next to the GTY quad(s) `pads` """
+    quads = [p.platform_info['quad'] for p in (pads if isinstance(pads, (list, tuple)) else [pads])]
+    x0, y0, x1, y1 = quad_clock_regions(platform.device, quads, width)
+    for module in modules:
+        PblockTagger(name)(module)
+    platform.add_platform_command(f"create_pblock {name}")
+    platform.add_platform_command(
+        f"resize_pblock [get_pblocks {name}] -add CLOCKREGION_X{x0}Y{y0}:CLOCKREGION_X{x1}Y{y1}")
+    platform.add_platform_command(
+        f"add_cells_to_pblock [get_pblocks {name}] "
+        "[get_cells -quiet -hier -filter {{" f"PBLOCK == {name}" "}}]")
@@ -0,0 +1,107 @@
+import re
+from math import ceil
+
+from migen import *
+from litex.soc.interconnect.stream import Endpoint, SyncFIFO
+
+from util.epbuf import PipelineInsert
+
+# SLRs, clock region rows per SLR (GTY quads are one clock region high)
+_SLR_LAYOUT = {
+    "xcvu9p":  (3, 5),
+    "xcvu13p": (4, 4),
+}
+
+def _slr_layout(part):
+    for prefix, layout in _SLR_LAYOUT.items():
+        if part.startswith(prefix):
+            return layout
+    raise ValueError("SLR layout of {} unknown".format(part))
+
+def slr_of_quad(part, quad):
+    """ SLR of a GTY quad, e.g. ("xcvu9p-...", "Quad_X1Y11") -> 2 """
+    slrs, rows = _slr_layout(part)
+    return int(re.search(r"Y(\d+)$", quad).group(1)) // rows
+
+def slr_of_pads(platform, pads):
+    return slr_of_quad(platform.device, pads.platform_info['quad'])
+
+class SLRCrossing(Module):
+    """ Stream crossing from SLR `slr_from` to SLR `slr_to`
+
+    valid/data and ready each go through `stages` plain registers (no
+    enables, so they map to Laguna TX/RX flops); the registers next to the
+    die boundary are tagged for USER_SLL_REG and all are tagged with their
+    SLR, see `add_slr_constraints`. As ready arrives `stages` cycles late, a
+    small FIFO on the `slr_to` side takes the beats still in flight.
+    """
+    def __init__(self, layout, slr_from, slr_to, stages=2):
+        self.sink   = sink   = Endpoint(layout)
+        self.source = source = Endpoint(layout)
+
+        # # #
+
+        def data(ep):
+            return Cat(ep.first, ep.last, ep.payload.raw_bits(), ep.param.raw_bits())
+
+        in_flight = 2 * stages + 1
+        depth = 2**log2_int(2 * in_flight, False)
+        self.submodules.fifo = fifo = SyncFIFO(layout, depth, buffered=False)
+        self.comb += fifo.source.connect(source)
+
+        def tag(sig, i, n, near, far):
+            slr = near if i < ceil(n / 2) else far
+            sig.attr.add(("SLR_XING", "SLR{}".format(slr)))
+            sig.attr.add(("SHREG_EXTRACT", "NO"))
+            if i in [ceil(n / 2) - 1, ceil(n / 2)]:
+                sig.attr.add(("SLR_XING_SLL", "TRUE"))
+
+        # Forward: valid/data
+        valid = [Signal() for _ in range(stages)]
+        dat   = [Signal(len(data(sink)), reset_less=True) for _ in range(stages)]
+        # Backward: ready
+        ready = [Signal() for _ in range(stages)]
+        for i in range(stages):
+            tag(valid[i], i, stages, slr_from, slr_to)
+            tag(dat[i],   i, stages, slr_from, slr_to)
+            tag(ready[i], i, stages, slr_to, slr_from)
+
+        self.comb += [
+            sink.ready.eq(ready[-1]),
+            fifo.sink.valid.eq(valid[-1]),
+            data(fifo.sink).eq(dat[-1]),
+        ]
+        self.sync += [
+            valid[0].eq(sink.valid & sink.ready),
+            dat[0].eq(data(sink)),
+            ready[0].eq(fifo.level < depth - in_flight),
+        ] + [
+            valid[i].eq(valid[i - 1]) for i in range(1, stages)
+        ] + [
+            dat[i].eq(dat[i - 1]) for i in range(1, stages)
+        ] + [
+            ready[i].eq(ready[i - 1]) for i in range(1, stages)
+        ]
+
+def slr_crossing_insert(top, crossings, stages=2):
+    """ Insert an `SLRCrossing` on endpoints of a module tree
+
+    `crossings` maps endpoint paths (as in `PipelineInsert`) to
+    (slr_from, slr_to), the SLRs data leaves and enters. Endpoints that do
+    not cross (slr_from == slr_to) are left alone.
+    """
+    for path, (slr_from, slr_to) in crossings.items():
+        if slr_from == slr_to:
+            continue
+        PipelineInsert({path: 1},
+            stage=lambda layout, a=slr_from, b=slr_to: SLRCrossing(layout, a, b, stages))(top)
+
+def add_slr_constraints(platform):
+    """ Turn the SLRCrossing register tags into placement constraints """
+    platform.add_platform_command(
+        "set_property USER_SLL_REG TRUE [get_cells -quiet -hier -filter {{SLR_XING_SLL == TRUE}}]")
+    slrs, rows = _slr_layout(platform.device)
+    for slr in range(slrs):
+        platform.add_platform_command(
+            f"set_property USER_SLR_ASSIGNMENT SLR{slr} "
+            "[get_cells -quiet -hier -filter {{" f"SLR_XING == SLR{slr}" "}}]")
@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+import random
+
+from migen import *
+from litex.soc.interconnect.stream import Endpoint, EndpointDescription
+
+from util.epbuf import _SkidBuffer, PipelineInsert, frequency_budget, timing_report_budget
+
+def test_skid(n=400, p_valid=0.8, p_ready=0.7):
+    """ Beats come out in order under random valid/ready """
+    dut = _SkidBuffer(EndpointDescription([("data", 32)]))
+    out = []
+
+    def writer():
+        for i in range(n):
+            while random.random() > p_valid:
+                yield dut.sink.valid.eq(0)
+                yield
+            yield dut.sink.data.eq(i)
+            yield dut.sink.last.eq(i % 7 == 6)
+            yield dut.sink.valid.eq(1)
+            yield
+            while not (yield dut.sink.ready):
+                yield
+        yield dut.sink.valid.eq(0)
+        while len(out) < n:
+            yield
+
+    @passive
+    def reader():
+        while True:
+            yield dut.source.ready.eq(random.random() < p_ready)
+            yield
+            if (yield dut.source.valid) and (yield dut.source.ready):
+                out.append(((yield dut.source.data), (yield dut.source.last)))
+
+    run_simulation(dut, [writer(), reader()])
+    assert out == [(i, i % 7 == 6) for i in range(n)]
+
+def test_throughput(n=64):
+    """ One beat per cycle, first beat out one cycle after it went in """
+    dut = _SkidBuffer(EndpointDescription([("data", 32)]))
+    cycles = []
+
+    def gen():
+        yield dut.source.ready.eq(1)
+        yield dut.sink.valid.eq(1)
+        for i in range(n):
+            yield dut.sink.data.eq(i)
+            yield
+            assert (yield dut.sink.ready)
+        yield dut.sink.valid.eq(0)
+        for _ in range(3):
+            yield
+
+    @passive
+    def monitor():
+        cycle = 0
+        while True:
+            if (yield dut.source.valid):
+                cycles.append((cycle, (yield dut.source.data)))
+            cycle += 1
+            yield
+
+    run_simulation(dut, [gen(), monitor()])
+    assert [d for c, d in cycles] == list(range(n))
+    assert cycles[-1][0] - cycles[0][0] == n - 1
+    print("latency {} cycle, {} beats in {} cycles".format(cycles[0][0] - 1, n, cycles[-1][0] - cycles[0][0] + 1))
+
+class _Producer(Module):
+    def __init__(self):
+        self.source = Endpoint(EndpointDescription([("data", 32)]))
+        self.sync += If(self.source.ready, self.source.data.eq(self.source.data + 1))
+        self.comb += self.source.valid.eq(1)
+
+class _Consumer(Module):
+    def __init__(self):
+        self.sink = Endpoint(EndpointDescription([("data", 32)]))
+        self.ready = Signal()
+        self.comb += self.sink.ready.eq(self.ready)
+
+class _Top(Module):
+    def __init__(self):
+        self.submodules.producer = _Producer()
+        self.submodules.consumer = _Consumer()
+        self.comb += self.producer.source.connect(self.consumer.sink)
+
+def test_pipeline_insert(budget):
+    """ Connections made before the transform go through the stages """
+    top = _Top()
+    sink = top.consumer.sink
+    PipelineInsert(budget)(top)
+    out, first = [], []
+
+    def gen():
+        for cycle in range(40):
+            if (yield sink.valid) and not first:
+                first.append(cycle)
+            yield top.consumer.ready.eq(cycle % 3 != 0)
+            yield
+            if (yield sink.valid) and (yield sink.ready):
+                out.append((yield sink.data))
+
+    run_simulation(top, gen())
+    assert out == list(range(len(out)))
+    return first[0]
+
+_report = """
+Slack (VIOLATED) :        -0.212ns  (required time - arrival time)
+  Source:                 k2mm_0_packet_ptx_sink_payload_data_reg[12]/C
+  Destination:            k2mm_0_packet_ptx_fsm_state_reg/D
+
+Slack (MET) :             0.101ns  (required time - arrival time)
+  Source:                 k2mm_1_packet_prx_source_valid_reg/C
+  Destination:            k2mm_1_fifo_reg/D
+"""
+
+if __name__ == "__main__":
+    random.seed(0)
+    test_skid()
+    test_skid(p_valid=1.0, p_ready=0.5)
+    test_throughput()
+
+    first = [test_pipeline_insert({"consumer.sink": n}) for n in [0, 1, 3]]
+    assert first[1] == first[0] + 1 and first[2] == first[0] + 3
+    assert test_pipeline_insert({"producer.source": 2}) == first[0] + 2
+    assert frequency_budget(["*.sink"], 400e6) == {"*.sink": 1}
+    budget = timing_report_budget(_report, ["k2mm_*.packet.ptx.sink", "k2mm_*.packet.prx.source"])
+    assert budget == {"k2mm_*.packet.ptx.sink": 1}
+    print("pipeline insert: first beat at {}".format(first))
@@ -0,0 +1,33 @@
+#!/usr/bin/python3
+from migen import *
+from litex.soc.interconnect.stream import EndpointDescription
+
+from util.pblock import quad_clock_regions, PblockTagger
+from util.epbuf import _SkidBuffer
+
+class _Port(Module):
+    def __init__(self):
+        self.submodules.buf = _SkidBuffer(EndpointDescription([("data", 8)]))
+        self.counter = Signal(8)
+        self.sync += self.counter.eq(self.counter + 1)
+        self.specials += Instance("ip_core", name="ip_core_i", i_clk=ClockSignal())
+
+class _Top(Module):
+    def __init__(self):
+        self.submodules.port = PblockTagger("port0")(_Port())
+        self.other = Signal()
+        self.sync += self.other.eq(~self.other)
+
+if __name__ == "__main__":
+    # VCU1525 QSFP quads are in the right GTY column
+    assert quad_clock_regions("xcvu9p-fsgd2104-2l-e", ["Quad_X1Y11"]) == (4, 11, 5, 11)
+    assert quad_clock_regions("xcvu13p-flga2577-2-e", ["Quad_X0Y2", "Quad_X0Y3"], width=3) == (0, 2, 2, 3)
+
+    top = _Top()
+    top.get_fragment()
+    port = top.port
+    tagged = [port.counter, port.buf.source.valid, port.buf.source.data]
+    assert all(("PBLOCK", "port0") in s.attr for s in tagged)
+    assert ("PBLOCK", "port0") not in top.other.attr
+    instance, = [s for s in port._fragment.specials if isinstance(s, Instance)]
+    assert ("PBLOCK", "port0") in instance.attr
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+import random
+
+from migen import *
+from litex.soc.interconnect.stream import EndpointDescription
+
+from util.slr import SLRCrossing, slr_of_quad
+
+def test_crossing(n=500, stages=2, p_valid=0.9, p_ready=0.6):
+    """ In order, never overruns the receive FIFO """
+    dut = SLRCrossing(EndpointDescription([("data", 32)]), 0, 1, stages=stages)
+    out = []
+
+    def writer():
+        for i in range(n):
+            while random.random() > p_valid:
+                yield dut.sink.valid.eq(0)
+                yield
+            yield dut.sink.data.eq(i)
+            yield dut.sink.valid.eq(1)
+            yield
+            while not (yield dut.sink.ready):
+                yield
+        yield dut.sink.valid.eq(0)
+        while len(out) < n:
+            yield
+
+    @passive
+    def reader():
+        while True:
+            yield dut.source.ready.eq(random.random() < p_ready)
+            yield
+            if (yield dut.fifo.sink.valid):
+                assert (yield dut.fifo.sink.ready)
+            if (yield dut.source.valid) and (yield dut.source.ready):
+                out.append((yield dut.source.data))
+
+    run_simulation(dut, [writer(), reader()])
+    assert out == list(range(n))
+
+def test_throughput(n=100, stages=2):
+    """ One beat per cycle once ready has come back """
+    dut = SLRCrossing(EndpointDescription([("data", 32)]), 0, 1, stages=stages)
+    cycles = []
+
+    def gen():
+        yield dut.source.ready.eq(1)
+        for i in range(n):
+            yield dut.sink.data.eq(i)
+            yield dut.sink.valid.eq(1)
+            yield
+            while not (yield dut.sink.ready):
+                yield
+        yield dut.sink.valid.eq(0)
+        for _ in range(2 * stages + 2):
+            yield
+
+    @passive
+    def monitor():
+        cycle = 0
+        while True:
+            if (yield dut.source.valid):
+                cycles.append(cycle)
+            cycle += 1
+            yield
+
+    run_simulation(dut, [gen(), monitor()])
+    assert len(cycles) == n and cycles[-1] - cycles[0] == n - 1
+    print("{} stages: first beat at cycle {}, {} beats in {} cycles".format(
+        stages, cycles[0], n, cycles[-1] - cycles[0] + 1))
+
+if __name__ == "__main__":
+    random.seed(0)
+    for stages in [1, 2, 3]:
+        test_crossing(stages=stages)
+        test_crossing(stages=stages, p_valid=1.0, p_ready=0.3)
+        test_throughput(stages=stages)
+    # VCU1525 QSFP quads are in SLR2, Trefoil quads spread over all four SLRs
+    assert slr_of_quad("xcvu9p-fsgd2104-2l-e", "Quad_X1Y11") == 2
+    assert [slr_of_quad("xcvu13p-flga2577-2-e", "Quad_X0Y{}".format(y)) for y in [0, 4, 11, 15]] == [0, 1, 2, 3]
@@ -16,7 +16,7 @@ from litex.soc.cores.led import LedChaser
 
 # Local source
 from litex_boards.platforms.xilinx_vcu1525 import Platform
-from cores.kyokko.aurora import Aurora64b66b
+from cores.kyokko.ports import add_link_ports, vcu1525_ports
 from util.reset import XilinxStartupReset
 from localbuilder import LocalBuilder
 
@@ -152,7 +152,7 @@ class _CRG(Module):
         self.submodules += USIDELAYCTRL(cd_ref=self.cd_idelay, cd_sys=self.cd_sys)
 
 class BaseSoC(SoCCore):
-    def __init__(self, sys_clk_freq=int(200e6), disable_sdram=False, use_clkwiz = False, **kwargs):
+    def __init__(self, sys_clk_freq=int(200e6), disable_sdram=False, use_clkwiz = False, aurora_streaming=False, with_eyescan=False, deep_buffer_depth=0, auto_pipeline=False, k2mm_slr=None, with_pblocks=False, k2mm_buffer_mode="cut-through", k2mm_fifo_depth=256, **kwargs):
         platform = Platform()
 
         SoCCore.__init__(self, platform, sys_clk_freq,
@@ -174,41 +174,56 @@ class BaseSoC(SoCCore):
             pads         = platform.request_all("user_led"),
             sys_clk_freq = sys_clk_freq)
         
-        self._add_aurora(platform)
-
-    def _add_aurora(self, platform):
-        from cores.tf.framing import K2MMControl, K2MM
-        # Port #1
-        self.submodules.ky_0 = kyokko = Aurora64b66b(
-            platform,
-            platform.request("qsfp", 0),
-            platform.request("qsfp0_refclk1"),
-            cd_freerun="clk100",
-        )
-        self.submodules.k2mm_0 = k2mm = K2MM(dw=256)
-        self.comb += [
-            kyokko.init_clk_locked.eq(self.crg.locked),
-            kyokko.source_user_rx.connect(k2mm.sink_packet_rx, omit={"last_be", "error", "src_port", "dst_port", "ip_address", "length"}),
-            k2mm.source_packet_tx.connect(kyokko.sink_user_tx, omit={"last_be", "error", "src_port", "dst_port", "ip_address", "length"}),
-        ]
-        self.submodules.k2mmctrl_0 = k2mmctrl_0 = K2MMControl(k2mm, dw=256)
-        self.comb += k2mmctrl_0.source_ctrl.connect(k2mm.sink_tester_ctrl)
-
-        self.submodules.ky_1 = ky1 = Aurora64b66b(
-            platform, 
-            platform.request("qsfp", 1),
-            platform.request("qsfp1_refclk1"),
-            cd_freerun="clk100",
-            with_ila=False
-        )
-        self.submodules.k2mm_1 = k2mm_1 = K2MM(dw=256)
-        self.comb += [
-            ky1.init_clk_locked.eq(self.crg.locked),
-            ky1.source_user_rx.connect(k2mm_1.sink_packet_rx, omit={"last_be", "error", "src_port", "dst_port", "ip_address", "length"}),
-            k2mm_1.source_packet_tx.connect(ky1.sink_user_tx, omit={"last_be", "error", "src_port", "dst_port", "ip_address", "length"}),
-        ]
-        self.submodules.k2mmctrl_1 = k2mmctrl_1 = K2MMControl(k2mm_1, dw=256)
-        self.comb += k2mmctrl_1.source_ctrl.connect(k2mm_1.sink_tester_ctrl)
+        if k2mm_buffer_mode == "store-and-forward" and not k2mm_fifo_depth:
+            raise ValueError("Store-and-forward needs a K2MM FIFO")
+        self._add_aurora(platform, aurora_streaming, with_eyescan, deep_buffer_depth,
+            k2mm_kwargs=dict(buffer_mode=k2mm_buffer_mode, bufferrized=k2mm_fifo_depth != 0,
+                fifo_depth=k2mm_fifo_depth))
+
+        # Pipeline the wide K2MM paths for sys_clk_freq
+        if auto_pipeline:
+            from util.epbuf import PipelineInsert, frequency_budget
+            PipelineInsert(frequency_budget([
+                "k2mm_*.packet.ptx.sink",
+                "k2mm_*.packet.prx.source",
+                "k2mm_*.sink_packet_rx",
+                "k2mm_*.source_packet_tx",
+            ], sys_clk_freq))(self)
+
+        # K2MM in another SLR than the QSFP quads: register the crossings
+        if k2mm_slr is not None:
+            from util.slr import slr_crossing_insert, slr_of_pads, add_slr_constraints
+            crossings = {}
+            for n, port in enumerate(self.link_ports):
+                quad_slr = slr_of_pads(platform, port.pads)
+                crossings["k2mm_{}.sink_packet_rx".format(n)]   = (quad_slr, k2mm_slr)
+                crossings["k2mm_{}.source_packet_tx".format(n)] = (k2mm_slr, quad_slr)
+            slr_crossing_insert(self, crossings)
+            add_slr_constraints(platform)
+
+        # Keep each port's Aurora (with its CDC FIFOs) and K2MM next to its quad
+        if with_pblocks:
+            from util.pblock import add_port_pblock
+            for n, port in enumerate(self.link_ports):
+                modules = [port.link]
+                if k2mm_slr is None:
+                    modules += [port.k2mm]
+                add_port_pblock(platform, "port{}".format(n), modules, port.pads)
+
+    def _add_aurora(self, platform, streaming=False, with_eyescan=False, deep_buffer_depth=0, k2mm_kwargs=None):
+        self.link_ports = ports = add_link_ports(self, platform, vcu1525_ports(),
+            locked=self.crg.locked, link_kwargs=dict(streaming=streaming),
+            k2mm_kwargs=dict(link_mode="streaming" if streaming else "framing",
+                deep_buffer_depth=deep_buffer_depth, **(k2mm_kwargs or {})))
+
+        # DRP access to all lanes of both ports
+        from cores.kyokko.drp import DRPControl
+        drp_ports = sum([p.link.drp for p in ports], [])
+        self.submodules.gt_drp = gt_drp = DRPControl(drp_ports, cd="clk100",
+            masters=len(drp_ports) if with_eyescan else 0)
+        if with_eyescan:
+            from cores.kyokko.eyescan import EyeScan
+            self.submodules.eyescan = EyeScan(gt_drp, range(len(drp_ports)), cd="clk100")
 
         from cores.qsfp_sideband import QSFPSidebandRegister
         self.submodules.qsfp0_ls = QSFPSidebandRegister(platform.request("qsfp_ls", 0))
@@ -225,6 +240,14 @@ def main():
     parser.add_argument("--disable-sdram",  action="store_true", help="Build without onboard memory controller. (default: false)")
     parser.add_argument("--sys-clk-freq",   default=400e6,       help="System clock frequency (default: 300MHz)")
     parser.add_argument("--use-clkwiz",     action="store_true", help="Generate CRG(Clock Reset Generator) with Xilinx Clocking Wizard IP. (default: false)")
+    parser.add_argument("--aurora-streaming", action="store_true", help="Use Aurora streaming mode, K2MM delimits frames. (default: false)")
+    parser.add_argument("--with-eyescan",   action="store_true", help="Add the in-system eye scan engine on all GTY lanes. (default: false)")
+    parser.add_argument("--auto-pipeline",  action="store_true", help="Insert skid buffers on the K2MM paths according to --sys-clk-freq. (default: false)")
+    parser.add_argument("--k2mm-slr",       default=None, type=int, help="SLR of the K2MM datapath, adds SLR crossing stages to the QSFP ports. (default: none)")
+    parser.add_argument("--with-pblocks",   action="store_true", help="Place each port's Aurora/K2MM in a pblock next to its GTY quad. (default: false)")
+    parser.add_argument("--k2mm-buffer-mode", default="cut-through", choices=["cut-through", "store-and-forward"], help="K2MM link-side buffering. (default: cut-through)")
+    parser.add_argument("--k2mm-fifo-depth", default=256, type=int, help="K2MM link-side FIFO depth [beats], 0 = no FIFO (cut-through only). (default: 256)")
+    parser.add_argument("--deep-buffer-depth", default=0, type=int, help="Add UltraRAM link buffers of this many 256-bit beats to each K2MM, e.g. 16384 for 4 Mbit. (default: 0 = none)")
     
     builder_args(parser)
     soc_core_args(parser)
@@ -234,6 +257,14 @@ def main():
         disable_sdram = True if args.disable_sdram else False,
         sys_clk_freq = int(float(args.sys_clk_freq)),
         use_clkwiz   = args.use_clkwiz,
+        aurora_streaming = args.aurora_streaming,
+        with_eyescan     = args.with_eyescan,
+        deep_buffer_depth = args.deep_buffer_depth,
+        auto_pipeline    = args.auto_pipeline,
+        k2mm_slr         = args.k2mm_slr,
+        with_pblocks     = args.with_pblocks,
+        k2mm_buffer_mode = args.k2mm_buffer_mode,
+        k2mm_fifo_depth  = args.k2mm_fifo_depth,
         **soc_core_argdict(args)
     )
 
@@ -5,6 +5,7 @@ import argparse
 
 from migen import *
 from migen.genlib.resetsync import AsyncResetSynchronizer
+from migen.genlib.cdc import MultiReg
 from migen.fhdl.structure import Cat
 from litex_boards.platforms.xilinx_vcu1525 import Platform
 from litex.soc.cores.clock import *
@@ -21,6 +22,8 @@ from localbuilder import LocalBuilder
 
 from cores.kyokko.phy.phy_usp_gty import USPGTY4
 from cores.kyokko.kyokko import KyokkoBlock
+from cores.kyokko.adapter import k2mm_to_link, link_to_k2mm
+from cores.kyokko.ports import add_link_ports, vcu1525_ports
 from cores.tf.framing import K2MMBlock
 from litex.soc.cores.clock.common import *
 from litex.soc.cores.clock.xilinx_common import *
@@ -79,7 +82,7 @@ class _MMCMReset(Module):
         ]
 
 class _CRG(Module):
-    def __init__(self, platform : Platform, sys_clk_freq):
+    def __init__(self, platform : Platform, sys_clk_freq, dp_clk_freq=None):
         self.rst = Signal()
         self.clock_domains.cd_sys    = ClockDomain()
         self.clock_domains.cd_sys4x  = ClockDomain(reset_less=True)
@@ -105,18 +108,29 @@ class _CRG(Module):
         pll.register_clkin(platform.request("sys_clk", 1), 300e6)
         pll.create_clkout(self.cd_pll4x, sys_clk_freq * 4, buf=None, with_reset=False)
         pll.create_clkout(self.cd_idelay, sys_clk_freq * 2)
+        if dp_clk_freq is not None:
+            # Datapath (K2MM) clock, independent of the CPU
+            self.clock_domains.cd_dp = ClockDomain()
+            # No clock-group false path: the sys/dp synchronizers carry their own
+            # constraints (XPM CDC, mr_ff on MultiReg), any other crossing must fail timing
+            pll.create_clkout(self.cd_dp, dp_clk_freq)
 
         platform.add_false_path_constraints(self.cd_sys.clk, pll.clkin) # Ignore sys_clk to pll.clkin path created by SoC's rst.
         platform.add_false_path_constraints(self.cd_sys.clk, pll.clkin)
         
         self.comb += pll.reset.eq(self.rst)
+
+        # clk100 from idelay (2 * sys_clk_freq), also with a slower CPU
+        clk100_div = int(sys_clk_freq * 2 // 100e6)
+        if clk100_div * 100e6 != sys_clk_freq * 2 or not 1 <= clk100_div <= 8:
+            raise ValueError("clk100 cannot be derived from sys_clk_freq {}".format(sys_clk_freq))
         
         self.specials += [
             Instance("BUFGCE_DIV", name="buf_pll4x",
                 p_BUFGCE_DIVIDE=4,
                 i_CE=1, i_I=self.cd_pll4x.clk, o_O=self.cd_sys.clk),
             Instance("BUFGCE_DIV", name="buf_clk100",
-                p_BUFGCE_DIVIDE=6,
+                p_BUFGCE_DIVIDE=clk100_div,
                 i_CE=1, i_I=self.cd_idelay.clk, o_O=self.cd_clk100.clk),
             AsyncResetSynchronizer(self.cd_clk100, self.cd_sys.rst),
             Instance("BUFGCE", name="buf_sys",
@@ -126,7 +140,7 @@ class _CRG(Module):
         self.submodules+= USIDELAYCTRL(cd_ref=self.cd_idelay, cd_sys=self.cd_sys)
 
 class BaseSoC(SoCCore):
-    def __init__(self, sys_clk_freq=int(200e6), disable_sdram=False, **kwargs):
+    def __init__(self, sys_clk_freq=int(200e6), disable_sdram=False, with_lag=False, dp_clk_freq=None, **kwargs):
         platform = Platform()
 
         SoCCore.__init__(self, platform, sys_clk_freq,
@@ -135,7 +149,7 @@ class BaseSoC(SoCCore):
             cpu_type       = "vexriscv",
             **kwargs)
 
-        self.submodules.crg = _CRG(platform, sys_clk_freq)
+        self.submodules.crg = _CRG(platform, sys_clk_freq, dp_clk_freq)
 
         if not disable_sdram:
             if not self.integrated_main_ram_size:
@@ -156,45 +170,31 @@ class BaseSoC(SoCCore):
             pads         = platform.request_all("user_led"),
             sys_clk_freq = sys_clk_freq)
         
-        self._add_kyokko(platform)
+        self._add_kyokko(platform, with_lag, cd="sys" if dp_clk_freq is None else "dp")
 
-    def _add_kyokko(self, platform):
+    def _add_kyokko(self, platform, with_lag=False, cd="sys"):
         from cores.tf.framing import K2MMControl, K2MM
-        #
-        # Port #1
-        #
-        self.submodules.ky_0 = kyokko = KyokkoBlock(
-            platform, 
-            platform.request("qsfp", 0),
-            platform.request("qsfp0_refclk1"),
-            cd_freerun="clk100"
-        )
-        self.submodules.k2mm_0 = k2mm = K2MM(dw=256)
-        self.comb += [
-            kyokko.init_clk_locked.eq(self.crg.pll.locked),
-            kyokko.source_user_rx.connect(k2mm.sink_packet_rx, omit={"last_be", "error", "src_port", "dst_port", "ip_address", "length"}),
-            k2mm.source_packet_tx.connect(kyokko.sink_user_tx, omit={"last_be", "error", "src_port", "dst_port", "ip_address", "length"}),
-        ]
-        self.submodules.k2mmctrl_0 = k2mmctrl_0 = K2MMControl(k2mm, dw=256)
-        self.comb += k2mmctrl_0.source_ctrl.connect(k2mm.sink_tester_ctrl)
-        
-        #
-        # Port #2
-        #
-        self.submodules.ky_1 = ky1 = KyokkoBlock(
-            platform, 
-            platform.request("qsfp", 1),
-            kyokko.get_refclk(),
-            cd_freerun="clk100"
-        )
-        self.submodules.k2mm_1 = k2mm_1 = K2MM(dw=256)
-        self.comb += [
-            ky1.init_clk_locked.eq(self.crg.pll.locked),
-            ky1.source_user_rx.connect(k2mm_1.sink_packet_rx, omit={"last_be", "error", "src_port", "dst_port", "ip_address", "length"}),
-            k2mm_1.source_packet_tx.connect(ky1.sink_user_tx, omit={"last_be", "error", "src_port", "dst_port", "ip_address", "length"}),
-        ]
-        self.submodules.k2mmctrl_1 = k2mmctrl_1 = K2MMControl(k2mm_1, dw=256)
-        self.comb += k2mmctrl_1.source_ctrl.connect(k2mm_1.sink_tester_ctrl)
+        # Both ports run from the reference clock of port #1
+        specs = [spec._replace(refclk=("qsfp0_refclk1", 0)) for spec in vcu1525_ports()]
+        ports = add_link_ports(self, platform, specs, phy="kyokko", cd=cd,
+            locked=self.crg.pll.locked, with_k2mm=not with_lag)
+        if with_lag:
+            # Both ports carry the stream of k2mm_0
+            from cores.tf.lag import K2MMLinkAggregator
+            self.submodules.k2mm_0 = k2mm = ClockDomainsRenamer(cd)(K2MM(dw=256))
+            self.submodules.k2mmctrl_0 = k2mmctrl_0 = K2MMControl(k2mm, dw=256, cd=cd)
+            self.submodules.lag = lag = K2MMLinkAggregator(dw=256, links=len(ports), cd=cd)
+            self.comb += [
+                k2mmctrl_0.source_ctrl.connect(k2mm.sink_tester_ctrl),
+                k2mm.source_packet_tx.connect(lag.sink),
+                lag.source.connect(k2mm.sink_packet_rx),
+            ]
+            self.specials += MultiReg(Cat(*[p.link._status.fields.channel_up for p in ports]), lag.link_status, odomain=cd)
+            for p, source, sink in zip(ports, lag.sources, lag.sinks):
+                self.comb += [
+                    link_to_k2mm(p.link.source_user_rx, sink),
+                    k2mm_to_link(source, p.link.sink_user_tx),
+                ]
         KyokkoBlock.add_common_timing_constraints(platform)
 
 def main():
@@ -203,6 +203,8 @@ def main():
     parser.add_argument("--load",         action="store_true", help="Load bitstream")
     parser.add_argument("--sys-clk-freq", default=300e6,       help="System clock frequency (default: 300MHz)")
     parser.add_argument("--disable_sdram", action="store_true", help="Build without onboard memory controller (default: false)")
+    parser.add_argument("--dp-clk-freq", default=None,        help="K2MM datapath clock frequency, e.g. 400e6 (default: sys clock)")
+    parser.add_argument("--with-lag",     action="store_true", help="Aggregate both QSFP ports into one K2MM link")
     builder_args(parser)
     soc_core_args(parser)
     args = parser.parse_args()
@@ -210,6 +212,8 @@ def main():
     soc = BaseSoC(
         disable_sdram = True if args.disable_sdram else False,
         sys_clk_freq = int(float(args.sys_clk_freq)),
+        with_lag     = args.with_lag,
+        dp_clk_freq  = None if args.dp_clk_freq is None else int(float(args.dp_clk_freq)),
         **soc_core_argdict(args)
     )
 